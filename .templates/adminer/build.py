@@ -11,11 +11,13 @@ def main():
   import ruamel.yaml
   import signal
   import sys
-  from blessed import Terminal
+  from deps.render import getTerminal
+  from deps.menu_engine import Menu, optionsMenuControls
   
   from deps.chars import specialChars, commonTopBorder, commonBottomBorder, commonEmptyLine, padText
   from deps.consts import servicesDirectory, templatesDirectory
-  from deps.common_functions import getExternalPorts, getInternalPorts, checkPortConflicts, enterPortNumberWithWhiptail
+  from deps.common_functions import getExternalPorts, getInternalPorts, enterPortNumberWithWhiptail
+  from deps.port_registry import getPortConflicts
 
   yaml = ruamel.yaml.YAML()
   yaml.preserve_quotes = True
@@ -94,12 +96,9 @@ def main():
   # #####################################
 
   def checkForIssues():
-    for (index, serviceName) in enumerate(dockerComposeServicesYaml):
-      if not currentServiceName == serviceName: # Skip self
-        currentServicePorts = getExternalPorts(currentServiceName, dockerComposeServicesYaml)
-        portConflicts = checkPortConflicts(serviceName, currentServicePorts, dockerComposeServicesYaml)
-        if (len(portConflicts) > 0):
-          issues["portConflicts"] = portConflicts
+    portConflicts = getPortConflicts(currentServiceName, dockerComposeServicesYaml)
+    if (len(portConflicts) > 0):
+      issues["portConflicts"] = portConflicts
 
   # #####################################
   # End Supporting functions
@@ -109,28 +108,15 @@ def main():
   # Menu Logic
   ############################
 
-  global currentMenuItemIndex
-  global selectionInProgress
-  global menuNavigateDirection
-  global needsRender
-
-  selectionInProgress = True
-  currentMenuItemIndex = 0
-  menuNavigateDirection = 0
-  needsRender = 1
-  term = Terminal()
+  term = getTerminal()
   hotzoneLocation = [((term.height // 16) + 6), 0]
 
   def goBack():
-    global selectionInProgress
-    global needsRender
-    selectionInProgress = False
-    needsRender = 1
+    optionsMenu.close()
     return True
 
   def enterPortNumberExec():
     # global term
-    global needsRender
     global dockerComposeServicesYaml
     externalPort = getExternalPorts(currentServiceName, dockerComposeServicesYaml)[0]
     internalPort = getInternalPorts(currentServiceName, dockerComposeServicesYaml)[0]
@@ -142,12 +128,6 @@ def main():
         oldIntPort = internalPort
       )
       createMenu()
-    needsRender = 1
-
-  def onResize(sig, action):
-    global adminerBuildOptions
-    global currentMenuItemIndex
-    mainRender(1, adminerBuildOptions, currentMenuItemIndex)
 
   adminerBuildOptions = []
 
@@ -164,134 +144,25 @@ def main():
       pass
     adminerBuildOptions.append(["Go back", goBack])
 
-  def runOptionsMenu():
-    createMenu()
-    menuEntryPoint()
-    return True
-
-  def renderHotZone(term, menu, selection, hotzoneLocation):
-    lineLengthAtTextStart = 71
-    print(term.move(hotzoneLocation[0], hotzoneLocation[1]))
-    for (index, menuItem) in enumerate(menu):
-      toPrint = ""
-      if index == selection:
-        toPrint += ('{bv} -> {t.blue_on_green} {title} {t.normal} <-'.format(t=term, title=menuItem[0], bv=specialChars[renderMode]["borderVertical"]))
-      else:
-        toPrint += ('{bv}    {t.normal} {title}    '.format(t=term, title=menuItem[0], bv=specialChars[renderMode]["borderVertical"]))
-
-      for i in range(lineLengthAtTextStart - len(menuItem[0])):
-        toPrint += " "
-
-      toPrint += "{bv}".format(bv=specialChars[renderMode]["borderVertical"])
-
-      toPrint = term.center(toPrint)
-
-      print(toPrint)
-
-  def mainRender(needsRender, menu, selection):
-    term = Terminal()
-    
-    if needsRender == 1:
-      print(term.clear())
-      print(term.move_y(term.height // 16))
-      print(term.black_on_cornsilk4(term.center('IOTstack Adminer Options')))
-      print("")
-      print(term.center(commonTopBorder(renderMode)))
-      print(term.center(commonEmptyLine(renderMode)))
-      print(term.center("{bv}      Select Option to configure                                                {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-      print(term.center(commonEmptyLine(renderMode)))
-
-    if needsRender >= 1:
-      renderHotZone(term, menu, selection, hotzoneLocation)
-
-    if needsRender == 1:
-      print(term.center(commonEmptyLine(renderMode)))
-      print(term.center(commonEmptyLine(renderMode)))
-      if not hideHelpText:
-        print(term.center(commonEmptyLine(renderMode)))
-        print(term.center("{bv}      Controls:                                                                 {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center("{bv}      [Up] and [Down] to move selection cursor                                  {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center("{bv}      [H] Show/hide this text                                                   {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center("{bv}      [Enter] to run command or save input                                      {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center("{bv}      [Escape] to go back to build stack menu                                   {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center(commonEmptyLine(renderMode)))
-        if len(documentationHint) > 1:
-          if len(documentationHint) > 56:
-            documentationAndPadding = padText(documentationHint, 71)
-            print(term.center("{bv}      Documentation:                                                            {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-            print(term.center("{bv}        {dap} {bv}".format(bv=specialChars[renderMode]["borderVertical"], dap=documentationAndPadding)))
-          else:
-            documentationAndPadding = padText(documentationHint, 56)
-            print(term.center("{bv}        Documentation: {dap} {bv}".format(bv=specialChars[renderMode]["borderVertical"], dap=documentationAndPadding)))
-          print(term.center(commonEmptyLine(renderMode)))
-      print(term.center(commonEmptyLine(renderMode)))
-      print(term.center(commonBottomBorder(renderMode)))
-
-  def runSelection(selection):
-    import types
+  def getOptionsMenuItems():
     global adminerBuildOptions
-    if len(adminerBuildOptions[selection]) > 1 and isinstance(adminerBuildOptions[selection][1], types.FunctionType):
-      adminerBuildOptions[selection][1]()
-    else:
-      print(term.green_reverse('IOTstack Error: No function assigned to menu item: "{}"'.format(nodeRedBuildOptions[selection][0])))
+    return adminerBuildOptions
 
-  def isMenuItemSelectable(menu, index):
-    if len(menu) > index:
-      if len(menu[index]) > 2:
-        if menu[index][2]["skip"] == True:
-          return False
-    return True
-
-  def menuEntryPoint():
-    # These need to be reglobalised due to eval()
-    global currentMenuItemIndex
-    global selectionInProgress
-    global menuNavigateDirection
-    global needsRender
+  def runOptionsMenu():
     global hideHelpText
-    global adminerBuildOptions
-    term = Terminal()
-    with term.fullscreen():
-      menuNavigateDirection = 0
-      mainRender(needsRender, adminerBuildOptions, currentMenuItemIndex)
-      selectionInProgress = True
-      with term.cbreak():
-        while selectionInProgress:
-          menuNavigateDirection = 0
-
-          if needsRender: # Only rerender when changed to prevent flickering
-            mainRender(needsRender, adminerBuildOptions, currentMenuItemIndex)
-            needsRender = 0
-          key = term.inkey(esc_delay=0.05)
-          if key.is_sequence:
-            if key.name == 'KEY_TAB':
-              menuNavigateDirection += 1
-            if key.name == 'KEY_DOWN':
-              menuNavigateDirection += 1
-            if key.name == 'KEY_UP':
-              menuNavigateDirection -= 1
-            if key.name == 'KEY_LEFT':
-              goBack()
-            if key.name == 'KEY_ENTER':
-              runSelection(currentMenuItemIndex)
-            if key.name == 'KEY_ESCAPE':
-              return True
-          elif key:
-            if key == 'h': # H pressed
-              if hideHelpText:
-                hideHelpText = False
-              else:
-                hideHelpText = True
-              mainRender(1, adminerBuildOptions, currentMenuItemIndex)
-
-          if menuNavigateDirection != 0: # If a direction was pressed, find next selectable item
-            currentMenuItemIndex += menuNavigateDirection
-            currentMenuItemIndex = currentMenuItemIndex % len(adminerBuildOptions)
-            needsRender = 2
-
-            while not isMenuItemSelectable(adminerBuildOptions, currentMenuItemIndex):
-              currentMenuItemIndex += menuNavigateDirection
-              currentMenuItemIndex = currentMenuItemIndex % len(adminerBuildOptions)
+    global optionsMenu
+    createMenu()
+    optionsMenu = Menu(
+      'IOTstack Adminer Options',
+      getOptionsMenuItems,
+      renderMode,
+      controls=optionsMenuControls,
+      documentationHint=documentationHint,
+      hideHelpText=hideHelpText,
+      leftGoesBack=True
+    )
+    optionsMenu.run()
+    hideHelpText = optionsMenu.hideHelpText
     return True
 
   ####################
@@ -9,13 +9,15 @@ def main():
   import os
   import time
   import ruamel.yaml
-  import signal
   import sys
-  from blessed import Terminal
+  from deps.render import getTerminal
+  from deps.menu_engine import Menu, optionsMenuControls, formatNoticeLine
+  from deps.hook_loader import loadHookCode
   
   from deps.chars import specialChars, commonTopBorder, commonBottomBorder, commonEmptyLine
   from deps.consts import servicesDirectory, templatesDirectory, buildSettingsFileName, buildCache, servicesFileName
-  from deps.common_functions import getExternalPorts, getInternalPorts, checkPortConflicts, enterPortNumberWithWhiptail, generateRandomString
+  from deps.common_functions import getExternalPorts, getInternalPorts, enterPortNumberWithWhiptail, generateRandomString
+  from deps.port_registry import getPortConflicts
 
   yaml = ruamel.yaml.YAML()
   yaml.preserve_quotes = True
@@ -200,12 +202,9 @@ def main():
     fileIssues = checkFiles()
     if (len(fileIssues) > 0):
       issues["fileIssues"] = fileIssues
-    for (index, serviceName) in enumerate(dockerComposeServicesYaml):
-      if not currentServiceName == serviceName: # Skip self
-        currentServicePorts = getExternalPorts(currentServiceName, dockerComposeServicesYaml)
-        portConflicts = checkPortConflicts(serviceName, currentServicePorts, dockerComposeServicesYaml)
-        if (len(portConflicts) > 0):
-          issues["portConflicts"] = portConflicts
+    portConflicts = getPortConflicts(currentServiceName, dockerComposeServicesYaml)
+    if (len(portConflicts) > 0):
+      issues["portConflicts"] = portConflicts
 
   def checkFiles():
     fileIssues = []
@@ -221,31 +220,17 @@ def main():
   # Menu Logic
   ############################
 
-  global currentMenuItemIndex
-  global selectionInProgress
-  global menuNavigateDirection
-  global needsRender
-
-  selectionInProgress = True
-  currentMenuItemIndex = 0
-  menuNavigateDirection = 0
-  needsRender = 1
-  term = Terminal()
+  term = getTerminal()
   hotzoneLocation = [((term.height // 16) + 6), 0]
 
   def goBack():
-    global selectionInProgress
-    global needsRender
-    selectionInProgress = False
-    needsRender = 1
+    optionsMenu.close()
     return True
 
   def selectDeconzHardware():
-    global needsRender
     global hasRebuiltHardwareSelection
     deconzSelectHardwareFilePath = "./.templates/deconz/select_hw.py"
-    with open(deconzSelectHardwareFilePath, "rb") as pythonDynamicImportFile:
-      code = compile(pythonDynamicImportFile.read(), deconzSelectHardwareFilePath, "exec")
+    code = loadHookCode(deconzSelectHardwareFilePath) # Compiled once, see deps/hook_loader.py
     # execGlobals = globals()
     # execLocals = locals()
     execGlobals = {
@@ -253,19 +238,14 @@ def main():
       "renderMode": renderMode
     }
     execLocals = {}
-    screenActive = False
     exec(code, execGlobals, execLocals)
-    signal.signal(signal.SIGWINCH, onResize)
     try:
       hasRebuiltHardwareSelection = execGlobals["hasRebuiltHardwareSelection"]
     except:
       hasRebuiltHardwareSelection = False
-    screenActive = True
-    needsRender = 1
 
   def enterPortNumberExec():
     # global term
-    global needsRender
     global dockerComposeServicesYaml
     externalPort = getExternalPorts(currentServiceName, dockerComposeServicesYaml)[0]
     internalPort = getInternalPorts(currentServiceName, dockerComposeServicesYaml)[0]
@@ -277,29 +257,17 @@ def main():
         oldIntPort = internalPort
       )
       createMenu()
-    needsRender = 1
 
   def setPasswordOptions():
-    global needsRender
     global hasRebuiltAddons
     passwordOptionsMenuFilePath = "./.templates/{currentService}/passwords.py".format(currentService=currentServiceName)
-    with open(passwordOptionsMenuFilePath, "rb") as pythonDynamicImportFile:
-      code = compile(pythonDynamicImportFile.read(), passwordOptionsMenuFilePath, "exec")
+    code = loadHookCode(passwordOptionsMenuFilePath) # Compiled once, see deps/hook_loader.py
     execGlobals = {
       "currentServiceName": currentServiceName,
       "renderMode": renderMode
     }
     execLocals = {}
-    screenActive = False
     exec(code, execGlobals, execLocals)
-    signal.signal(signal.SIGWINCH, onResize)
-    screenActive = True
-    needsRender = 1
-
-  def onResize(sig, action):
-    global deconzBuildOptions
-    global currentMenuItemIndex
-    mainRender(1, deconzBuildOptions, currentMenuItemIndex)
 
   deconzBuildOptions = []
 
@@ -328,135 +296,32 @@ def main():
 
     deconzBuildOptions.append(["Go back", goBack])
 
-  def runOptionsMenu():
-    createMenu()
-    menuEntryPoint()
-    return True
-
-  def renderHotZone(term, menu, selection, hotzoneLocation):
-    lineLengthAtTextStart = 71
-    print(term.move(hotzoneLocation[0], hotzoneLocation[1]))
-    for (index, menuItem) in enumerate(menu):
-      toPrint = ""
-      if index == selection:
-        toPrint += ('{bv} -> {t.blue_on_green} {title} {t.normal} <-'.format(t=term, title=menuItem[0], bv=specialChars[renderMode]["borderVertical"]))
-      else:
-        toPrint += ('{bv}    {t.normal} {title}    '.format(t=term, title=menuItem[0], bv=specialChars[renderMode]["borderVertical"]))
-
-      for i in range(lineLengthAtTextStart - len(menuItem[0])):
-        toPrint += " "
-
-      toPrint += "{bv}".format(bv=specialChars[renderMode]["borderVertical"])
-
-      toPrint = term.center(toPrint)
-
-      print(toPrint)
-
-  def mainRender(needsRender, menu, selection):
-    global hasRebuiltHardwareSelection
-    term = Terminal()
-    
-    if needsRender == 1:
-      print(term.clear())
-      print(term.move_y(term.height // 16))
-      print(term.black_on_cornsilk4(term.center('IOTstack DeConz Options')))
-      print("")
-      print(term.center(commonTopBorder(renderMode)))
-      print(term.center(commonEmptyLine(renderMode)))
-      print(term.center("{bv}      Select Option to configure                                                {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-      print(term.center(commonEmptyLine(renderMode)))
-
-    if needsRender >= 1:
-      renderHotZone(term, menu, selection, hotzoneLocation)
-
-    if needsRender == 1:
-      if os.path.exists("{buildSettings}".format(buildSettings=buildSettings)):
-        if hasRebuiltHardwareSelection:
-          print(term.center(commonEmptyLine(renderMode)))
-          print(term.center('{bv}      {t.grey_on_blue4} {text} {t.normal}{t.white_on_black}{t.normal}                      {bv}'.format(t=term, text="Hardware list has been rebuilt: build_settings.yml", bv=specialChars[renderMode]["borderVertical"])))
-        else:
-          print(term.center(commonEmptyLine(renderMode)))
-          print(term.center('{bv}      {t.grey_on_blue4} {text} {t.normal}{t.white_on_black}{t.normal}             {bv}'.format(t=term, text="Using existing build_settings.yml for hardware installation", bv=specialChars[renderMode]["borderVertical"])))
-      else:
-        print(term.center(commonEmptyLine(renderMode)))
-        print(term.center(commonEmptyLine(renderMode)))
-      if not hideHelpText:
-        print(term.center(commonEmptyLine(renderMode)))
-        print(term.center("{bv}      Controls:                                                                 {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center("{bv}      [Up] and [Down] to move selection cursor                                  {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center("{bv}      [H] Show/hide this text                                                   {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center("{bv}      [Enter] to run command or save input                                      {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center("{bv}      [Escape] to go back to build stack menu                                   {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center(commonEmptyLine(renderMode)))
-      print(term.center(commonEmptyLine(renderMode)))
-      print(term.center(commonBottomBorder(renderMode)))
-
-  def runSelection(selection):
-    import types
+  def getOptionsMenuItems():
     global deconzBuildOptions
-    if len(deconzBuildOptions[selection]) > 1 and isinstance(deconzBuildOptions[selection][1], types.FunctionType):
-      deconzBuildOptions[selection][1]()
-    else:
-      print(term.green_reverse('IOTstack Error: No function assigned to menu item: "{}"'.format(nodeRedBuildOptions[selection][0])))
+    return deconzBuildOptions
 
-  def isMenuItemSelectable(menu, index):
-    if len(menu) > index:
-      if len(menu[index]) > 2:
-        if menu[index][2]["skip"] == True:
-          return False
-    return True
+  def getOptionsMenuStatus():
+    if os.path.exists("{buildSettings}".format(buildSettings=buildSettings)):
+      if hasRebuiltHardwareSelection:
+        return [formatNoticeLine("Hardware list has been rebuilt: build_settings.yml", renderMode, term.width)]
+      return [formatNoticeLine("Using existing build_settings.yml for hardware installation", renderMode, term.width)]
+    return [None]
 
-  def menuEntryPoint():
-    # These need to be reglobalised due to eval()
-    global currentMenuItemIndex
-    global selectionInProgress
-    global menuNavigateDirection
-    global needsRender
+  def runOptionsMenu():
     global hideHelpText
-    global deconzBuildOptions
-    term = Terminal()
-    with term.fullscreen():
-      menuNavigateDirection = 0
-      mainRender(needsRender, deconzBuildOptions, currentMenuItemIndex)
-      selectionInProgress = True
-      with term.cbreak():
-        while selectionInProgress:
-          menuNavigateDirection = 0
-
-          if needsRender: # Only rerender when changed to prevent flickering
-            mainRender(needsRender, deconzBuildOptions, currentMenuItemIndex)
-            needsRender = 0
-
-          key = term.inkey(esc_delay=0.05)
-          if key.is_sequence:
-            if key.name == 'KEY_TAB':
-              menuNavigateDirection += 1
-            if key.name == 'KEY_DOWN':
-              menuNavigateDirection += 1
-            if key.name == 'KEY_UP':
-              menuNavigateDirection -= 1
-            if key.name == 'KEY_LEFT':
-              goBack()
-            if key.name == 'KEY_ENTER':
-              runSelection(currentMenuItemIndex)
-            if key.name == 'KEY_ESCAPE':
-              return True
-          elif key:
-            if key == 'h': # H pressed
-              if hideHelpText:
-                hideHelpText = False
-              else:
-                hideHelpText = True
-              mainRender(1, deconzBuildOptions, currentMenuItemIndex)
-
-          if menuNavigateDirection != 0: # If a direction was pressed, find next selectable item
-            currentMenuItemIndex += menuNavigateDirection
-            currentMenuItemIndex = currentMenuItemIndex % len(deconzBuildOptions)
-            needsRender = 2
-
-            while not isMenuItemSelectable(deconzBuildOptions, currentMenuItemIndex):
-              currentMenuItemIndex += menuNavigateDirection
-              currentMenuItemIndex = currentMenuItemIndex % len(deconzBuildOptions)
+    global optionsMenu
+    createMenu()
+    optionsMenu = Menu(
+      'IOTstack DeConz Options',
+      getOptionsMenuItems,
+      renderMode,
+      controls=optionsMenuControls,
+      hideHelpText=hideHelpText,
+      statusLines=getOptionsMenuStatus,
+      leftGoesBack=True
+    )
+    optionsMenu.run()
+    hideHelpText = optionsMenu.hideHelpText
     return True
 
   ####################
@@ -76,6 +76,7 @@ def main():
 
 	# This function is optional, and will run just before the build docker-compose.yml code.
 	def preBuild():
+		doCustomSetup() # also done here so a failed sudo fails the build
 		return True
 
   # #####################################
@@ -104,10 +105,12 @@ def main():
 				if exists(SOURCE_PATH) :
 
 					# yes! we should copy the source to the target
-					subprocess.call(['sudo', 'cp', SOURCE_PATH, TARGET_PATH])
+					if subprocess.call(['sudo', 'cp', SOURCE_PATH, TARGET_PATH]) != 0 :
+						raise RuntimeError('Unable to install ' + TARGET_PATH + ' (sudo cp failed)')
 
 					# sudo cp sets root ownership but not necessarily correct mode
-					subprocess.call(['sudo', 'chmod', '644', TARGET_PATH])
+					if subprocess.call(['sudo', 'chmod', '644', TARGET_PATH]) != 0 :
+						raise RuntimeError('Unable to set the mode of ' + TARGET_PATH + ' (sudo chmod failed)')
 
 		def setEnvironment (path, key, value) :
 
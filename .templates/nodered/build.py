@@ -9,12 +9,15 @@ def main():
   import os
   import time
   import ruamel.yaml
-  import signal
   import sys
-  from blessed import Terminal
+  from deps.render import getTerminal
+  from deps.menu_engine import Menu, optionsMenuControls, formatNoticeLine
+  from deps.hook_loader import loadHookCode
   from deps.chars import specialChars, commonTopBorder, commonBottomBorder, commonEmptyLine, padText
   from deps.consts import servicesDirectory, templatesDirectory
-  from deps.common_functions import getExternalPorts, getInternalPorts, checkPortConflicts, enterPortNumberWithWhiptail
+  from deps.yaml_io import readYaml
+  from deps.common_functions import getExternalPorts, getInternalPorts, enterPortNumberWithWhiptail
+  from deps.port_registry import getPortConflicts
 
   global dockerComposeServicesYaml # The loaded memory YAML of all checked services
   global renderMode # For rendering fancy or basic ascii characters
@@ -111,13 +114,20 @@ def main():
     with open(r'%s/Dockerfile.template' % serviceTemplate, 'r') as dockerTemplate:
       templateData = dockerTemplate.read()
 
-    with open(r'%s' % addonsFile) as objAddonsFile:
-      addonsSelected = yaml.load(objAddonsFile)
+    # Without an addons list (the addons menu wasn't opened), the addons menu's defaults are built
+    if os.path.exists(addonsFile):
+      with open(r'%s' % addonsFile) as objAddonsFile:
+        addonsSelected = readYaml(objAddonsFile)
+      selectedAddons = addonsSelected["addons"]
+    else:
+      with open(r'%s/addons.yml' % serviceTemplate) as objAddonsFile:
+        addonsSelected = readYaml(objAddonsFile)
+      selectedAddons = addonsSelected["addons"]["default_on"]
 
     addonsInstallCommands = ""
-    if os.path.exists(addonsFile):
+    if len(selectedAddons) > 0:
       installCommand = addonsSelected["dockerFileInstallCommand"]
-      for (index, addonName) in enumerate(addonsSelected["addons"]):
+      for (index, addonName) in enumerate(selectedAddons):
         if (addonName == 'node-red-node-sqlite'): # SQLite requires a special param
           addonsInstallCommands = addonsInstallCommands + "{installCommand} --unsafe-perm {addonName}\n".format(addonName=addonName, installCommand=installCommand)
         else:
@@ -136,48 +146,23 @@ def main():
   # #####################################
 
   def checkForIssues():
-    fileIssues = checkFiles()
-    if (len(fileIssues) > 0):
-      issues["fileIssues"] = fileIssues
-    for (index, serviceName) in enumerate(dockerComposeServicesYaml):
-      if not currentServiceName == serviceName: # Skip self
-        currentServicePorts = getExternalPorts(currentServiceName, dockerComposeServicesYaml)
-        portConflicts = checkPortConflicts(serviceName, currentServicePorts, dockerComposeServicesYaml)
-        if (len(portConflicts) > 0):
-          issues["portConflicts"] = portConflicts
-
-  def checkFiles():
-    fileIssues = []
-    if not os.path.exists(serviceService + '/addons_list.yml'):
-      fileIssues.append('/addons_list.yml does not exist. Build addons file in options to fix. This is optional')
-    return fileIssues
+    portConflicts = getPortConflicts(currentServiceName, dockerComposeServicesYaml)
+    if (len(portConflicts) > 0):
+      issues["portConflicts"] = portConflicts
 
   ############################
   # Menu Logic
   ############################
 
-  global currentMenuItemIndex
-  global selectionInProgress
-  global menuNavigateDirection
-  global needsRender
-
-  selectionInProgress = True
-  currentMenuItemIndex = 0
-  menuNavigateDirection = 0
-  needsRender = 1
-  term = Terminal()
+  term = getTerminal()
   hotzoneLocation = [((term.height // 16) + 6), 0]
 
   def goBack():
-    global selectionInProgress
-    global needsRender
-    selectionInProgress = False
-    needsRender = 1
+    optionsMenu.close()
     return True
 
   def enterPortNumberExec():
     # global term
-    global needsRender
     global dockerComposeServicesYaml
     externalPort = getExternalPorts(currentServiceName, dockerComposeServicesYaml)[0]
     internalPort = getInternalPorts(currentServiceName, dockerComposeServicesYaml)[0]
@@ -189,19 +174,11 @@ def main():
         oldIntPort = internalPort
       )
       createMenu()
-    needsRender = 1
-
-  def onResize(sig, action):
-    global nodeRedBuildOptions
-    global currentMenuItemIndex
-    mainRender(1, nodeRedBuildOptions, currentMenuItemIndex)
 
   def selectNodeRedAddons():
-    global needsRender
     global hasRebuiltAddons
     dockerCommandsFilePath = "./.templates/nodered/addons.py"
-    with open(dockerCommandsFilePath, "rb") as pythonDynamicImportFile:
-      code = compile(pythonDynamicImportFile.read(), dockerCommandsFilePath, "exec")
+    code = loadHookCode(dockerCommandsFilePath) # Compiled once, see deps/hook_loader.py
     # execGlobals = globals()
     # execLocals = locals()
     execGlobals = {
@@ -209,15 +186,11 @@ def main():
       "renderMode": renderMode
     }
     execLocals = {}
-    screenActive = False
     exec(code, execGlobals, execLocals)
-    signal.signal(signal.SIGWINCH, onResize)
     try:
       hasRebuiltAddons = execGlobals["hasRebuiltAddons"]
     except:
       hasRebuiltAddons = False
-    screenActive = True
-    needsRender = 1
 
   nodeRedBuildOptions = []
 
@@ -239,143 +212,33 @@ def main():
     else:
       nodeRedBuildOptions.insert(0, ["Select & build addons list", selectNodeRedAddons])
 
-  def runOptionsMenu():
-    createMenu()
-    menuEntryPoint()
-    return True
-
-  def renderHotZone(term, menu, selection, hotzoneLocation):
-    lineLengthAtTextStart = 71
-    print(term.move(hotzoneLocation[0], hotzoneLocation[1]))
-    for (index, menuItem) in enumerate(menu):
-      toPrint = ""
-      if index == selection:
-        toPrint += ('{bv} -> {t.blue_on_green} {title} {t.normal} <-'.format(t=term, title=menuItem[0], bv=specialChars[renderMode]["borderVertical"]))
-      else:
-        toPrint += ('{bv}    {t.normal} {title}    '.format(t=term, title=menuItem[0], bv=specialChars[renderMode]["borderVertical"]))
-
-      for i in range(lineLengthAtTextStart - len(menuItem[0])):
-        toPrint += " "
-
-      toPrint += "{bv}".format(bv=specialChars[renderMode]["borderVertical"])
-
-      toPrint = term.center(toPrint)
-
-      print(toPrint)
-
-  def mainRender(needsRender, menu, selection):
-    term = Terminal()
-    
-    if needsRender == 1:
-      print(term.clear())
-      print(term.move_y(term.height // 16))
-      print(term.black_on_cornsilk4(term.center('IOTstack NodeRed Options')))
-      print("")
-      print(term.center(commonTopBorder(renderMode)))
-      print(term.center(commonEmptyLine(renderMode)))
-      print(term.center("{bv}      Select Option to configure                                                {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-      print(term.center(commonEmptyLine(renderMode)))
-
-    if needsRender >= 1:
-      renderHotZone(term, menu, selection, hotzoneLocation)
-
-    if needsRender == 1:
-      if os.path.exists(serviceService + '/addons_list.yml'):
-        if hasRebuiltAddons:
-          print(term.center(commonEmptyLine(renderMode)))
-          print(term.center('{bv}     {t.grey_on_blue4} {text} {t.normal}{t.white_on_black}{t.normal}                            {bv}'.format(t=term, text="Addons list has been rebuilt: addons_list.yml", bv=specialChars[renderMode]["borderVertical"])))
-        else:
-          print(term.center(commonEmptyLine(renderMode)))
-          print(term.center('{bv}     {t.grey_on_blue4} {text} {t.normal}{t.white_on_black}{t.normal}                   {bv}'.format(t=term, text="Using existing addons_list.yml for addons installation", bv=specialChars[renderMode]["borderVertical"])))
-      else:
-        print(term.center(commonEmptyLine(renderMode)))
-        print(term.center(commonEmptyLine(renderMode)))
-      if not hideHelpText:
-        print(term.center(commonEmptyLine(renderMode)))
-        print(term.center("{bv}      Controls:                                                                 {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center("{bv}      [Up] and [Down] to move selection cursor                                  {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center("{bv}      [H] Show/hide this text                                                   {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center("{bv}      [Enter] to run command or save input                                      {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center("{bv}      [Escape] to go back to build stack menu                                   {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-        print(term.center(commonEmptyLine(renderMode)))
-        if len(documentationHint) > 1:
-          if len(documentationHint) > 56:
-            documentationAndPadding = padText(documentationHint, 71)
-            print(term.center("{bv}      Documentation:                                                            {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-            print(term.center("{bv}        {dap} {bv}".format(bv=specialChars[renderMode]["borderVertical"], dap=documentationAndPadding)))
-          else:
-            documentationAndPadding = padText(documentationHint, 56)
-            print(term.center("{bv}        Documentation: {dap} {bv}".format(bv=specialChars[renderMode]["borderVertical"], dap=documentationAndPadding)))
-          print(term.center(commonEmptyLine(renderMode)))
-      print(term.center(commonEmptyLine(renderMode)))
-      print(term.center(commonBottomBorder(renderMode)))
-
-  def runSelection(selection):
-    import types
+  def getOptionsMenuItems():
     global nodeRedBuildOptions
-    if len(nodeRedBuildOptions[selection]) > 1 and isinstance(nodeRedBuildOptions[selection][1], types.FunctionType):
-      nodeRedBuildOptions[selection][1]()
-    else:
-      print(term.green_reverse('IOTstack Error: No function assigned to menu item: "{}"'.format(nodeRedBuildOptions[selection][0])))
+    return nodeRedBuildOptions
 
-  def isMenuItemSelectable(menu, index):
-    if len(menu) > index:
-      if len(menu[index]) > 2:
-        if menu[index][2]["skip"] == True:
-          return False
-    return True
+  def getOptionsMenuStatus():
+    if os.path.exists(serviceService + '/addons_list.yml'):
+      if hasRebuiltAddons:
+        return [formatNoticeLine("Addons list has been rebuilt: addons_list.yml", renderMode, term.width)]
+      return [formatNoticeLine("Using existing addons_list.yml for addons installation", renderMode, term.width)]
+    return [None]
 
-  def menuEntryPoint():
-    # These need to be reglobalised due to eval()
-    global currentMenuItemIndex
-    global selectionInProgress
-    global menuNavigateDirection
-    global needsRender
+  def runOptionsMenu():
     global hideHelpText
-    global nodeRedBuildOptions
-    term = Terminal()
-    with term.fullscreen():
-      menuNavigateDirection = 0
-      mainRender(needsRender, nodeRedBuildOptions, currentMenuItemIndex)
-      selectionInProgress = True
-      with term.cbreak():
-        while selectionInProgress:
-          menuNavigateDirection = 0
-
-          if needsRender: # Only rerender when changed to prevent flickering
-            mainRender(needsRender, nodeRedBuildOptions, currentMenuItemIndex)
-            needsRender = 0
-
-          key = term.inkey(esc_delay=0.05)
-          if key.is_sequence:
-            if key.name == 'KEY_TAB':
-              menuNavigateDirection += 1
-            if key.name == 'KEY_DOWN':
-              menuNavigateDirection += 1
-            if key.name == 'KEY_UP':
-              menuNavigateDirection -= 1
-            if key.name == 'KEY_LEFT':
-              goBack()
-            if key.name == 'KEY_ENTER':
-              runSelection(currentMenuItemIndex)
-            if key.name == 'KEY_ESCAPE':
-              return True
-          elif key:
-            if key == 'h': # H pressed
-              if hideHelpText:
-                hideHelpText = False
-              else:
-                hideHelpText = True
-              mainRender(1, nodeRedBuildOptions, currentMenuItemIndex)
-
-          if menuNavigateDirection != 0: # If a direction was pressed, find next selectable item
-            currentMenuItemIndex += menuNavigateDirection
-            currentMenuItemIndex = currentMenuItemIndex % len(nodeRedBuildOptions)
-            needsRender = 2
-
-            while not isMenuItemSelectable(nodeRedBuildOptions, currentMenuItemIndex):
-              currentMenuItemIndex += menuNavigateDirection
-              currentMenuItemIndex = currentMenuItemIndex % len(nodeRedBuildOptions)
+    global optionsMenu
+    createMenu()
+    optionsMenu = Menu(
+      'IOTstack NodeRed Options',
+      getOptionsMenuItems,
+      renderMode,
+      controls=optionsMenuControls,
+      documentationHint=documentationHint,
+      hideHelpText=hideHelpText,
+      statusLines=getOptionsMenuStatus,
+      leftGoesBack=True
+    )
+    optionsMenu.run()
+    hideHelpText = optionsMenu.hideHelpText
     return True
 
   ####################
@@ -13,7 +13,8 @@ def main():
   import sys
   
   from deps.consts import servicesDirectory, templatesDirectory, volumesDirectory
-  from deps.common_functions import getExternalPorts, getInternalPorts, checkPortConflicts
+  from deps.common_functions import getInternalPorts
+  from deps.port_registry import getPortConflicts
 
   global dockerComposeServicesYaml # The loaded memory YAML of all checked services
   global toRun # Switch for which function to run when executed
@@ -104,12 +105,9 @@ def main():
     envFileIssues = checkEnvFiles()
     if (len(envFileIssues) > 0):
       issues["envFileIssues"] = envFileIssues
-    for (index, serviceName) in enumerate(dockerComposeServicesYaml):
-      if not currentServiceName == serviceName: # Skip self
-        currentServicePorts = getExternalPorts(currentServiceName, dockerComposeServicesYaml)
-        portConflicts = checkPortConflicts(serviceName, currentServicePorts, dockerComposeServicesYaml)
-        if (len(portConflicts) > 0):
-          issues["portConflicts"] = portConflicts
+    portConflicts = getPortConflicts(currentServiceName, dockerComposeServicesYaml)
+    if (len(portConflicts) > 0):
+      issues["portConflicts"] = portConflicts
 
   def checkEnvFiles():
     envFileIssues = []
@@ -12,7 +12,8 @@ def main():
   import sys
   
   from deps.consts import servicesDirectory, templatesDirectory
-  from deps.common_functions import getExternalPorts, getInternalPorts, checkPortConflicts, checkDependsOn
+  from deps.common_functions import getInternalPorts, checkDependsOn
+  from deps.port_registry import getPortConflicts
 
   global dockerComposeServicesYaml # The loaded memory YAML of all checked services
   global toRun # Switch for which function to run when executed
@@ -99,12 +100,9 @@ def main():
     dependsOnListMissing = checkDependsOn(currentServiceName, dockerComposeServicesYaml)
     if (len(dependsOnListMissing) > 0):
       issues["dependsOn"] = dependsOnListMissing
-    for (index, serviceName) in enumerate(dockerComposeServicesYaml):
-      if not currentServiceName == serviceName: # Skip self
-        currentServicePorts = getExternalPorts(currentServiceName, dockerComposeServicesYaml)
-        portConflicts = checkPortConflicts(serviceName, currentServicePorts, dockerComposeServicesYaml)
-        if (len(portConflicts) > 0):
-          issues["portConflicts"] = portConflicts
+    portConflicts = getPortConflicts(currentServiceName, dockerComposeServicesYaml)
+    if (len(portConflicts) > 0):
+      issues["portConflicts"] = portConflicts
 
   # #####################################
   # End Supporting functions
@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+# Times the build pipeline against generated IOTstack trees with many services, so changes
+# to the catalog, checks, merging or build can be compared between commits.
+#
+# For each size a temporary IOTstack directory is generated with that many templates. Each
+# template has a service.yml with ports (some of them conflicting), volumes, environment and
+# depends_on, and a build.py with runChecks, preBuild and postBuild hooks like the real ones.
+#
+# Timed steps:
+#  catalogCold:   Building the template catalog with no ./.tmp cache
+#  catalogWarm:   Loading the template catalog from ./.tmp in a fresh process state
+#  selectAll:     Selecting every service, as the menu does for a previous build
+#  toggle:        Average of selecting one more service and rerunning every check (space in the menu)
+#  mergeYaml:     Merging a compose-override.yml that touches every service
+#  buildFull:     buildServices() running every hook
+#  buildNoChange: buildServices() again, with nothing changed
+#
+# Usage:
+#  python3 ./scripts/benchmarks/build_pipeline.py
+#  python3 ./scripts/benchmarks/build_pipeline.py --sizes 50,200 --compare ./.tmp/benchmarks/build_pipeline-<commit>.json
+#
+# Results are saved to ./.tmp/benchmarks/build_pipeline-<commit>.json (or --output).
+import os
+import io
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import platform
+import subprocess
+from contextlib import redirect_stdout
+
+repoDirectory = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+scriptsDirectory = os.path.join(repoDirectory, 'scripts')
+
+syntheticBuildScript = '''#!/usr/bin/env python3
+
+issues = {} # Returned issues dict
+buildHooks = {} # Options, and others hooks
+haltOnErrors = True
+
+def main():
+  import os
+  from deps.render import getTerminal
+  from deps.consts import servicesDirectory, templatesDirectory, volumesDirectory
+  from deps.port_registry import getPortConflicts
+
+  global dockerComposeServicesYaml
+  global toRun
+  global buildHooks
+  global currentServiceName
+  global issues
+
+  serviceService = servicesDirectory + currentServiceName
+  term = getTerminal()
+
+  def runChecks():
+    checkForIssues()
+    return []
+
+  def preBuild():
+    if not os.path.exists(serviceService):
+      os.makedirs(serviceService, exist_ok=True)
+    with open(serviceService + '/service.conf', 'w') as objConfigFile:
+      objConfigFile.write("name=" + currentServiceName + "\\n")
+    dockerComposeServicesYaml[currentServiceName]["environment"].append("CONFIG=/config/service.conf")
+    return True
+
+  def postBuild():
+    return True
+
+  def checkForIssues():
+    portConflicts = getPortConflicts(currentServiceName, dockerComposeServicesYaml)
+    if (len(portConflicts) > 0):
+      issues["portConflicts"] = portConflicts
+
+  if toRun in ["runChecks", "preBuild", "postBuild"]:
+    eval(toRun)()
+
+main()
+'''
+
+def parseArguments():
+  parser = argparse.ArgumentParser(description="Benchmark the IOTstack build pipeline against generated templates.")
+  parser.add_argument("--sizes", default="50,200,1000", help="Comma separated numbers of services to generate.")
+  parser.add_argument("--toggles", type=int, default=3, help="Number of selection toggles to average.")
+  parser.add_argument("--output", help="Where to save the JSON results. Defaults to ./.tmp/benchmarks/build_pipeline-<commit>.json")
+  parser.add_argument("--compare", help="A previous results file to compare against.")
+  parser.add_argument("--keep", action="store_true", help="Keep the generated directories, and print where they are.")
+  return parser.parse_args()
+
+def getServiceName(index):
+  return "svc{index:04d}".format(index=index)
+
+def getServiceText(index, serviceCount):
+  serviceName = getServiceName(index)
+  lines = [
+    serviceName + ":",
+    "  container_name: " + serviceName,
+    "  image: example/" + serviceName + ":latest # Synthetic image",
+    "  restart: unless-stopped",
+    "  ports:",
+    '    - "{port}:80"'.format(port=10000 + index),
+    '    - "{port}:443"'.format(port=10000 + (index // 10)), # Every 10 services share a port
+    '    - "127.0.0.1:{port}:9000/udp"'.format(port=30000 + index),
+    "  environment:",
+    "    - TZ=${TZ:-Etc/UTC}",
+    "    - SERVICE_NAME=" + serviceName,
+    "    - SERVICE_PASSWORD=%randomPassword%",
+    "  volumes:",
+    "    - ./volumes/" + serviceName + "/data:/data",
+    "    - ./volumes/" + serviceName + "/config:/config",
+  ]
+  if index % 5 == 4 and index > 0:
+    lines.append("  depends_on:")
+    lines.append("    - " + getServiceName(index - 1))
+  if index % 20 == 0:
+    lines.append("  devices:")
+    lines.append("    - /dev/ttyUSB0:/dev/ttyUSB0")
+  return "\n".join(lines) + "\n"
+
+def generateStack(stackDirectory, serviceCount):
+  templatesPath = os.path.join(stackDirectory, '.templates')
+  os.makedirs(templatesPath)
+  os.makedirs(os.path.join(stackDirectory, '.tmp'))
+  shutil.copy(os.path.join(repoDirectory, '.templates', 'docker-compose-base.yml'), templatesPath)
+  for index in range(serviceCount):
+    templatePath = os.path.join(templatesPath, getServiceName(index))
+    os.makedirs(templatePath)
+    with open(os.path.join(templatePath, 'service.yml'), 'w') as objServiceFile:
+      objServiceFile.write(getServiceText(index, serviceCount))
+    with open(os.path.join(templatePath, 'build.py'), 'w') as objBuildFile:
+      objBuildFile.write(syntheticBuildScript)
+
+def writeOverride(stackDirectory, serviceCount):
+  lines = ["services:"]
+  for index in range(serviceCount):
+    lines.append("  " + getServiceName(index) + ":")
+    lines.append("    environment:")
+    lines.append("      - OVERRIDDEN=true")
+    lines.append("    labels:")
+    lines.append("      com.example.index: \"{index}\"".format(index=index))
+  with open(os.path.join(stackDirectory, 'compose-override.yml'), 'w') as objOverrideFile:
+    objOverrideFile.write("\n".join(lines) + "\n")
+
+def resetModuleState():
+  # The deps modules keep caches for the life of the process, clear them between stacks
+  from deps import hook_loader, hook_index, template_catalog, dependency_graph, port_registry, issue_cache
+  hook_loader.clearHookCache()
+  hook_index.hookIndex = None
+  hook_index.hookIndexChanged = False
+  template_catalog.templateCatalog = None
+  dependency_graph.lastGraph = None
+  dependency_graph.lastGraphKey = None
+  port_registry.lastRegistry = None
+  port_registry.lastFingerprint = None
+  issue_cache.issuesCache = None
+  issue_cache.issuesCacheChanged = False
+
+def timeStep(stepFn):
+  startTime = time.perf_counter()
+  with redirect_stdout(io.StringIO()):
+    result = stepFn()
+  return (time.perf_counter() - startTime) * 1000, result
+
+def benchmarkStack(serviceCount, toggles, keep):
+  from deps import buildstack
+  from deps.yaml_io import loadRoundTripFile
+  from deps.yaml_merge import mergeYaml
+
+  stackDirectory = tempfile.mkdtemp(prefix="iotstack-bench-{count}-".format(count=serviceCount))
+  results = {}
+  previousDirectory = os.getcwd()
+  try:
+    generateStack(stackDirectory, serviceCount)
+    os.chdir(stackDirectory)
+    resetModuleState()
+
+    results["catalogCold"], templateNames = timeStep(buildstack.generateTemplateList)
+    resetModuleState()
+    results["catalogWarm"], templateNames = timeStep(buildstack.generateTemplateList)
+
+    # Leave the last few services unselected so they can be toggled on
+    toggles = min(toggles, len(templateNames) - 1)
+    selectedNames = templateNames[:len(templateNames) - toggles]
+    dockerComposeServicesYaml = {}
+    def selectAll():
+      for serviceName in selectedNames:
+        dockerComposeServicesYaml[serviceName] = buildstack.loadService(serviceName)
+      return buildstack.checkForIssues(selectedNames, dockerComposeServicesYaml, interactive=False)
+    results["selectAll"], serviceIssues = timeStep(selectAll)
+    results["issuesFound"] = len([serviceName for serviceName in serviceIssues if serviceIssues[serviceName]])
+
+    toggleTimes = []
+    for serviceName in templateNames[len(selectedNames):]:
+      def toggle():
+        selectedNames.append(serviceName)
+        dockerComposeServicesYaml[serviceName] = buildstack.loadService(serviceName)
+        return buildstack.checkForIssues(selectedNames, dockerComposeServicesYaml, interactive=False)
+      toggleTimes.append(timeStep(toggle)[0])
+    results["toggle"] = sum(toggleTimes) / max(1, len(toggleTimes))
+
+    writeOverride(stackDirectory, serviceCount)
+    baseYaml = loadRoundTripFile('./.templates/docker-compose-base.yml')
+    baseYaml["services"] = dockerComposeServicesYaml
+    overrideYaml = loadRoundTripFile('./compose-override.yml')
+    results["mergeYaml"] = timeStep(lambda: mergeYaml(overrideYaml, baseYaml))[0]
+    os.remove('./compose-override.yml')
+
+    results["buildFull"], buildResults = timeStep(lambda: buildstack.buildServices(selectedNames, dockerComposeServicesYaml, interactive=False))
+    results["failedHooks"] = len(buildResults["failedHooks"])
+    dockerComposeServicesYaml = buildstack.loadServices(selectedNames)
+    results["buildNoChange"] = timeStep(lambda: buildstack.buildServices(selectedNames, dockerComposeServicesYaml, interactive=False))[0]
+  finally:
+    os.chdir(previousDirectory)
+    if keep:
+      print("Kept: " + stackDirectory)
+    else:
+      shutil.rmtree(stackDirectory, ignore_errors=True)
+  return results
+
+def getGitCommit():
+  try:
+    commit = subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=repoDirectory, stderr=subprocess.DEVNULL).decode().strip()
+    dirty = subprocess.call(["git", "diff", "--quiet", "HEAD", "--", "scripts"], cwd=repoDirectory, stderr=subprocess.DEVNULL) == 1
+    return commit, dirty
+  except (OSError, subprocess.CalledProcessError):
+    return "unknown", False
+
+def printResults(allResults, previousResults=None):
+  steps = ["catalogCold", "catalogWarm", "selectAll", "toggle", "mergeYaml", "buildFull", "buildNoChange"]
+  for (size, results) in allResults.items():
+    print("")
+    print("{size} services:".format(size=size))
+    for step in steps:
+      line = "  {step:<14} {ms:10.1f} ms".format(step=step, ms=results[step])
+      if previousResults and size in previousResults.get("results", {}) and step in previousResults["results"][size]:
+        previousMs = previousResults["results"][size][step]
+        if previousMs > 0:
+          line += "  ({change:+.0f}% vs {commit})".format(change=(results[step] - previousMs) / previousMs * 100, commit=previousResults.get("commit", "previous"))
+      print(line)
+
+def main():
+  args = parseArguments()
+  sys.path.insert(0, scriptsDirectory)
+  from deps.yaml_io import hasCLoader
+  import ruamel.yaml
+
+  sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+  commit, dirty = getGitCommit()
+  previousResults = None
+  if args.compare:
+    with open(args.compare) as objCompareFile:
+      previousResults = json.load(objCompareFile)
+
+  allResults = {}
+  for size in sizes:
+    print("Benchmarking {size} services...".format(size=size))
+    allResults[str(size)] = benchmarkStack(size, args.toggles, args.keep)
+
+  report = {
+    "commit": commit,
+    "dirty": dirty,
+    "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "python": platform.python_version(),
+    "machine": platform.machine(),
+    "ruamelYaml": ruamel.yaml.__version__,
+    "cLoader": hasCLoader(),
+    "results": allResults
+  }
+  printResults(allResults, previousResults)
+
+  outputPath = args.output
+  if not outputPath:
+    outputPath = os.path.join(repoDirectory, '.tmp', 'benchmarks', "build_pipeline-{commit}{dirty}.json".format(commit=commit, dirty="-dirty" if dirty else ""))
+  os.makedirs(os.path.dirname(outputPath), exist_ok=True)
+  with open(outputPath, 'w') as objOutputFile:
+    json.dump(report, objOutputFile, indent=2)
+  print("")
+  print("Results saved to: " + outputPath)
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# Compares the time taken to load every YAML file in ./.templates with the round trip
+# loader (comments and quotes kept) and the safe loader used for read only files.
+#
+# Usage:
+#  python3 ./scripts/benchmarks/yaml_load.py
+#  python3 ./scripts/benchmarks/yaml_load.py --repeat 20
+import os
+import sys
+import time
+import argparse
+
+def parseArguments():
+  parser = argparse.ArgumentParser(description="Benchmark the YAML loaders in deps/yaml_io.py against the full template set.")
+  parser.add_argument("--repeat", type=int, default=5, help="Number of times to load the full template set with each loader.")
+  return parser.parse_args()
+
+def findTemplateYamlFiles(templatesDirectory):
+  yamlFiles = []
+  for (root, directories, files) in os.walk(templatesDirectory):
+    directories.sort()
+    for fileName in sorted(files):
+      if fileName.endswith('.yml') or fileName.endswith('.yaml'):
+        yamlFiles.append(os.path.join(root, fileName))
+  return yamlFiles
+
+def timeLoader(loadFn, fileContents, repeat):
+  timings = []
+  for i in range(repeat):
+    startTime = time.perf_counter()
+    for fileText in fileContents:
+      loadFn(fileText)
+    timings.append(time.perf_counter() - startTime)
+  return min(timings)
+
+def main():
+  os.chdir(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+  sys.path.insert(0, './scripts')
+  from deps.consts import templatesDirectory
+  from deps.yaml_io import readYaml, loadRoundTrip, hasCLoader
+
+  args = parseArguments()
+  fileContents = []
+  for yamlFile in findTemplateYamlFiles(templatesDirectory):
+    with open(yamlFile) as objYamlFile:
+      fileContents.append(objYamlFile.read())
+
+  # Files that neither loader can read are left out, so both load the same set
+  loadableContents = []
+  for fileText in fileContents:
+    try:
+      loadRoundTrip(fileText)
+      readYaml(fileText)
+      loadableContents.append(fileText)
+    except Exception:
+      pass
+
+  totalBytes = sum(len(fileText) for fileText in loadableContents)
+  print("Files: {count} ({size} KB), best of {repeat} runs".format(count=len(loadableContents), size=round(totalBytes / 1024), repeat=args.repeat))
+  print("C loader available: {cLoader}".format(cLoader=hasCLoader()))
+
+  roundTripTime = timeLoader(loadRoundTrip, loadableContents, args.repeat)
+  safeTime = timeLoader(readYaml, loadableContents, args.repeat)
+  print("Round trip loader: {ms:8.1f} ms".format(ms=roundTripTime * 1000))
+  print("Safe loader:       {ms:8.1f} ms".format(ms=safeTime * 1000))
+  if safeTime > 0:
+    print("Speedup:           {speedup:8.1f}x".format(speedup=roundTripTime / safeTime))
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# Compares mergeYaml() in deps/yaml_merge.py with the recursive version it replaced, on
+# generated docker-compose files with an override that changes every service. Also checks
+# that both produce the same values.
+#
+# Usage:
+#  python3 ./scripts/benchmarks/yaml_merge.py
+#  python3 ./scripts/benchmarks/yaml_merge.py --sizes 50,200,1000 --repeat 5
+import os
+import sys
+import json
+import time
+import argparse
+
+def legacyMergeYaml(priorityYaml, defaultYaml):
+  # The previous deps/yaml_merge.py, kept here for comparison
+  if not priorityYaml:
+      return defaultYaml
+  finalYaml = {}
+  if isinstance(defaultYaml, dict):
+    for dk, dv in defaultYaml.items():
+      if dk in priorityYaml:
+        finalYaml[dk] = legacyMergeYaml(priorityYaml[dk], dv)
+      else:
+        finalYaml[dk] = dv
+    for pk, pv in priorityYaml.items():
+      if pk in finalYaml:
+        finalYaml[pk] = legacyMergeYaml(finalYaml[pk], pv)
+      else:
+        finalYaml[pk] = pv
+  else:
+    finalYaml = defaultYaml
+  return finalYaml
+
+def parseArguments():
+  parser = argparse.ArgumentParser(description="Benchmark mergeYaml() against the previous recursive version.")
+  parser.add_argument("--sizes", default="50,200,1000", help="Comma separated numbers of services to generate.")
+  parser.add_argument("--repeat", type=int, default=5, help="Number of runs for each size, the fastest is reported.")
+  return parser.parse_args()
+
+def generateComposeText(serviceCount):
+  lines = ["version: '3.6'", "services:"]
+  for index in range(serviceCount):
+    serviceName = "svc{index:04d}".format(index=index)
+    lines += [
+      "  {name}: # Service {index}".format(name=serviceName, index=index),
+      "    container_name: " + serviceName,
+      "    image: example/" + serviceName,
+      "    restart: unless-stopped",
+      "    ports:",
+      '      - "{port}:80"'.format(port=10000 + index),
+      "    environment:",
+      "      - TZ=${TZ:-Etc/UTC}",
+      "      - SERVICE_NAME=" + serviceName,
+      "    volumes:",
+      "      - ./volumes/" + serviceName + "/data:/data",
+      "    logging:",
+      "      options:",
+      '        max-size: "5m"',
+    ]
+  lines += ["networks:", "  default:", "    driver: bridge"]
+  return "\n".join(lines) + "\n"
+
+def generateOverrideText(serviceCount):
+  lines = ["services:"]
+  for index in range(serviceCount):
+    lines += [
+      "  svc{index:04d}:".format(index=index),
+      "    restart: always",
+      "    environment:",
+      "      - TZ=Europe/London",
+      "    logging:",
+      "      options:",
+      '        max-file: "3"',
+    ]
+  return "\n".join(lines) + "\n"
+
+def timeMerge(mergeFn, overrideYaml, composeYaml, repeat):
+  timings = []
+  for i in range(repeat):
+    startTime = time.perf_counter()
+    mergedYaml = mergeFn(overrideYaml, composeYaml)
+    timings.append(time.perf_counter() - startTime)
+  return min(timings), mergedYaml
+
+def main():
+  os.chdir(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+  sys.path.insert(0, './scripts')
+  from deps.yaml_merge import mergeYaml
+  from deps.yaml_io import loadRoundTrip
+
+  args = parseArguments()
+  print("{size:>8} {legacy:>12} {merge:>12} {speedup:>8}  {same}".format(size="services", legacy="legacy ms", merge="new ms", speedup="speedup", same="same values"))
+  for size in [int(size) for size in args.sizes.split(",") if size.strip()]:
+    composeYaml = loadRoundTrip(generateComposeText(size))
+    overrideYaml = loadRoundTrip(generateOverrideText(size))
+    legacyTime, legacyYaml = timeMerge(legacyMergeYaml, overrideYaml, composeYaml, args.repeat)
+    mergeTime, mergedYaml = timeMerge(mergeYaml, overrideYaml, composeYaml, args.repeat)
+    sameValues = json.dumps(legacyYaml, sort_keys=True) == json.dumps(mergedYaml, sort_keys=True)
+    print("{size:>8} {legacy:>12.2f} {merge:>12.2f} {speedup:>7.1f}x  {same}".format(size=size, legacy=legacyTime * 1000, merge=mergeTime * 1000, speedup=legacyTime / max(mergeTime, 1e-9), same=sameValues))
+
+if __name__ == '__main__':
+  main()
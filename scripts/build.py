@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# Builds docker-compose.yml without the menu, for use from scripts and automation.
+#
+# Usage:
+#  python3 ./scripts/build.py --services nodered,influxdb,grafana
+#  python3 ./scripts/build.py             # Rebuild the services from the last build
+#  python3 ./scripts/build.py --services nextcloud --start-order # Print the order the services start in
+#
+# Exit codes:
+#  0 = Build completed
+#  1 = Build failed, or a build hook errored
+#  2 = Issues were found with the selected services (use --ignore-issues to build anyway)
+#  3 = Invalid arguments, or unknown service names
+import os
+import sys
+import argparse
+
+exitCodes = {
+  "success": 0,
+  "buildFailed": 1,
+  "issuesFound": 2,
+  "invalidArguments": 3
+}
+
+def parseArguments():
+  parser = argparse.ArgumentParser(description="Build IOTstack's docker-compose.yml from a list of services, without the menu.")
+  parser.add_argument("--services", help="Comma separated list of services to build. Defaults to the services from the last build.")
+  parser.add_argument("--ignore-issues", action="store_true", help="Build even if the services' checks report issues.")
+  parser.add_argument("--no-build-cache", action="store_true", help="Load every service from its template, instead of keeping the config saved by the last build.")
+  parser.add_argument("--force", action="store_true", help="Run every service's build hooks, even for services that are unchanged since the last build.")
+  parser.add_argument("--no-dependencies", action="store_true", help="Don't add the services that the selected services depend on.")
+  parser.add_argument("--jobs", type=int, default=None, help="Number of services' build hooks to run at the same time. Use 1 to run them one after another.")
+  parser.add_argument("--hook-timeout", type=int, default=None, metavar="SECONDS", help="Stop a build hook that runs for longer than this. Hooks run in worker processes, use 0 to run them in this process without a limit.")
+  parser.add_argument("--profile", action="store_true", help="Print how long each step of the build took, slowest first.")
+  parser.add_argument("--profile-trace", nargs="?", const="", metavar="PATH", help="Also save the timings as a Chrome trace (defaults to ./.tmp/build_profile_<time>.json).")
+  parser.add_argument("--list", action="store_true", help="List the services that can be built, and exit.")
+  parser.add_argument("--start-order", action="store_true", help="Print the order the services start in, from their depends_on, and exit without building.")
+  return parser.parse_args()
+
+def printIssues(serviceIssues):
+  for (serviceName, issues) in serviceIssues.items():
+    for issueType in issues:
+      print("{service} ({issueType}) - {issue}".format(service=serviceName, issueType=issueType, issue=issues[issueType]), file=sys.stderr)
+
+def runBuild(args):
+  from deps import buildstack
+  from deps.dependency_graph import resolveSelection, getStartWaves, getComposeDependsOn, findCycles
+
+  templatesList = buildstack.generateTemplateList()
+
+  if args.list:
+    for serviceName in templatesList:
+      print(serviceName)
+    return exitCodes["success"]
+
+  if args.services:
+    serviceNames = [serviceName.strip() for serviceName in args.services.split(",") if serviceName.strip()]
+  else:
+    serviceNames = list(buildstack.loadBuildCache())
+
+  if len(serviceNames) == 0:
+    print("No services to build. Use --services to select services.", file=sys.stderr)
+    return exitCodes["invalidArguments"]
+
+  unknownServices = [serviceName for serviceName in serviceNames if not serviceName in templatesList]
+  if len(unknownServices) > 0:
+    print("Unknown services: {services}".format(services=", ".join(unknownServices)), file=sys.stderr)
+    return exitCodes["invalidArguments"]
+
+  if not args.no_dependencies:
+    addedServices = resolveSelection(serviceNames, buildstack.loadDependencyGraph())
+    if len(addedServices) > 0:
+      print("Adding dependencies: {services}".format(services=", ".join(addedServices)))
+      serviceNames += addedServices
+
+  dockerComposeServicesYaml = buildstack.loadServices(serviceNames, useBuildCache=not args.no_build_cache)
+
+  if args.start_order:
+    # Each line is a wave, the services in it start once those in the lines above have. The build hooks run in this order too.
+    composeDependsOn = getComposeDependsOn(dockerComposeServicesYaml)
+    for (waveIndex, wave) in enumerate(getStartWaves(list(dockerComposeServicesYaml), composeDependsOn)):
+      print("{wave}: {services}".format(wave=waveIndex + 1, services=", ".join(wave)))
+    cyclicServices = findCycles(list(dockerComposeServicesYaml), composeDependsOn)
+    if len(cyclicServices) > 0:
+      print("Circular dependencies, started together last: {services}".format(services=", ".join(cyclicServices)), file=sys.stderr)
+    return exitCodes["success"]
+
+  serviceIssues = buildstack.checkForIssues(serviceNames, dockerComposeServicesYaml, interactive=False)
+  serviceIssues = { serviceName: issues for (serviceName, issues) in serviceIssues.items() if issues }
+  if len(serviceIssues) > 0:
+    printIssues(serviceIssues)
+    if not args.ignore_issues:
+      print("Build cancelled due to issues. Use --ignore-issues to build anyway.", file=sys.stderr)
+      return exitCodes["issuesFound"]
+
+  if args.jobs == None:
+    hookWorkers = buildstack.defaultHookWorkers
+  elif args.jobs < 1:
+    print("--jobs must be 1 or more", file=sys.stderr)
+    return exitCodes["invalidArguments"]
+  else:
+    hookWorkers = args.jobs
+
+  if args.hook_timeout == None:
+    hookTimeout = buildstack.defaultHookTimeout
+  elif args.hook_timeout < 0:
+    print("--hook-timeout must be 0 or more", file=sys.stderr)
+    return exitCodes["invalidArguments"]
+  else:
+    hookTimeout = args.hook_timeout
+
+  buildResults = buildstack.buildServices(serviceNames, dockerComposeServicesYaml, interactive=False, forceRebuild=args.force, hookWorkers=hookWorkers, hookTimeout=hookTimeout)
+  if not buildResults["buildState"]:
+    return exitCodes["buildFailed"]
+  if len(buildResults["failedHooks"]) > 0:
+    print("Build hooks failed for: {services}".format(services=", ".join(buildResults["failedHooks"])), file=sys.stderr)
+    return exitCodes["buildFailed"]
+  if not buildResults["postBuildScriptExitCode"] == 0:
+    print("postbuild.sh exited with code {code}".format(code=buildResults["postBuildScriptExitCode"]), file=sys.stderr)
+    return exitCodes["buildFailed"]
+
+  print("Build completed: {path}".format(path=buildstack.dockerPathOutput))
+  return exitCodes["success"]
+
+def main():
+  # All paths used by the build are relative to the IOTstack directory
+  os.chdir(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+  from deps import profiler
+
+  args = parseArguments()
+  if args.profile or not args.profile_trace == None:
+    profiler.enableProfiling()
+
+  exitCode = runBuild(args)
+
+  if profiler.isProfiling():
+    profiler.printProfileReport(sys.stderr)
+    if not args.profile_trace == None:
+      tracePath = profiler.writeProfileTrace(args.profile_trace)
+      if tracePath:
+        print("Profile trace written to: {path}".format(path=tracePath), file=sys.stderr)
+  return exitCode
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -3,30 +3,41 @@ import signal
 
 checkedMenuItems = []
 results = {}
+dockerComposeServicesYaml = {} # The selected services' config, loaded again by loadCurrentConfigs() each visit
+hideHelpText = False # Kept between visits to the menu
 
-def main():
+def main(renderMode):
+  # Returns True if the stack was built
   import os
   import time
-  import ruamel.yaml
   import math
   import sys
-  import subprocess
   import traceback
-  from deps.chars import specialChars, commonTopBorder, commonBottomBorder, commonEmptyLine, padText
-  from deps.consts import servicesDirectory, templatesDirectory, volumesDirectory, buildCache, envFile, dockerPathOutput, servicesFileName, composeOverrideFile
-  from deps.yaml_merge import mergeYaml
-  from blessed import Terminal
-  global signal
-  global renderMode
+  from deps.chars import specialChars, commonTopBorder, commonTitledTopBorder, commonBottomBorder, commonEmptyLine, commonScrollLine, padText
+  from deps.consts import servicesDirectory, templatesDirectory, volumesDirectory, buildCache
+  from deps.hook_loader import loadHookCode
+  from deps.dependency_graph import resolveSelection
+  from deps.yaml_io import loadRoundTripFile
+  from deps.issue_checker import BackgroundIssueChecker
+  from deps.template_filter import buildTemplateFilter
+  from deps import buildstack
+  from deps import profiler
+  from deps.render import getTerminal, renderFrame
+  from deps.menu_engine import MenuRows
   global term
   global paginationSize
   global paginationStartIndex
   global hideHelpText
-  global activeMenuLocation
   global lastSelection
+  global menuRows
+  global drawnIssues
+  global issueChecker
+  global visibleMenu
+  global filterQuery
+  global filterInProgress
+  global templateFilter
+  global menuItemsByService
 
-  yaml = ruamel.yaml.YAML()
-  yaml.preserve_quotes = True
 
   # Constants
   buildScriptFile = 'build.py'
@@ -34,71 +45,37 @@ def main():
 
   # Runtime vars
   menu = []
-  dockerComposeServicesYaml = {}
-  templatesDirectoryFolders = next(os.walk(templatesDirectory))[1]
-  term = Terminal()
+  term = getTerminal()
   hotzoneLocation = [7, 0] # Top text
   paginationToggle = [10, term.height - 22] # Top text + controls text
   paginationStartIndex = 0
   paginationSize = paginationToggle[0]
-  activeMenuLocation = 0
   lastSelection = 0
-  
-  try: # If not already set, then set it.
-    hideHelpText = hideHelpText
-  except:
-    hideHelpText = False
-
-  def buildServices(): # TODO: Move this into a dependency so that it can be executed with just a list of services.
+  menuRows = None # The rows as they were last drawn, so only the rows that change are drawn again. Set below generateMenuRow()
+  issueChecker = None # Checks for issues in the background while the menu is open
+  issuePollInterval = 0.1
+  issueCheckWaitTimeout = 5 # Seconds the options menu waits for the checks before stopping them
+  drawnIssues = None # The issues shown in the Build Issues box, see isIssuesBoxOutdated()
+  visibleMenu = menu # The menu items shown, the ones matching the filter
+  filterQuery = ""
+  filterInProgress = False # Typing goes into the filter
+  templateFilter = None # Built the first time [F] is pressed, see deps/template_filter.py
+  menuItemsByService = {}
+
+  def cancelKeyPressed():
+    # Polled while build hooks run in worker processes, see deps/hook_runner.py
+    key = term.inkey(timeout=0)
+    return key.is_sequence and key.name == 'KEY_ESCAPE'
+
+  def buildServices(forceRebuild=False):
     global dockerComposeServicesYaml
-    try:
-      runPrebuildHook()
-      menuStateFileYaml = {}
-      menuStateFileYaml["services"] = dockerComposeServicesYaml
-
-      with open(r'%s' % envFile) as fileEnv:
-        dockerFileYaml = yaml.load(fileEnv)
-      dockerFileYaml["services"] = dockerComposeServicesYaml
-
-      if os.path.exists(composeOverrideFile):
-        with open(r'%s' % composeOverrideFile) as fileOverride:
-          yamlOverride = yaml.load(fileOverride)
-
-        mergedYaml = mergeYaml(yamlOverride, dockerFileYaml)
-        dockerFileYaml = mergedYaml
-
-      with open(r'%s' % dockerPathOutput, 'w') as outputFile:
-        yaml.dump(dockerFileYaml, outputFile)
-
-      if not os.path.exists(servicesDirectory):
-        os.makedirs(servicesDirectory, exist_ok=True)
-
-      with open(r'%s' % dockerSavePathOutput, 'w') as outputFile:
-        yaml.dump(menuStateFileYaml, outputFile)
-      runPostBuildHook()
-
-      if os.path.exists('./postbuild.sh'):
-        servicesList = ""
-        for (index, serviceName) in enumerate(dockerComposeServicesYaml):
-          servicesList += " " + serviceName
-        subprocess.call("./postbuild.sh" + servicesList, shell=True)
-
-      return True
-    except Exception as err: 
-      print("Issue running build:")
-      traceback.print_exc()
+    print("Press [Esc] to stop running build hooks")
+    buildResults = buildstack.buildServices(checkedMenuItems, dockerComposeServicesYaml, forceRebuild=forceRebuild, shouldCancel=cancelKeyPressed)
+    if profiler.isProfiling(): # IOTSTACK_PROFILE=1
+      profiler.printProfileReport()
+      print("Profile trace written to: {path}".format(path=profiler.writeProfileTrace()))
       input("Press Enter to continue...")
-      return False
-
-  def generateTemplateList(templatesDirectoryFolders):
-    templatesDirectoryFolders.sort()
-    templateListDirectories = []
-    for directory in templatesDirectoryFolders:
-      serviceFilePath = templatesDirectory + '/' + directory + '/' + servicesFileName
-      if os.path.exists(serviceFilePath):
-        templateListDirectories.append(directory)
-
-    return templateListDirectories
+    return buildResults["buildState"]
 
   def generateLineText(text, textLength=None, paddingBefore=0, lineLength=26):
     result = ""
@@ -118,116 +95,98 @@ def main():
     
     return result
 
-  def renderHotZone(term, renderType, menu, selection, paddingBefore, allIssues):
-    global paginationSize
+  def generateMenuRow(menuItem, isSelected, paddingBefore):
     optionsLength = len(" >>   Options ")
     optionsIssuesSpace = len("      ")
     selectedTextLength = len("-> ")
     spaceAfterissues = len("      ")
     issuesLength = len(" !!   Issue ")
 
-    print(term.move(hotzoneLocation[0], hotzoneLocation[1]))
+    lineText = generateLineText(menuItem[0], paddingBefore=paddingBefore)
 
-    if paginationStartIndex >= 1:
-      print(term.center("{b}       {uaf}      {uaf}{uaf}{uaf}                                                   {ual}           {b}".format(
-        b=specialChars[renderMode]["borderVertical"],
-        uaf=specialChars[renderMode]["upArrowFull"],
-        ual=specialChars[renderMode]["upArrowLine"]
-      )))
+    # Menu highlight logic
+    if isSelected:
+      formattedLineText = '-> {t.blue_on_green}{title}{t.normal} <-'.format(t=term, title=menuItem[0])
+      paddedLineText = generateLineText(formattedLineText, textLength=len(menuItem[0]) + selectedTextLength, paddingBefore=paddingBefore - selectedTextLength)
+      toPrint = paddedLineText
     else:
-      print(term.center(commonEmptyLine(renderMode)))
+      toPrint = '{title}{t.normal}'.format(t=term, title=lineText)
+    # #####
 
-    menuItemsActiveRow = term.get_location()[0]
-    if renderType == 2 or renderType == 1: # Rerender entire hotzone
-      for (index, menuItem) in enumerate(menu): # Menu loop
-        if "issues" in menuItem[1] and menuItem[1]["issues"]:
-          allIssues.append({ "serviceName": menuItem[0], "issues": menuItem[1]["issues"] })
-
-        if index >= paginationStartIndex and index < paginationStartIndex + paginationSize:
-          lineText = generateLineText(menuItem[0], paddingBefore=paddingBefore)
-
-          # Menu highlight logic
-          if index == selection:
-            activeMenuLocation = term.get_location()[0]
-            formattedLineText = '-> {t.blue_on_green}{title}{t.normal} <-'.format(t=term, title=menuItem[0])
-            paddedLineText = generateLineText(formattedLineText, textLength=len(menuItem[0]) + selectedTextLength, paddingBefore=paddingBefore - selectedTextLength)
-            toPrint = paddedLineText
-          else:
-            toPrint = '{title}{t.normal}'.format(t=term, title=lineText)
-          # #####
+    # Options and issues
+    if "buildHooks" in menuItem[1] and "options" in menuItem[1]["buildHooks"] and menuItem[1]["buildHooks"]["options"]:
+      toPrint = toPrint + '{t.blue_on_black} {raf}{raf} {t.normal}'.format(t=term, raf=specialChars[renderMode]["rightArrowFull"])
+      toPrint = toPrint + ' {t.white_on_black} Options {t.normal}'.format(t=term)
+    else:
+      for i in range(optionsLength):
+        toPrint += " "
 
-          # Options and issues
-          if "buildHooks" in menuItem[1] and "options" in menuItem[1]["buildHooks"] and menuItem[1]["buildHooks"]["options"]:
-            toPrint = toPrint + '{t.blue_on_black} {raf}{raf} {t.normal}'.format(t=term, raf=specialChars[renderMode]["rightArrowFull"])
-            toPrint = toPrint + ' {t.white_on_black} Options {t.normal}'.format(t=term)
-          else:
-            for i in range(optionsLength):
-              toPrint += " "
+    for i in range(optionsIssuesSpace):
+      toPrint += " "
 
-          for i in range(optionsIssuesSpace):
+    if menuItem[1]["checked"] and "checking" in menuItem[1] and menuItem[1]["checking"]:
+      toPrint = toPrint + ' {t.black_on_white} Checking {t.normal} '.format(t=term)
+    elif "issues" in menuItem[1] and menuItem[1]["issues"]:
+      toPrint = toPrint + '{t.red_on_orange} !! {t.normal}'.format(t=term)
+      toPrint = toPrint + ' {t.orange_on_black} Issue {t.normal}'.format(t=term)
+    else:
+      if menuItem[1]["checked"]:
+        if not menuItem[1]["issues"] == None and len(menuItem[1]["issues"]) == 0:
+          toPrint = toPrint + '     {t.green_on_blue} Pass {t.normal} '.format(t=term)
+        else:
+          for i in range(issuesLength):
             toPrint += " "
+      else:
+        for i in range(issuesLength):
+          toPrint += " "
 
-          if "issues" in menuItem[1] and menuItem[1]["issues"]:
-            toPrint = toPrint + '{t.red_on_orange} !! {t.normal}'.format(t=term)
-            toPrint = toPrint + ' {t.orange_on_black} Issue {t.normal}'.format(t=term)
-          else:
-            if menuItem[1]["checked"]:
-              if not menuItem[1]["issues"] == None and len(menuItem[1]["issues"]) == 0:
-                toPrint = toPrint + '     {t.green_on_blue} Pass {t.normal} '.format(t=term)
-              else:
-                for i in range(issuesLength):
-                  toPrint += " "
-            else:
-              for i in range(issuesLength):
-                toPrint += " "
+    for i in range(spaceAfterissues):
+      toPrint += " "
+    # #####
 
-          for i in range(spaceAfterissues):
-            toPrint += " "
-          # #####
+    # Menu check render logic
+    if menuItem[1]["checked"]:
+      toPrint = "     (X) " + toPrint
+    else:
+      toPrint = "     ( ) " + toPrint
 
-          # Menu check render logic
-          if menuItem[1]["checked"]:
-            toPrint = "     (X) " + toPrint
-          else:
-            toPrint = "     ( ) " + toPrint
-
-          toPrint = "{bv} {toPrint}  {bv}".format(bv=specialChars[renderMode]["borderVertical"], toPrint=toPrint) # Generate border
-          toPrint = term.center(toPrint) # Center Text (All lines should have the same amount of printable characters)
-          # #####
-          print(toPrint)
-
-
-    if renderType == 3: # Only partial rerender of hotzone (the unselected menu item, and the newly selected menu item rows)
-      global lastSelection
-      global renderOffsetLastSelection
-      global renderOffsetCurrentSelection
-      # TODO: Finish this, currently disabled. To enable, update the actions for UP and DOWN array keys below to assigned 3 to needsRender
-      renderOffsetLastSelection = lastSelection - paginationStartIndex
-      renderOffsetCurrentSelection = selection - paginationStartIndex
-      lineText = generateLineText(menu[lastSelection][0], paddingBefore=paddingBefore)
-      toPrint = '{title}{t.normal}'.format(t=term, title=lineText)
-      print('{t.move_y(lastSelection)}{title}'.format(t=term, title=toPrint))
-      # print(toPrint)
-      print(renderOffsetCurrentSelection, lastSelection, renderOffsetLastSelection)
-      lastSelection = selection
-      
-          # menuItemsActiveRow
-          # activeMenuLocation
+    toPrint = "{bv} {toPrint}  {bv}".format(bv=specialChars[renderMode]["borderVertical"], toPrint=toPrint) # Generate border
+    return term.center(toPrint) # Center Text (All lines should have the same amount of printable characters)
+
+  menuRows = MenuRows(lambda index, isSelected: generateMenuRow(visibleMenu[index], isSelected, paddingBefore=4))
 
+  def renderHotZone(term, renderType, menu, selection, allIssues, changedRows):
+    global drawnIssues
+    menuItemsRow = hotzoneLocation[0] + 2 # Below the hotzone's move and the scroll up arrows
+    frameKey = (paginationStartIndex, paginationSize, term.width, term.height, renderMode)
+
+    if renderType == 3 and menuRows.canRedraw(frameKey): # Only the rows that changed, the last and new selection and any with new issues
+      menuRows.redraw([lastSelection, selection] + changedRows, selection)
+      return
+
+    if renderType == 1:
+      drawnIssues = getAllIssues() # Including services hidden by the filter
+      allIssues.extend(drawnIssues)
+
+    print(term.move(hotzoneLocation[0], hotzoneLocation[1]))
+
+    if paginationStartIndex >= 1:
+      print(term.center(commonScrollLine(renderMode, -1)))
+    else:
+      print(term.center(commonEmptyLine(renderMode)))
+
+    menuRows.draw(menuItemsRow, paginationStartIndex, min(paginationStartIndex + paginationSize, len(menu)), selection, frameKey)
 
     if paginationStartIndex + paginationSize < len(menu):
-      print(term.center("{b}       {daf}      {daf}{daf}{daf}                                                   {dal}           {b}".format(
-        b=specialChars[renderMode]["borderVertical"],
-        daf=specialChars[renderMode]["downArrowFull"],
-        dal=specialChars[renderMode]["downArrowLine"]
-      )))
+      print(term.center(commonScrollLine(renderMode, 1)))
     else:
       print(term.center(commonEmptyLine(renderMode)))
 
-  def mainRender(menu, selection, renderType = 1):
+  @renderFrame()
+  def mainRender(menu, selection, renderType = 1, changedRows = []):
     global paginationStartIndex
     global paginationSize
-    paddingBefore = 4
+    global lastSelection
 
     allIssues = []
 
@@ -251,15 +210,21 @@ def main():
         print(term.center(commonEmptyLine(renderMode)))
         print(term.center("{bv}      Select containers to build                                                {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
         print(term.center(commonEmptyLine(renderMode)))
-        print(term.center(commonEmptyLine(renderMode)))
+        if filterInProgress or not filterQuery == "":
+          filterText = "Filter: {query}{cursor}".format(query=filterQuery[-40:], cursor="_" if filterInProgress else "")
+          filterText = padText(filterText, 56) + "({shown} of {total})".format(shown=len(visibleMenu), total=len(templatesList))
+          print(term.center("{bv}      {text}{bv}".format(bv=specialChars[renderMode]["borderVertical"], text=padText(filterText, 74))))
+        else:
+          print(term.center(commonEmptyLine(renderMode)))
         print(term.center(commonEmptyLine(renderMode)))
 
-      renderHotZone(term, renderType, menu, selection, paddingBefore, allIssues)
+      renderHotZone(term, renderType, menu, selection, allIssues, changedRows)
+      lastSelection = selection
 
       if (renderType == 1):
         print(term.center(commonEmptyLine(renderMode)))
         if not hideHelpText:
-          room = term.height - (28 + len(allIssues) + paginationSize)
+          room = term.height - (30 + len(allIssues) + paginationSize)
           if room < 0:
             allIssues.append({ "serviceName": "BuildStack Menu", "issues": { "screenSize": 'Not enough scren height to render correctly (t-height = ' + str(term.height) + ' v-lines = ' + str(room) + ')' } })
             print(term.center(commonEmptyLine(renderMode)))
@@ -273,31 +238,27 @@ def main():
             print(term.center("{bv}      [Right] for options for containers that support them                      {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
             print(term.center("{bv}      [Tab] Expand or collapse build menu size                                  {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
             print(term.center("{bv}      [H] Show/hide this text                                                   {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
-            # print(term.center("{bv}      [F] Filter options                                                        {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
+            print(term.center("{bv}      [F] Filter services by name or image                                      {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
             print(term.center("{bv}      [Enter] to begin build                                                    {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
+            print(term.center("{bv}      [R] to begin build, running every service's build hooks again             {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
             print(term.center("{bv}      [Escape] to cancel build                                                  {bv}".format(bv=specialChars[renderMode]["borderVertical"])))
             print(term.center(commonEmptyLine(renderMode)))
             print(term.center(commonEmptyLine(renderMode)))
         print(term.center(commonEmptyLine(renderMode)))
         print(term.center(commonBottomBorder(renderMode)))
 
+        # Rows are only redrawn in place while the whole menu fits, once the screen scrolls they aren't where menuRows drew them
+        issuesHeight = 0
+        if len(allIssues) > 0:
+          issuesHeight = 7 + sum([len(serviceIssues["issues"]) for serviceIssues in allIssues])
+        if term.height - (30 + paginationSize + issuesHeight) < 0:
+          menuRows.invalidate()
+
         if len(allIssues) > 0:
           print(term.center(""))
           print(term.center(""))
           print(term.center(""))
-          print(term.center(("{btl}{bh}{bh}{bh}{bh}{bh}{bh} Build Issues "
-            "{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}"
-            "{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}"
-            "{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}"
-            "{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}"
-            "{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}"
-            "{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}"
-            "{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}{bh}"
-            "{bh}{bh}{bh}{bh}{bh}{bh}{bh}{btr}").format(
-            btl=specialChars[renderMode]["borderTopLeft"],
-            btr=specialChars[renderMode]["borderTopRight"],
-            bh=specialChars[renderMode]["borderHorizontal"]
-          )))
+          print(term.center(commonTitledTopBorder(renderMode, "Build Issues", size = 139)))
           print(term.center(commonEmptyLine(renderMode, size = 139)))
           for serviceIssues in allIssues:
             for index, issue in enumerate(serviceIssues["issues"]):
@@ -329,17 +290,10 @@ def main():
     global dockerComposeServicesYaml
     dockerComposeServicesYaml.clear()
     for (index, checkedMenuItem) in enumerate(checkedMenuItems):
-      if reload == False:
-        if not checkedMenuItem in dockerComposeServicesYaml:
-          serviceFilePath = templatesDirectory + '/' + checkedMenuItem + '/' + servicesFileName
-          with open(r'%s' % serviceFilePath) as yamlServiceFile:
-            dockerComposeServicesYaml[checkedMenuItem] = yaml.load(yamlServiceFile)[checkedMenuItem]
-      else:
+      if reload:
         print("reload!")
         time.sleep(1)
-        serviceFilePath = templatesDirectory + '/' + checkedMenuItem + '/' + servicesFileName
-        with open(r'%s' % serviceFilePath) as yamlServiceFile:
-          dockerComposeServicesYaml[checkedMenuItem] = yaml.load(yamlServiceFile)[checkedMenuItem]
+      dockerComposeServicesYaml[checkedMenuItem] = buildstack.loadService(checkedMenuItem)
 
     return True
 
@@ -348,15 +302,11 @@ def main():
       global dockerComposeServicesYaml
       if reload == False:
         if not serviceName in dockerComposeServicesYaml:
-          serviceFilePath = templatesDirectory + '/' + serviceName + '/' + servicesFileName
-          with open(r'%s' % serviceFilePath) as yamlServiceFile:
-            dockerComposeServicesYaml[serviceName] = yaml.load(yamlServiceFile)[serviceName]
+          dockerComposeServicesYaml[serviceName] = buildstack.loadService(serviceName)
       else:
         print("reload!")
         time.sleep(1)
-        servicesFileNamePath = templatesDirectory + '/' + serviceName + '/' + servicesFileName
-        with open(r'%s' % serviceFilePath) as yamlServiceFile:
-          dockerComposeServicesYaml[serviceName] = yaml.load(yamlServiceFile)[serviceName]
+        dockerComposeServicesYaml[serviceName] = buildstack.loadService(serviceName)
     except Exception as err:
       print("Error running build menu:", err)
       print("Check the following:")
@@ -371,137 +321,72 @@ def main():
 
   def checkForIssues():
     global dockerComposeServicesYaml
-    for (index, checkedMenuItem) in enumerate(checkedMenuItems):
-      buildScriptPath = templatesDirectory + '/' + checkedMenuItem + '/' + buildScriptFile
-      if os.path.exists(buildScriptPath):
-        try:
-          with open(buildScriptPath, "rb") as pythonDynamicImportFile:
-            code = compile(pythonDynamicImportFile.read(), buildScriptPath, "exec")
-          execGlobals = {
-            "dockerComposeServicesYaml": dockerComposeServicesYaml,
-            "toRun": "checkForRunChecksHook",
-            "currentServiceName": checkedMenuItem
-          }
-          execLocals = locals()
-          exec(code, execGlobals, execLocals)
-          if "buildHooks" in execGlobals and "runChecksHook" in execGlobals["buildHooks"] and execGlobals["buildHooks"]["runChecksHook"]:
-            execGlobals = {
-              "dockerComposeServicesYaml": dockerComposeServicesYaml,
-              "toRun": "runChecks",
-              "currentServiceName": checkedMenuItem
-            }
-            execLocals = locals()
-            try:
-              exec(code, execGlobals, execLocals)
-              if "issues" in execGlobals and len(execGlobals["issues"]) > 0:
-                menu[getMenuItemIndexByService(checkedMenuItem)][1]["issues"] = execGlobals["issues"]
-              else:
-                menu[getMenuItemIndexByService(checkedMenuItem)][1]["issues"] = []
-            except Exception as err:
-              print("Error running checkForIssues on '%s'" % checkedMenuItem)
-              traceback.print_exc()
-              input("Press Enter to continue...")
-          else:
-            menu[getMenuItemIndexByService(checkedMenuItem)][1]["issues"] = []
-        except Exception as err:
-          print("Error running checkForIssues on '%s'" % checkedMenuItem)
-          traceback.print_exc()
-          input("Press any key to exit...")
-          sys.exit(1)
+    serviceIssues = buildstack.checkForIssues(checkedMenuItems, dockerComposeServicesYaml)
+    for (serviceName, issues) in serviceIssues.items():
+      menu[getMenuItemIndexByService(serviceName)][1]["issues"] = issues
+      menu[getMenuItemIndexByService(serviceName)][1]["checking"] = False
+
+  def requestIssueCheck():
+    # The selected services are checked in the background, see deps/issue_checker.py
+    global dockerComposeServicesYaml
+    issueChecker.requestCheck(checkedMenuItems, dockerComposeServicesYaml)
+
+  def applyIssueUpdates():
+    # Returns the indexes in visibleMenu of the rows that changed
+    changedServices = set()
+    for issueUpdate in issueChecker.getUpdates():
+      if issueUpdate[0] == "checking":
+        for serviceName in issueUpdate[1]:
+          menuItem = menu[getMenuItemIndexByService(serviceName)]
+          if menuItem[1]["checked"]:
+            menuItem[1]["checking"] = True
+            changedServices.add(serviceName)
+      elif issueUpdate[0] == "issues":
+        menuItem = menu[getMenuItemIndexByService(issueUpdate[1])]
+        if menuItem[1]["checked"]:
+          menuItem[1]["issues"] = issueUpdate[2]
+          menuItem[1]["checking"] = False
+          changedServices.add(issueUpdate[1])
+    return [index for (index, menuItem) in enumerate(visibleMenu) if menuItem[0] in changedServices]
+
+  def isIssuesBoxOutdated():
+    # The Build Issues box is only drawn again once the checks have finished, rather than for every
+    # service's result, and only if the issues in it changed
+    return issueChecker.waitUntilIdle(0) and not getAllIssues() == drawnIssues
+
+  def waitForIssueChecks():
+    # The options menu may change the services being checked, so the checks have to finish first.
+    # If they take too long, they're stopped and checked again once the options menu closes.
+    global issueChecker
+    if issueChecker.waitUntilIdle(issuePollInterval):
+      return
+    print(term.move_yx(term.height - 1, 0) + term.center('{t.black_on_white} Waiting for the issue checks to finish... {t.normal}'.format(t=term)), end='', flush=True)
+    if not issueChecker.waitUntilIdle(issueCheckWaitTimeout):
+      issueChecker.stop(cancel=True)
+      issueChecker = BackgroundIssueChecker()
+      for menuItem in menu:
+        menuItem[1]["checking"] = False
 
   def checkForOptions():
     global dockerComposeServicesYaml
     for (index, menuItem) in enumerate(menu):
-      buildScriptPath = templatesDirectory + '/' + menuItem[0] + '/' + buildScriptFile
-      if os.path.exists(buildScriptPath):
-        try:
-          with open(buildScriptPath, "rb") as pythonDynamicImportFile:
-            code = compile(pythonDynamicImportFile.read(), buildScriptPath, "exec")
-          execGlobals = {
-            "dockerComposeServicesYaml": dockerComposeServicesYaml,
-            "toRun": "checkForOptionsHook",
-            "currentServiceName": menuItem[0],
-            "renderMode": renderMode
-          }
-          execLocals = {}
-          exec(code, execGlobals, execLocals)
-          if not "buildHooks" in menu[getMenuItemIndexByService(menuItem[0])][1]:
-            menu[getMenuItemIndexByService(menuItem[0])][1]["buildHooks"] = {}
-          if "options" in execGlobals["buildHooks"] and execGlobals["buildHooks"]["options"]:
-            menu[getMenuItemIndexByService(menuItem[0])][1]["buildHooks"]["options"] = True
-        except Exception as err:
-          print("Error running checkForOptions on '%s'" % menuItem[0])
-          traceback.print_exc()
-          input("Press any key to exit...")
-          sys.exit(1)
-
-  def runPrebuildHook():
-    global dockerComposeServicesYaml
-    for (index, checkedMenuItem) in enumerate(checkedMenuItems):
-      buildScriptPath = templatesDirectory + '/' + checkedMenuItem + '/' + buildScriptFile
-      if os.path.exists(buildScriptPath):
-          with open(buildScriptPath, "rb") as pythonDynamicImportFile:
-            code = compile(pythonDynamicImportFile.read(), buildScriptPath, "exec")
-          execGlobals = {
-            "dockerComposeServicesYaml": dockerComposeServicesYaml,
-            "toRun": "checkForPreBuildHook",
-            "currentServiceName": checkedMenuItem
-          }
-          execLocals = locals()
-          try:
-            exec(code, execGlobals, execLocals)
-            if "preBuildHook" in execGlobals["buildHooks"] and execGlobals["buildHooks"]["preBuildHook"]:
-              execGlobals = {
-                "dockerComposeServicesYaml": dockerComposeServicesYaml,
-                "toRun": "preBuild",
-                "currentServiceName": checkedMenuItem
-              }
-              execLocals = locals()
-              exec(code, execGlobals, execLocals)
-          except Exception as err:
-            print("Error running PreBuildHook on '%s'" % checkedMenuItem)
-            traceback.print_exc()
-            input("Press Enter to continue...")
-            try: # If the prebuild hook modified the docker-compose object, pull it from the script back to here.
-              dockerComposeServicesYaml = execGlobals["dockerComposeServicesYaml"]
-            except:
-              pass
-
-  def runPostBuildHook():
-    for (index, checkedMenuItem) in enumerate(checkedMenuItems):
-      buildScriptPath = templatesDirectory + '/' + checkedMenuItem + '/' + buildScriptFile
-      if os.path.exists(buildScriptPath):
-          with open(buildScriptPath, "rb") as pythonDynamicImportFile:
-            code = compile(pythonDynamicImportFile.read(), buildScriptPath, "exec")
-          execGlobals = {
-            "dockerComposeServicesYaml": dockerComposeServicesYaml,
-            "toRun": "checkForPostBuildHook",
-            "currentServiceName": checkedMenuItem
-          }
-          execLocals = locals()
-          try:
-            exec(code, execGlobals, execLocals)
-            if "postBuildHook" in execGlobals["buildHooks"] and execGlobals["buildHooks"]["postBuildHook"]:
-              execGlobals = {
-                "dockerComposeServicesYaml": dockerComposeServicesYaml,
-                "toRun": "postBuild",
-                "currentServiceName": checkedMenuItem
-              }
-              execLocals = locals()
-              exec(code, execGlobals, execLocals)
-          except Exception as err:
-            print("Error running PostBuildHook on '%s'" % checkedMenuItem)
-            traceback.print_exc()
-            input("Press Enter to continue...")
+      # Hooks were found when the template catalog was built, see deps/template_catalog.py
+      templateHooks = buildstack.getTemplateEntry(menuItem[0])["hooks"]
+      if not templateHooks == None:
+        if not "buildHooks" in menuItem[1]:
+          menuItem[1]["buildHooks"] = {}
+        if templateHooks["options"]:
+          menuItem[1]["buildHooks"]["options"] = True
 
   def executeServiceOptions():
     global dockerComposeServicesYaml
-    menuItem = menu[selection]
-    if menu[selection][1]["checked"] and "buildHooks" in menuItem[1] and "options" in menuItem[1]["buildHooks"] and menuItem[1]["buildHooks"]["options"]:
+    if len(visibleMenu) == 0:
+      return
+    menuItem = visibleMenu[selection]
+    if menuItem[1]["checked"] and "buildHooks" in menuItem[1] and "options" in menuItem[1]["buildHooks"] and menuItem[1]["buildHooks"]["options"]:
       buildScriptPath = templatesDirectory + '/' + menuItem[0] + '/' + buildScriptFile
       if os.path.exists(buildScriptPath):
-        with open(buildScriptPath, "rb") as pythonDynamicImportFile:
-          code = compile(pythonDynamicImportFile.read(), buildScriptPath, "exec")
+        code = loadHookCode(buildScriptPath)
 
         execGlobals = {
           "dockerComposeServicesYaml": dockerComposeServicesYaml,
@@ -510,10 +395,50 @@ def main():
           "renderMode": renderMode
         }
         execLocals = locals()
+        waitForIssueChecks()
         exec(code, execGlobals, execLocals)
         dockerComposeServicesYaml = execGlobals["dockerComposeServicesYaml"]
-        checkForIssues()
-        mainRender(menu, selection, 1)
+        requestIssueCheck()
+        mainRender(visibleMenu, selection, 1)
+
+  def startBuild(forceRebuild=False):
+    # forceRebuild runs every service's build hooks, not only those of the changed services
+    issueChecker.stop()
+    setCheckedMenuItems()
+    checkForIssues()
+    results["buildState"] = buildServices(forceRebuild)
+    return results["buildState"]
+
+  def getAllIssues():
+    allIssues = []
+    for menuItem in menu:
+      if "issues" in menuItem[1] and menuItem[1]["issues"]:
+        allIssues.append({ "serviceName": menuItem[0], "issues": menuItem[1]["issues"] })
+    return allIssues
+
+  def applyFilter(query, selection):
+    # Shows only the services matching query, and returns the new selection
+    global visibleMenu
+    global filterQuery
+    global templateFilter
+    global menuItemsByService
+    global paginationStartIndex
+    if templateFilter == None:
+      templateFilter = buildTemplateFilter(templatesList)
+      menuItemsByService = { menuItem[0]: menuItem for menuItem in menu }
+    selectedService = None
+    if selection < len(visibleMenu):
+      selectedService = visibleMenu[selection][0]
+
+    filterQuery = query
+    if filterQuery.strip() == "":
+      visibleMenu = menu
+    else:
+      visibleMenu = [menuItemsByService[serviceName] for serviceName in templateFilter.search(filterQuery)]
+    paginationStartIndex = 0
+    if visibleMenu is menu and not selectedService == None: # Keep the service selected while filtering
+      return getMenuItemIndexByService(selectedService)
+    return 0
 
   def getMenuItemIndexByService(serviceName):
     for (index, menuItem) in enumerate(menu):
@@ -525,18 +450,31 @@ def main():
     if menu[selection][1]["checked"] == True:
       menu[selection][1]["checked"] = False
       menu[selection][1]["issues"] = None
+      menu[selection][1]["checking"] = False
+      issueChecker.forgetService(menu[selection][0])
       del dockerComposeServicesYaml[menu[selection][0]]
     else:
       menu[selection][1]["checked"] = True
-      print(menu[selection][0])
+      menu[selection][1]["checking"] = True
       loadService(menu[selection][0])
 
+  def selectDependencies(serviceName):
+    # Also select every service the selected service depends on, see deps/dependency_graph.py
+    dependencyGraph = buildstack.loadDependencyGraph()
+    for dependencyName in resolveSelection([serviceName] + checkedMenuItems, dependencyGraph):
+      dependencyIndex = getMenuItemIndexByService(dependencyName)
+      if not menu[dependencyIndex][1]["checked"]:
+        checkMenuItem(dependencyIndex)
+
   def prepareMenuState():
+    # Restores the selection from the build cache in one pass, then checks every service once
     global dockerComposeServicesYaml
-    for (index, serviceName) in enumerate(dockerComposeServicesYaml):
-      checkMenuItem(getMenuItemIndexByService(serviceName))
-      setCheckedMenuItems()
-      checkForIssues()
+    for menuItem in menu:
+      if menuItem[0] in dockerComposeServicesYaml:
+        menuItem[1]["checked"] = True
+        menuItem[1]["checking"] = True
+    setCheckedMenuItems()
+    requestIssueCheck()
 
     return True
 
@@ -544,42 +482,48 @@ def main():
     global dockerComposeServicesYaml
     if os.path.exists(dockerSavePathOutput):
       print("Loading config fom: '%s'" % dockerSavePathOutput)
-      with open(r'%s' % dockerSavePathOutput) as fileSavedConfigs:
-        previousConfigs = yaml.load(fileSavedConfigs)
-        if not previousConfigs == None:
-          if "services" in previousConfigs:
-            dockerComposeServicesYaml = {}
-            for (index, serviceName) in enumerate(previousConfigs["services"]):
-              if serviceName in templatesList: # This ensures every service loaded has a template directory
-                dockerComposeServicesYaml[serviceName] = previousConfigs["services"][serviceName]
-            return True
+      previousConfigs = loadRoundTripFile(dockerSavePathOutput) # Saved services go back into docker-compose.yml
+      if not previousConfigs == None:
+        if "services" in previousConfigs:
+          dockerComposeServicesYaml = {}
+          for (index, serviceName) in enumerate(previousConfigs["services"]):
+            if serviceName in templatesList: # This ensures every service loaded has a template directory
+              dockerComposeServicesYaml[serviceName] = previousConfigs["services"][serviceName]
+          return True
     dockerComposeServicesYaml = {}
     return False
 
   def onResize(sig, action):
     global paginationToggle
     paginationToggle = [10, term.height - 25]
-    mainRender(menu, selection, 1)
+    mainRender(visibleMenu, selection, 1)
 
-  templatesList = generateTemplateList(templatesDirectoryFolders)
+  templatesList = buildstack.generateTemplateList()
   for directory in templatesList:
     menu.append([directory, { "checked": False, "issues": None }])
-
-  if __name__ == 'builtins':
-    global results
-    global signal
-    needsRender = 1
-    signal.signal(signal.SIGWINCH, onResize)
-    with term.fullscreen():
-      print('Loading...')
-      selection = 0
+  visibleMenu = menu
+
+  needsRender = 1
+  signal.signal(signal.SIGWINCH, onResize)
+  with term.fullscreen():
+    print('Loading...')
+    selection = 0
+    issueChecker = BackgroundIssueChecker()
+    try:
       if loadCurrentConfigs(templatesList):
         prepareMenuState()
-      mainRender(menu, selection, 1)
+      mainRender(visibleMenu, selection, 1)
       selectionInProgress = True
       with term.cbreak():
         while selectionInProgress:
-          key = term.inkey(esc_delay=0.05)
+          key = term.inkey(timeout=issuePollInterval, esc_delay=0.05)
+          if not key: # No key pressed, show any issue checks that have finished
+            changedRows = applyIssueUpdates()
+            if isIssuesBoxOutdated():
+              mainRender(visibleMenu, selection, 1)
+            elif len(changedRows) > 0:
+              mainRender(visibleMenu, selection, 3, changedRows)
+            continue
           if key.is_sequence:
             if key.name == 'KEY_TAB':
               needsRender = 1
@@ -590,26 +534,39 @@ def main():
                 paginationSize = paginationToggle[0]
             if key.name == 'KEY_DOWN':
               selection += 1
-              needsRender = 2
+              needsRender = 3
             if key.name == 'KEY_UP':
               selection -= 1
-              needsRender = 2
+              needsRender = 3
             if key.name == 'KEY_RIGHT':
               executeServiceOptions()
-            if key.name == 'KEY_ENTER':
-              setCheckedMenuItems()
-              checkForIssues()
-              selectionInProgress = False
-              results["buildState"] = buildServices()
-              return results["buildState"]
-            if key.name == 'KEY_ESCAPE':
+            if key.name == 'KEY_BACKSPACE' or key.name == 'KEY_DELETE':
+              if filterInProgress:
+                selection = applyFilter(filterQuery[:-1], selection)
+                needsRender = 1
+            if key.name == 'KEY_ENTER' and filterInProgress: # Stop typing, the filter stays
+              filterInProgress = False
+              needsRender = 1
+            elif key.name == 'KEY_ENTER':
+              return startBuild()
+            if key.name == 'KEY_ESCAPE' and (filterInProgress or not filterQuery == ""): # Clear the filter
+              filterInProgress = False
+              selection = applyFilter("", selection)
+              needsRender = 1
+            elif key.name == 'KEY_ESCAPE':
               results["buildState"] = False
               return results["buildState"]
           elif key:
-            if key == ' ': # Space pressed
-              checkMenuItem(selection) # Update checked list
+            if filterInProgress:
+              if key.isprintable():
+                selection = applyFilter(filterQuery + key, selection)
+                needsRender = 1
+            elif key == ' ' and len(visibleMenu) > 0: # Space pressed
+              checkMenuItem(getMenuItemIndexByService(visibleMenu[selection][0])) # Update checked list
+              if visibleMenu[selection][1]["checked"]:
+                selectDependencies(visibleMenu[selection][0])
               setCheckedMenuItems() # Update UI memory
-              checkForIssues()
+              requestIssueCheck()
               needsRender = 1
             elif key == 'h': # H pressed
               if hideHelpText:
@@ -617,14 +574,23 @@ def main():
               else:
                 hideHelpText = True
               needsRender = 1
-          else:
-            print(key)
-            time.sleep(0.5)
+            elif key == 'f': # F pressed
+              filterInProgress = True
+              needsRender = 1
+            elif key == 'r': # R pressed
+              return startBuild(forceRebuild=True)
 
-          selection = selection % len(menu)
+          changedRows = applyIssueUpdates()
+          if isIssuesBoxOutdated():
+            needsRender = 1
+          elif len(changedRows) > 0 and not needsRender == 1:
+            needsRender = 3
 
-          mainRender(menu, selection, needsRender)
+          if len(visibleMenu) > 0:
+            selection = selection % len(visibleMenu)
+          else:
+            selection = 0
 
-originalSignalHandler = signal.getsignal(signal.SIGINT)
-main()
-signal.signal(signal.SIGWINCH, originalSignalHandler)
+          mainRender(visibleMenu, selection, needsRender, changedRows)
+    finally:
+      issueChecker.stop()
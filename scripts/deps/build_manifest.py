@@ -0,0 +1,144 @@
+import os
+import json
+import hashlib
+from deps.yaml_io import readYamlFile
+from deps.hook_index import getHookCapabilities
+from deps.consts import servicesDirectory, templatesDirectory, buildManifestFile
+
+# The build manifest records, for each service in the last build, the hashes of:
+#  template: Every file in the service's ./.templates directory
+#  settings: The service's .yml settings files in ./services (build_settings.yml, addons_list.yml etc)
+#  compose:  The service's docker-compose config after its preBuild hook ran
+#  outputs:  The path, size and modified time of every file in the service's ./services directory,
+#            after its hooks ran. Files the hooks generate (a Dockerfile, a copied app) that were
+#            deleted or changed since the last build are then made again.
+# A service's hooks only need to run again when one of these has changed since the last build.
+# Hooks flagged "needsTerminal" (they run sudo or ask for input, see deps/hook_index.py) also
+# write outside ./services/<service> (esphome sets ./.env and copies a udev rule into /etc), which
+# isn't hashed here, so they always run.
+
+manifestVersion = 2
+
+# build_settings.yml password options that ask for the hooks to run on every build
+everyBuildPasswordOptions = [
+  "Randomise database password every build",
+  "Randomise passwords every build"
+]
+
+def hashFileInto(digest, filePath):
+  with open(filePath, 'rb') as objFile:
+    for chunk in iter(lambda: objFile.read(65536), b''):
+      digest.update(chunk)
+
+def getTemplateHash(serviceName):
+  digest = hashlib.sha256()
+  templatePath = templatesDirectory + serviceName
+  for (root, directories, files) in os.walk(templatePath):
+    directories.sort()
+    directories[:] = [directory for directory in directories if not directory == '__pycache__']
+    for fileName in sorted(files):
+      filePath = os.path.join(root, fileName)
+      digest.update(os.path.relpath(filePath, templatePath).encode('utf-8') + b'\0')
+      hashFileInto(digest, filePath)
+  return digest.hexdigest()
+
+def getSettingsHash(serviceName):
+  digest = hashlib.sha256()
+  servicePath = servicesDirectory + serviceName
+  if os.path.isdir(servicePath):
+    for fileName in sorted(os.listdir(servicePath)):
+      filePath = os.path.join(servicePath, fileName)
+      if fileName.endswith('.yml') and os.path.isfile(filePath):
+        digest.update(fileName.encode('utf-8') + b'\0')
+        hashFileInto(digest, filePath)
+  return digest.hexdigest()
+
+def getOutputsHash(serviceName):
+  # File signatures rather than their content, so large generated trees stay quick to check
+  digest = hashlib.sha256()
+  servicePath = servicesDirectory + serviceName
+  for (root, directories, files) in os.walk(servicePath):
+    directories.sort()
+    for fileName in sorted(files):
+      filePath = os.path.join(root, fileName)
+      try:
+        fileStat = os.stat(filePath)
+      except OSError: # A broken link
+        continue
+      digest.update("{path}\0{size}\0{mtime}\0".format(path=os.path.relpath(filePath, servicePath), size=fileStat.st_size, mtime=fileStat.st_mtime_ns).encode('utf-8'))
+  return digest.hexdigest()
+
+def getComposeHash(serviceYaml):
+  serialised = json.dumps(serviceYaml, sort_keys=True, default=str)
+  return hashlib.sha256(serialised.encode('utf-8')).hexdigest()
+
+def isRebuiltEveryBuild(serviceName):
+  # Some services have a password option like "Randomise database password every build"
+  # (databasePasswordOption in build_settings.yml), their hooks must always run even when
+  # nothing else has changed.
+  buildSettingsPath = servicesDirectory + serviceName + '/build_settings.yml'
+  if not os.path.exists(buildSettingsPath):
+    return False
+  try:
+    buildSettings = readYamlFile(buildSettingsPath)
+  except Exception: # Unreadable settings, the hooks report it
+    return True
+  if not isinstance(buildSettings, dict):
+    return False
+  for (optionName, optionValue) in buildSettings.items():
+    if str(optionName).endswith("PasswordOption") and optionValue in everyBuildPasswordOptions:
+      return True
+  return False
+
+def hasExternalSideEffects(serviceName):
+  # See the note at the top, these hooks check and restore the files they wrote themselves
+  buildScriptPath = templatesDirectory + '/' + serviceName + '/build.py'
+  return os.path.exists(buildScriptPath) and getHookCapabilities(buildScriptPath)["needsTerminal"]
+
+def getServiceHashes(serviceName, dockerComposeServicesYaml):
+  serviceYaml = None
+  if serviceName in dockerComposeServicesYaml:
+    serviceYaml = dockerComposeServicesYaml[serviceName]
+  return {
+    "template": getTemplateHash(serviceName),
+    "settings": getSettingsHash(serviceName),
+    "compose": getComposeHash(serviceYaml),
+    "outputs": getOutputsHash(serviceName)
+  }
+
+def loadBuildManifest():
+  try:
+    with open(buildManifestFile) as objManifestFile:
+      manifest = json.load(objManifestFile)
+    if manifest.get("version") == manifestVersion and isinstance(manifest.get("services"), dict):
+      return manifest
+  except (OSError, ValueError):
+    pass
+  return { "version": manifestVersion, "services": {} }
+
+def saveBuildManifest(manifest):
+  tempPath = "{path}.{pid}.tmp".format(path=buildManifestFile, pid=os.getpid())
+  try:
+    os.makedirs(servicesDirectory, exist_ok=True)
+    with open(tempPath, 'w') as objManifestFile:
+      json.dump(manifest, objManifestFile, indent=2, sort_keys=True)
+    os.replace(tempPath, buildManifestFile)
+    return True
+  except OSError:
+    return False
+
+def getChangedServices(serviceNames, dockerComposeServicesYaml, manifest):
+  changedServices = []
+  for serviceName in serviceNames:
+    previousHashes = manifest["services"].get(serviceName)
+    if previousHashes == None or isRebuiltEveryBuild(serviceName) or hasExternalSideEffects(serviceName):
+      changedServices.append(serviceName)
+    elif not getServiceHashes(serviceName, dockerComposeServicesYaml) == previousHashes:
+      changedServices.append(serviceName)
+  return changedServices
+
+def updateBuildManifest(serviceNames, dockerComposeServicesYaml):
+  manifest = { "version": manifestVersion, "services": {} }
+  for serviceName in serviceNames:
+    manifest["services"][serviceName] = getServiceHashes(serviceName, dockerComposeServicesYaml)
+  return manifest
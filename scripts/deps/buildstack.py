@@ -1,106 +1,240 @@
 import os
-import ruamel.yaml
-import math
-import sys
-from deps.yaml_merge import mergeYaml
-from deps.consts import servicesDirectory, templatesDirectory, volumesDirectory, buildCache, envFile, dockerPathOutput, servicesFileName, composeOverrideFile
+import subprocess
+import traceback
+from deps.yaml_io import loadRoundTrip, loadRoundTripFile
+from deps.compose_writer import writeComposeFile
+from deps.profiler import timeSpan
+from deps.hook_loader import loadHookCode
+from deps.hook_index import getHookCapabilities, saveHookIndex
+from deps.hook_scheduler import runHooks, defaultHookWorkers
+from deps.hook_runner import defaultHookTimeout
+from deps.dependency_graph import getDependencyGraph, getDependencyIssues
+from deps.template_catalog import getTemplateNames, getTemplateEntry, getTemplateDependencies
+from deps.port_registry import sharedPortRegistry
+from deps.issue_cache import getIssuesKey, getCachedIssues, storeIssues, saveIssuesCache
+from deps.build_manifest import loadBuildManifest, saveBuildManifest, getChangedServices, updateBuildManifest
+from deps.consts import servicesDirectory, templatesDirectory, buildCache, envFile, dockerPathOutput, composeOverrideFile
 
-yaml = ruamel.yaml.YAML()
-yaml.preserve_quotes = True
+# Builds docker-compose.yml from a list of service names. This is used by the Build Stack
+# menu, and by scripts/build.py to build without the menu. Set interactive to False to
+# never wait for input, errors are then printed and reported through the return values.
 
 buildScriptFile = 'build.py'
 
-def buildServices(dockerComposeServicesYaml):
+def getBuildScriptPath(serviceName):
+  return templatesDirectory + '/' + serviceName + '/' + buildScriptFile
+
+def pauseOnError(interactive, message="Press Enter to continue..."):
+  if interactive:
+    input(message)
+
+def generateTemplateList():
+  return getTemplateNames()
+
+def loadService(serviceName):
+  # Parsed round trip from the catalog's copy of service.yml, so comments and quotes are kept
+  return loadRoundTrip(getTemplateEntry(serviceName)["serviceText"])[serviceName]
+
+def loadDependencyGraph():
+  return getDependencyGraph(getTemplateDependencies())
+
+def loadBuildCache():
+  if os.path.exists(buildCache):
+    with timeSpan("Load build cache", "load"):
+      previousConfigs = loadRoundTripFile(buildCache)
+    if previousConfigs and "services" in previousConfigs and previousConfigs["services"]:
+      return previousConfigs["services"]
+  return {}
+
+def loadServices(serviceNames, useBuildCache=True):
+  # Services from the last build keep their saved config (passwords, changed ports etc)
+  savedServices = {}
+  if useBuildCache:
+    savedServices = loadBuildCache()
+  dockerComposeServicesYaml = {}
+  for serviceName in serviceNames:
+    if serviceName in savedServices:
+      dockerComposeServicesYaml[serviceName] = savedServices[serviceName]
+    else:
+      with timeSpan("Load template", "load", serviceName):
+        dockerComposeServicesYaml[serviceName] = loadService(serviceName)
+  return dockerComposeServicesYaml
+
+def runServiceHook(serviceName, toRun, dockerComposeServicesYaml, extraGlobals=None):
+  buildScriptPath = getBuildScriptPath(serviceName)
+  code = loadHookCode(buildScriptPath)
+  execGlobals = {
+    "dockerComposeServicesYaml": dockerComposeServicesYaml,
+    "toRun": toRun,
+    "currentServiceName": serviceName
+  }
+  if extraGlobals:
+    execGlobals.update(extraGlobals)
+  execLocals = {}
+  exec(code, execGlobals, execLocals)
+  return execGlobals
+
+def hasRunChecksHook(serviceName):
+  buildScriptPath = getBuildScriptPath(serviceName)
+  return os.path.exists(buildScriptPath) and getHookCapabilities(buildScriptPath)["runChecksHook"]
+
+def hookNeedsTerminal(serviceName):
+  # True if the service's build.py runs sudo or calls input(), see deps/hook_index.py
+  buildScriptPath = getBuildScriptPath(serviceName)
+  return os.path.exists(buildScriptPath) and getHookCapabilities(buildScriptPath)["needsTerminal"]
+
+def getServiceIssues(serviceName, dockerComposeServicesYaml, issuesKey=None, interactive=True, hookRunner=None):
+  # Returns the issues from the service's runChecks hook, or None if it has no build script.
+  # With an issuesKey, stored issues are reused and new ones are stored, see deps/issue_cache.py
+  # hookRunner(serviceName, toRun) runs the hook somewhere else and returns its globals, it's exec()ed here by default
+  buildScriptPath = getBuildScriptPath(serviceName)
+  if not os.path.exists(buildScriptPath):
+    return None
+  try:
+    if not getHookCapabilities(buildScriptPath)["runChecksHook"]:
+      return []
+    if not issuesKey == None:
+      cachedIssues = getCachedIssues(serviceName, issuesKey)
+      if not cachedIssues == None:
+        return cachedIssues
+    serviceIssues = []
+    with timeSpan("runChecks", "checks", serviceName):
+      if hookRunner == None:
+        execGlobals = runServiceHook(serviceName, "runChecks", dockerComposeServicesYaml)
+      else:
+        execGlobals = hookRunner(serviceName, "runChecks")
+    if "issues" in execGlobals and len(execGlobals["issues"]) > 0:
+      serviceIssues = execGlobals["issues"]
+    if not issuesKey == None:
+      storeIssues(serviceName, issuesKey, serviceIssues)
+    return serviceIssues
+  except Exception as err:
+    print("Error running checkForIssues on '%s'" % serviceName)
+    traceback.print_exc()
+    pauseOnError(interactive)
+    return { "checkError": str(err) }
+
+def addDependencyIssues(serviceNames, serviceIssues):
+  dependencyIssues = getDependencyIssues(serviceNames, loadDependencyGraph())
+  for (serviceName, issues) in dependencyIssues.items():
+    if serviceName in serviceIssues and serviceIssues[serviceName]:
+      issues = dict(serviceIssues[serviceName], **issues)
+    serviceIssues[serviceName] = issues
+  return serviceIssues
+
+def checkForIssues(serviceNames, dockerComposeServicesYaml, interactive=True, useIssuesCache=True):
+  # Returns {serviceName: issues} for each service that has a build script, or a dependency issue.
+  # A service's runChecks hook only runs when it has no stored issues for its current key, see deps/issue_cache.py
+  serviceIssues = {}
+  with sharedPortRegistry(dockerComposeServicesYaml): # runChecks hooks only read the ports
+    for serviceName in serviceNames:
+      issuesKey = None
+      if useIssuesCache and hasRunChecksHook(serviceName):
+        issuesKey = getIssuesKey(serviceName, dockerComposeServicesYaml)
+      issues = getServiceIssues(serviceName, dockerComposeServicesYaml, issuesKey, interactive)
+      if not issues == None:
+        serviceIssues[serviceName] = issues
+  saveHookIndex()
+  saveIssuesCache()
+  return addDependencyIssues(serviceNames, serviceIssues)
+
+def runBuildHooks(serviceNames, toRun, hookName, hookLabel, dockerComposeServicesYaml, interactive=True, hookWorkers=defaultHookWorkers, hookTimeout=defaultHookTimeout, shouldCancel=None):
+  # Independent services' hooks run in parallel, see deps/hook_scheduler.py
+  # With a hookTimeout (seconds) each hook runs in a worker process, see deps/hook_runner.py. 0 runs them in this process.
+  # Hooks that need the terminal (sudo or input()) always run in this process, see deps/hook_index.py
+  hookTargets = []
+  terminalServices = set()
+  for serviceName in serviceNames:
+    buildScriptPath = getBuildScriptPath(serviceName)
+    if os.path.exists(buildScriptPath) and getHookCapabilities(buildScriptPath)[hookName]:
+      hookTargets.append((serviceName, buildScriptPath))
+      if getHookCapabilities(buildScriptPath)["needsTerminal"]:
+        terminalServices.add(serviceName)
+  saveHookIndex()
+
+  failedServices = []
+  for hookResult in runHooks(hookTargets, toRun, dockerComposeServicesYaml, maxWorkers=hookWorkers, hookTimeout=hookTimeout, shouldCancel=shouldCancel, terminalServices=terminalServices):
+    if not hookResult["error"] == None:
+      print("Error running {hookLabel} on '{service}': {error}".format(hookLabel=hookLabel, service=hookResult["serviceName"], error=hookResult["error"]))
+      failedServices.append(hookResult["serviceName"])
+  if len(failedServices) > 0:
+    pauseOnError(interactive)
+  return failedServices
+
+def runPrebuildHook(serviceNames, dockerComposeServicesYaml, interactive=True, hookWorkers=defaultHookWorkers, hookTimeout=defaultHookTimeout, shouldCancel=None):
+  return runBuildHooks(serviceNames, "preBuild", "preBuildHook", "PreBuildHook", dockerComposeServicesYaml, interactive, hookWorkers, hookTimeout, shouldCancel)
+
+def runPostBuildHook(serviceNames, dockerComposeServicesYaml, interactive=True, hookWorkers=defaultHookWorkers, hookTimeout=defaultHookTimeout, shouldCancel=None):
+  return runBuildHooks(serviceNames, "postBuild", "postBuildHook", "PostBuildHook", dockerComposeServicesYaml, interactive, hookWorkers, hookTimeout, shouldCancel)
+
+def runPostBuildScript(dockerComposeServicesYaml):
+  if os.path.exists('./postbuild.sh'):
+    servicesList = ""
+    for serviceName in dockerComposeServicesYaml:
+      servicesList += " " + serviceName
+    with timeSpan("postbuild.sh", "postbuild"):
+      return subprocess.call("./postbuild.sh" + servicesList, shell=True)
+  return 0
+
+def buildServices(serviceNames, dockerComposeServicesYaml, interactive=True, forceRebuild=False, hookWorkers=defaultHookWorkers, hookTimeout=defaultHookTimeout, shouldCancel=None):
+  # buildState is True once docker-compose.yml is written. Hooks that errored are listed in failedHooks.
+  # composeChanges lists the services added, changed and removed in docker-compose.yml, see deps/compose_writer.py
+  # Only services whose template, settings or config changed since the last build have their hooks run,
+  # unless forceRebuild is set. See deps/build_manifest.py
+  # shouldCancel() is polled while hooks run in worker processes, running hooks are stopped once it returns True.
+  buildResults = {
+    "buildState": False,
+    "failedHooks": [],
+    "changedServices": [],
+    "unchangedServices": [],
+    "composeChanges": None,
+    "postBuildScriptExitCode": 0
+  }
   try:
-    runPrebuildHook()
-    dockerFileYaml = {}
+    with timeSpan("Find changed services", "manifest"):
+      if forceRebuild:
+        changedServices = list(serviceNames)
+      else:
+        changedServices = getChangedServices(serviceNames, dockerComposeServicesYaml, loadBuildManifest())
+    buildResults["changedServices"] = changedServices
+    buildResults["unchangedServices"] = [serviceName for serviceName in serviceNames if not serviceName in changedServices]
+    if len(buildResults["unchangedServices"]) > 0:
+      print("{count} services unchanged since the last build".format(count=len(buildResults["unchangedServices"])))
+
+    buildResults["failedHooks"] += runPrebuildHook(changedServices, dockerComposeServicesYaml, interactive, hookWorkers, hookTimeout, shouldCancel)
     menuStateFileYaml = {}
-    dockerFileYaml["version"] = "3.6"
-    dockerFileYaml["services"] = {}
-    menuStateFileYaml["services"] = {}
-    dockerFileYaml["services"] = dockerComposeServicesYaml
     menuStateFileYaml["services"] = dockerComposeServicesYaml
 
-    if os.path.exists(envFile):
-      with open(r'%s' % envFile) as fileEnv:
-        envSettings = yaml.load(fileEnv)
-      mergedYaml = mergeYaml(envSettings, dockerFileYaml)
-      dockerFileYaml = mergedYaml
+    with timeSpan("Load docker-compose-base.yml", "load"):
+      dockerFileYaml = loadRoundTripFile(envFile)
+    dockerFileYaml["services"] = dockerComposeServicesYaml
 
     if os.path.exists(composeOverrideFile):
-      with open(r'%s' % composeOverrideFile) as fileOverride:
-        yamlOverride = yaml.load(fileOverride)
+      from deps.yaml_merge import mergeYaml, splitMergeStrategies # Imports ruamel.yaml, only needed here
+      with timeSpan("Merge compose-override.yml", "merge"):
+        yamlOverride, mergeStrategies = splitMergeStrategies(loadRoundTripFile(composeOverrideFile))
+        mergedYaml = mergeYaml(yamlOverride, dockerFileYaml, mergeStrategies)
+        dockerFileYaml = mergedYaml
+
+    with timeSpan("Write docker-compose.yml", "write"):
+      buildResults["composeChanges"] = writeComposeFile(dockerPathOutput, dockerFileYaml, showDiff=True)["diff"]
+
+    if not os.path.exists(servicesDirectory):
+      os.makedirs(servicesDirectory, exist_ok=True)
 
-      mergedYaml = mergeYaml(yamlOverride, dockerFileYaml)
-      dockerFileYaml = mergedYaml
+    with timeSpan("Write build cache", "write"):
+      writeComposeFile(buildCache, menuStateFileYaml)
+    buildResults["buildState"] = True
 
-    with open(r'%s' % dockerPathOutput, 'w') as outputFile:
-      yaml.dump(dockerFileYaml, outputFile, explicit_start=True, default_style='"')
+    buildResults["failedHooks"] += runPostBuildHook(changedServices, dockerComposeServicesYaml, interactive, hookWorkers, hookTimeout, shouldCancel)
 
-    with open(r'%s' % buildCache, 'w') as outputFile:
-      yaml.dump(menuStateFileYaml, outputFile, explicit_start=True, default_style='"')
-    runPostBuildHook()
-    return True
-  except Exception as err: 
+    # Services with failed hooks are left out, so that they run again on the next build
+    builtServices = [serviceName for serviceName in serviceNames if not serviceName in buildResults["failedHooks"]]
+    with timeSpan("Save build manifest", "manifest"):
+      saveBuildManifest(updateBuildManifest(builtServices, dockerComposeServicesYaml))
+    buildResults["postBuildScriptExitCode"] = runPostBuildScript(dockerComposeServicesYaml)
+  except Exception as err:
     print("Issue running build:")
-    print(err)
-    input("Press Enter to continue...")
-    return False
-
-def runPrebuildHook(dockerComposeServicesYaml):
-  for (index, checkedMenuItem) in enumerate(checkedMenuItems):
-    buildScriptPath = templatesDirectory + '/' + checkedMenuItem + '/' + buildScriptFile
-    if os.path.exists(buildScriptPath):
-        with open(buildScriptPath, "rb") as pythonDynamicImportFile:
-          code = compile(pythonDynamicImportFile.read(), buildScriptPath, "exec")
-        execGlobals = {
-          "dockerComposeServicesYaml": dockerComposeServicesYaml,
-          "toRun": "checkForPreBuildHook",
-          "currentServiceName": checkedMenuItem
-        }
-        execLocals = locals()
-        try:
-          exec(code, execGlobals, execLocals)
-          if "preBuildHook" in execGlobals["buildHooks"] and execGlobals["buildHooks"]["preBuildHook"]:
-            execGlobals = {
-              "dockerComposeServicesYaml": dockerComposeServicesYaml,
-              "toRun": "preBuild",
-              "currentServiceName": checkedMenuItem
-            }
-            execLocals = locals()
-            exec(code, execGlobals, execLocals)
-        except Exception as err:
-          print("Error running PreBuildHook on '%s'" % checkedMenuItem)
-          print(err)
-          input("Press Enter to continue...")
-          try: # If the prebuild hook modified the docker-compose object, pull it from the script back to here.
-            dockerComposeServicesYaml = execGlobals["dockerComposeServicesYaml"]
-          except:
-            pass
-
-def runPostBuildHook():
-  for (index, checkedMenuItem) in enumerate(checkedMenuItems):
-    buildScriptPath = templatesDirectory + '/' + checkedMenuItem + '/' + buildScriptFile
-    if os.path.exists(buildScriptPath):
-        with open(buildScriptPath, "rb") as pythonDynamicImportFile:
-          code = compile(pythonDynamicImportFile.read(), buildScriptPath, "exec")
-        execGlobals = {
-          "dockerComposeServicesYaml": dockerComposeServicesYaml,
-          "toRun": "checkForPostBuildHook",
-          "currentServiceName": checkedMenuItem
-        }
-        execLocals = locals()
-        try:
-          exec(code, execGlobals, execLocals)
-          if "postBuildHook" in execGlobals["buildHooks"] and execGlobals["buildHooks"]["postBuildHook"]:
-            execGlobals = {
-              "dockerComposeServicesYaml": dockerComposeServicesYaml,
-              "toRun": "postBuild",
-              "currentServiceName": checkedMenuItem
-            }
-            execLocals = locals()
-            exec(code, execGlobals, execLocals)
-        except Exception as err:
-          print("Error running PostBuildHook on '%s'" % checkedMenuItem)
-          print(err)
-          input("Press Enter to continue...")
+    traceback.print_exc()
+    pauseOnError(interactive)
+  return buildResults
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 specialChars = {
   "latin": {
     "rightArrowFull": "►",
@@ -40,33 +42,46 @@ specialChars = {
   }
 }
 
+# The borders and lines below are the same for a renderMode and size every time, and are
+# drawn many times per frame, so each is built once and then looked up.
+
+@lru_cache(maxsize=None)
 def commonTopBorder(renderMode, size=80):
-  output = ""
-  output += "{btl}".format(btl=specialChars[renderMode]["borderTopLeft"])
-  for i in range(size):
-    output += "{bh}".format(bh=specialChars[renderMode]["borderHorizontal"])
-  output += "{btr}".format(btr=specialChars[renderMode]["borderTopRight"])
-  return output
+  return specialChars[renderMode]["borderTopLeft"] + specialChars[renderMode]["borderHorizontal"] * size + specialChars[renderMode]["borderTopRight"]
 
+@lru_cache(maxsize=None)
+def commonTitledTopBorder(renderMode, title, size=80, titleOffset=6):
+  # A top border with a title in it: "╔══════ Build Issues ════...╗"
+  titleText = " {title} ".format(title=title)
+  return (specialChars[renderMode]["borderTopLeft"]
+    + specialChars[renderMode]["borderHorizontal"] * titleOffset
+    + titleText
+    + specialChars[renderMode]["borderHorizontal"] * (size - titleOffset - len(titleText))
+    + specialChars[renderMode]["borderTopRight"])
+
+@lru_cache(maxsize=None)
 def commonBottomBorder(renderMode, size=80):
-  output = ""
-  output += "{bbl}".format(bbl=specialChars[renderMode]["borderBottomLeft"])
-  for i in range(size):
-    output += "{bh}".format(bh=specialChars[renderMode]["borderHorizontal"])
-  output += "{bbr}".format(bbr=specialChars[renderMode]["borderBottomRight"])
-  return output
+  return specialChars[renderMode]["borderBottomLeft"] + specialChars[renderMode]["borderHorizontal"] * size + specialChars[renderMode]["borderBottomRight"]
 
+@lru_cache(maxsize=1024)
 def padText(text, size=45):
-  output = ""
-  output += text
-  for i in range(size - len(text)):
-    output += " "
-  return output
+  return text + " " * (size - len(text))
 
+@lru_cache(maxsize=None)
 def commonEmptyLine(renderMode, size=80):
-  output = ""
-  output += "{bv}".format(bv=specialChars[renderMode]["borderVertical"])
-  for i in range(size):
-    output += " "
-  output += "{bv}".format(bv=specialChars[renderMode]["borderVertical"])
-  return output
+  return specialChars[renderMode]["borderVertical"] + " " * size + specialChars[renderMode]["borderVertical"]
+
+@lru_cache(maxsize=None)
+def commonScrollLine(renderMode, direction):
+  # The arrows shown in a paginated menu when there are more items above (direction < 0) or below (direction > 0)
+  if direction < 0:
+    arrowFull = specialChars[renderMode]["upArrowFull"]
+    arrowLine = specialChars[renderMode]["upArrowLine"]
+  else:
+    arrowFull = specialChars[renderMode]["downArrowFull"]
+    arrowLine = specialChars[renderMode]["downArrowLine"]
+  return "{b}       {af}      {af}{af}{af}                                                   {al}           {b}".format(
+    b=specialChars[renderMode]["borderVertical"],
+    af=arrowFull,
+    al=arrowLine
+  )
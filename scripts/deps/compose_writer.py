@@ -0,0 +1,114 @@
+import os
+import stat
+from deps.yaml_io import readYaml, dumpRoundTrip
+
+# Writes docker-compose.yml (and the build cache) safely:
+#  * The new content is written to a temp file next to the target, then compared with the
+#    existing file. The temp file only replaces the target (os.replace) if they differ, so an
+#    unchanged build doesn't touch the file, and a crash mid write never leaves half a file.
+#  * The services in the old and new files are compared, so the build can report which
+#    containers 'docker-compose up -d' will create, recreate or remove.
+
+def getTempPath(filePath):
+  directory, fileName = os.path.split(filePath)
+  return os.path.join(directory, ".{fileName}.{pid}.tmp".format(fileName=fileName, pid=os.getpid()))
+
+def readExistingContent(filePath):
+  try:
+    with open(filePath, 'rb') as objExistingFile:
+      return objExistingFile.read()
+  except OSError:
+    return None
+
+def parseServices(content):
+  # Returns ({serviceName: config}, {topLevelKey: value}) or (None, None) if unreadable
+  try:
+    composeYaml = readYaml(content) or {}
+  except Exception:
+    return None, None
+  services = composeYaml.get("services") or {}
+  otherKeys = { key: value for (key, value) in composeYaml.items() if not key == "services" }
+  return services, otherKeys
+
+def getComposeDiff(oldContent, newContent):
+  composeDiff = {
+    "added": [],
+    "removed": [],
+    "changed": {}, # serviceName: [changed keys]
+    "unchanged": [],
+    "otherChanges": [] # Top level keys, such as networks
+  }
+  newServices, newOtherKeys = parseServices(newContent)
+  if newServices == None:
+    return composeDiff
+  oldServices, oldOtherKeys = ({}, {})
+  if not oldContent == None:
+    oldServices, oldOtherKeys = parseServices(oldContent)
+    if oldServices == None:
+      oldServices, oldOtherKeys = ({}, {})
+
+  for (serviceName, serviceYaml) in newServices.items():
+    if not serviceName in oldServices:
+      composeDiff["added"].append(serviceName)
+    elif oldServices[serviceName] == serviceYaml:
+      composeDiff["unchanged"].append(serviceName)
+    else:
+      oldServiceYaml = oldServices[serviceName] or {}
+      serviceYaml = serviceYaml or {}
+      changedKeys = [key for key in serviceYaml if not oldServiceYaml.get(key) == serviceYaml[key]]
+      changedKeys += [key for key in oldServiceYaml if not key in serviceYaml]
+      composeDiff["changed"][serviceName] = changedKeys
+  composeDiff["removed"] = [serviceName for serviceName in oldServices if not serviceName in newServices]
+
+  for key in list(newOtherKeys) + [key for key in oldOtherKeys if not key in newOtherKeys]:
+    if not oldOtherKeys.get(key) == newOtherKeys.get(key):
+      composeDiff["otherChanges"].append(key)
+  return composeDiff
+
+def printComposeDiff(filePath, composeDiff, fileWritten):
+  if not fileWritten:
+    print("No changes to '{filePath}'".format(filePath=filePath))
+    return
+  print("Changes to '{filePath}':".format(filePath=filePath))
+  for serviceName in composeDiff["added"]:
+    print("  + {service} (new)".format(service=serviceName))
+  for (serviceName, changedKeys) in composeDiff["changed"].items():
+    print("  ~ {service} (recreated, changed: {keys})".format(service=serviceName, keys=", ".join(str(key) for key in changedKeys)))
+  for serviceName in composeDiff["removed"]:
+    print("  - {service} (removed)".format(service=serviceName))
+  for key in composeDiff["otherChanges"]:
+    print("  ~ {key}".format(key=key))
+  if len(composeDiff["unchanged"]) > 0:
+    print("  {count} services unchanged".format(count=len(composeDiff["unchanged"])))
+
+def writeComposeFile(filePath, yamlData, showDiff=False):
+  # Returns {"written": True if the file was replaced, "diff": see getComposeDiff()}
+  tempPath = getTempPath(filePath)
+  try:
+    with open(tempPath, 'w') as objTempFile:
+      dumpRoundTrip(yamlData, objTempFile)
+      objTempFile.flush()
+      os.fsync(objTempFile.fileno())
+    with open(tempPath, 'rb') as objTempFile:
+      newContent = objTempFile.read()
+
+    oldContent = readExistingContent(filePath)
+    writeResult = {
+      "written": False,
+      "diff": getComposeDiff(oldContent, newContent)
+    }
+    if oldContent == newContent:
+      os.remove(tempPath)
+    else:
+      if not oldContent == None:
+        os.chmod(tempPath, stat.S_IMODE(os.stat(filePath).st_mode))
+      os.replace(tempPath, filePath)
+      writeResult["written"] = True
+  except Exception:
+    if os.path.exists(tempPath):
+      os.remove(tempPath)
+    raise
+
+  if showDiff:
+    printComposeDiff(filePath, writeResult["diff"], writeResult["written"])
+  return writeResult
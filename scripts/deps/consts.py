@@ -10,3 +10,9 @@ envFile = templatesDirectory + 'docker-compose-base.yml'
 dockerPathOutput = './docker-compose.yml'
 servicesFileName = 'service.yml'
 ifCheckList = ['eth0', 'wlan0']
+hookCacheDirectory = tempDirectory + 'hook_cache/'
+hookIndexFile = tempDirectory + 'hook_index.json'
+buildManifestFile = servicesDirectory + 'build_manifest.json'
+templateCatalogFile = tempDirectory + 'templates_catalog.json'
+issuesCacheFile = tempDirectory + 'issues_cache.json'
+startupProbesFile = tempDirectory + 'startup_probes.json'
@@ -0,0 +1,140 @@
+# A graph of the depends_on entries of every template's service.yml (taken from the
+# template catalog, see deps/template_catalog.py). It is used to:
+#  * Select the services a service depends on (and the ones they depend on) in the build menu
+#  * Report services whose dependencies aren't selected, and circular dependencies
+#  * Order the stack into waves, where each service comes after the services it depends on
+#
+# depends_on entries that name another service in the same service.yml (such as gitea_db in
+# gitea's template) are provided by the template itself and aren't part of the graph.
+
+lastGraphKey = None
+lastGraph = None
+
+def getDependsOn(serviceYaml):
+  # depends_on can be a list of names, or a dict of names to conditions (long syntax)
+  try:
+    dependsOn = serviceYaml["depends_on"]
+  except (KeyError, TypeError):
+    return []
+  if isinstance(dependsOn, dict):
+    return [str(dependencyName) for dependencyName in dependsOn.keys()]
+  if isinstance(dependsOn, list):
+    return [str(dependencyName) for dependencyName in dependsOn]
+  return []
+
+def getDependencyGraph(templateDependencies):
+  # templateDependencies: {templateName: [depends_on, ...]}
+  # Returns:
+  #  dependsOn:  {templateName: [templateName, ...]} The templates each template depends on
+  #  unresolved: {templateName: [serviceName, ...]}  depends_on entries that no template provides
+  #  cycles:     [templateName, ...]                 Templates that are part of a circular dependency
+  # The graph is only rebuilt when a template's depends_on changes.
+  global lastGraphKey
+  global lastGraph
+  templateNames = set(templateDependencies)
+  graphKey = repr(sorted(templateDependencies.items()))
+  if lastGraph == None or not graphKey == lastGraphKey:
+    dependsOn = {}
+    unresolved = {}
+    for (templateName, dependencyNames) in templateDependencies.items():
+      dependsOn[templateName] = [dependencyName for dependencyName in dependencyNames if dependencyName in templateNames]
+      missingDependencies = [dependencyName for dependencyName in dependencyNames if not dependencyName in templateNames]
+      if len(missingDependencies) > 0:
+        unresolved[templateName] = missingDependencies
+    lastGraph = {
+      "dependsOn": dependsOn,
+      "unresolved": unresolved,
+      "cycles": findCycles(list(templateDependencies), dependsOn)
+    }
+    lastGraphKey = graphKey
+  return lastGraph
+
+def getTopologicalWaves(serviceNames, dependsOn):
+  # Kahn's algorithm, in waves. Each wave only depends on services in earlier waves, and
+  # services keep the order they were given in within a wave. Dependencies that aren't in
+  # serviceNames are ignored. Returns (waves, cyclicServices), where cyclicServices could
+  # not be ordered because they're part of, or depend on, a circular dependency.
+  serviceSet = set(serviceNames)
+  remainingDependencies = {}
+  dependents = {}
+  for serviceName in serviceNames:
+    dependencies = set(dependencyName for dependencyName in dependsOn.get(serviceName, []) if dependencyName in serviceSet and not dependencyName == serviceName)
+    remainingDependencies[serviceName] = len(dependencies)
+    for dependencyName in dependencies:
+      dependents.setdefault(dependencyName, []).append(serviceName)
+
+  waves = []
+  wave = [serviceName for serviceName in serviceNames if remainingDependencies[serviceName] == 0]
+  while len(wave) > 0:
+    waves.append(wave)
+    readyServices = set()
+    for serviceName in wave:
+      for dependentName in dependents.get(serviceName, []):
+        remainingDependencies[dependentName] -= 1
+        if remainingDependencies[dependentName] == 0:
+          readyServices.add(dependentName)
+    wave = [serviceName for serviceName in serviceNames if serviceName in readyServices]
+
+  cyclicServices = [serviceName for serviceName in serviceNames if remainingDependencies[serviceName] > 0]
+  return waves, cyclicServices
+
+def findCycles(serviceNames, dependsOn):
+  # Services left over by getTopologicalWaves() are in a cycle, or depend on one. Only
+  # the ones that can reach themselves through their dependencies are in a cycle.
+  cyclicServices = []
+  for serviceName in getTopologicalWaves(serviceNames, dependsOn)[1]:
+    visited = set()
+    toVisit = list(dependsOn.get(serviceName, []))
+    while len(toVisit) > 0:
+      dependencyName = toVisit.pop()
+      if dependencyName == serviceName:
+        cyclicServices.append(serviceName)
+        break
+      if not dependencyName in visited:
+        visited.add(dependencyName)
+        toVisit += dependsOn.get(dependencyName, [])
+  return cyclicServices
+
+def getStartWaves(serviceNames, dependsOn):
+  # Services in a circular dependency are started together, after everything else
+  waves, cyclicServices = getTopologicalWaves(serviceNames, dependsOn)
+  if len(cyclicServices) > 0:
+    waves.append(cyclicServices)
+  return waves
+
+def getComposeDependsOn(dockerComposeServicesYaml):
+  dependsOn = {}
+  for serviceName in dockerComposeServicesYaml:
+    dependsOn[serviceName] = getDependsOn(dockerComposeServicesYaml[serviceName])
+  return dependsOn
+
+def resolveSelection(serviceNames, graph):
+  # Returns the services to add to the selection so that everything the selected services
+  # depend on, directly or through another service, is also selected.
+  selectedServices = set(serviceNames)
+  addedServices = []
+  toVisit = list(serviceNames)
+  while len(toVisit) > 0:
+    serviceName = toVisit.pop(0)
+    for dependencyName in graph["dependsOn"].get(serviceName, []):
+      if not dependencyName in selectedServices:
+        selectedServices.add(dependencyName)
+        addedServices.append(dependencyName)
+        toVisit.append(dependencyName)
+  return addedServices
+
+def getDependencyIssues(serviceNames, graph):
+  # Returns {serviceName: issues} for selected services with missing or circular dependencies
+  dependencyIssues = {}
+  selectedServices = set(serviceNames)
+  for serviceName in serviceNames:
+    issues = {}
+    missingServices = [dependencyName for dependencyName in graph["dependsOn"].get(serviceName, []) if not dependencyName in selectedServices]
+    missingServices += graph["unresolved"].get(serviceName, [])
+    if len(missingServices) > 0:
+      issues["dependsOn"] = missingServices
+    if serviceName in graph["cycles"]:
+      issues["dependencyCycle"] = [dependencyName for dependencyName in graph["dependsOn"].get(serviceName, []) if dependencyName in graph["cycles"]]
+    if len(issues) > 0:
+      dependencyIssues[serviceName] = issues
+  return dependencyIssues
@@ -0,0 +1,225 @@
+import os
+import json
+import socket
+import http.client
+from urllib.parse import quote, urlencode
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# A small client for the Docker Engine API, spoken over the daemon's unix socket rather than by
+# starting a 'docker' CLI process for each command. Requests share one HTTP/1.1 connection,
+# which is opened on the first request and opened again if the daemon closed it.
+#
+# To use it:
+#   dockerApi = getDockerApi()
+#   if dockerApi.isAvailable():
+#     for container in dockerApi.listContainers():
+#       dockerApi.restartContainer(container["Id"])
+#
+# Errors returned by the daemon raise DockerApiError, with the HTTP status and the daemon's
+# message. Not being able to reach the socket raises OSError, such as PermissionError when the
+# user isn't in the docker group. isAvailable() only checks that the socket exists, so callers
+# can fall back to the CLI when DOCKER_HOST points somewhere else.
+#
+# The Engine API has no equivalent of docker-compose, so 'docker-compose up', 'down', 'pull'
+# and 'logs' are still run with the CLI.
+
+defaultSocketPath = '/var/run/docker.sock'
+requestTimeout = 30 # Seconds, streams (events) have no timeout
+maxParallelRequests = 16 # Connections open at once in stopContainers()
+clientTimeout = object() # sendRequest()'s default, the timeout the client was created with
+
+class DockerApiError(RuntimeError):
+  def __init__(self, status, message):
+    super().__init__("Docker API error {status}: {message}".format(status=status, message=message))
+    self.status = status
+    self.message = message
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+  def __init__(self, socketPath, timeout=None):
+    super().__init__('localhost', timeout=timeout) # The daemon expects a Host header, any host will do
+    self.socketPath = socketPath
+
+  def connect(self):
+    self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+      if not self.timeout == None:
+        self.sock.settimeout(self.timeout)
+      self.sock.connect(self.socketPath)
+    except OSError:
+      self.sock.close()
+      self.sock = None
+      raise
+
+def getSocketPath():
+  dockerHost = os.environ.get("DOCKER_HOST", "")
+  if dockerHost.startswith("unix://"):
+    return dockerHost[len("unix://"):]
+  if not dockerHost == "":
+    return None # tcp:// or ssh://, only the CLI can reach it
+  return defaultSocketPath
+
+def getErrorMessage(responseBody):
+  try:
+    return json.loads(responseBody)["message"]
+  except (ValueError, KeyError, TypeError):
+    return responseBody.decode("utf-8", "replace").strip()
+
+class DockerApi:
+  def __init__(self, socketPath=None, timeout=requestTimeout):
+    self.socketPath = socketPath or getSocketPath()
+    self.timeout = timeout
+    self.connection = None
+
+  def isAvailable(self):
+    return not self.socketPath == None and os.path.exists(self.socketPath)
+
+  def close(self):
+    if not self.connection == None:
+      self.connection.close()
+      self.connection = None
+
+  def getConnection(self):
+    if self.socketPath == None:
+      raise FileNotFoundError("DOCKER_HOST is not a unix socket: {host}".format(host=os.environ.get("DOCKER_HOST")))
+    if self.connection == None:
+      self.connection = UnixHTTPConnection(self.socketPath, timeout=self.timeout)
+    return self.connection
+
+  def request(self, method, path, query=None, body=None):
+    # Returns the decoded JSON response, or None when the response has no body
+    (status, responseBody) = self.sendRequest(method, path, query, body)
+    if len(responseBody) == 0:
+      return None
+    return json.loads(responseBody)
+
+  def sendRequest(self, method, path, query=None, body=None, timeout=clientTimeout):
+    # Returns (status, responseBody), raises DockerApiError if the daemon returned an error.
+    # timeout replaces the client's timeout for this request, None waits for as long as it takes.
+    if timeout is clientTimeout:
+      timeout = self.timeout
+    if query:
+      path += "?" + urlencode(query)
+    headers = {}
+    if not body == None:
+      body = json.dumps(body).encode("utf-8")
+      headers["Content-Type"] = "application/json"
+
+    for attempt in range(2):
+      connection = self.getConnection()
+      connection.timeout = timeout
+      if not connection.sock == None:
+        connection.sock.settimeout(timeout)
+      try:
+        connection.request(method, path, body=body, headers=headers)
+        response = connection.getresponse()
+        responseBody = response.read()
+        break
+      except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+        self.close() # The daemon closed the kept alive connection, try once more on a new one
+        if attempt == 1:
+          raise
+      except OSError:
+        self.close()
+        raise
+      except http.client.HTTPException as err:
+        self.close()
+        raise ConnectionError("Bad response from the Docker daemon: {err}".format(err=repr(err))) from err
+
+    if response.will_close:
+      self.close()
+    if response.status >= 400:
+      raise DockerApiError(response.status, getErrorMessage(responseBody))
+    return (response.status, responseBody)
+
+  def getVersion(self):
+    return self.request("GET", "/version")
+
+  def listContainers(self, all=False, filters=None):
+    query = { "all": "1" if all else "0" }
+    if filters:
+      query["filters"] = json.dumps(filters)
+    return self.request("GET", "/containers/json", query)
+
+  # start, stop and restart return False if the container was already started or stopped
+  def startContainer(self, containerId):
+    return self.runContainerAction(containerId, "start")
+
+  def stopContainer(self, containerId, timeout=None):
+    return self.runContainerAction(containerId, "stop", timeout)
+
+  def restartContainer(self, containerId, timeout=None):
+    return self.runContainerAction(containerId, "restart", timeout)
+
+  def runContainerAction(self, containerId, action, timeout=None):
+    # timeout is the seconds the container has to stop before it's killed. Without one the
+    # container's own stop timeout is used, which the client can't know, so the daemon is
+    # waited on for as long as it takes. It always answers once the container is killed.
+    query = None
+    actionTimeout = self.timeout
+    if action in ["stop", "restart"]:
+      actionTimeout = None
+      if not timeout == None:
+        query = { "t": str(int(timeout)) }
+        actionTimeout = int(timeout) + self.timeout
+    (status, responseBody) = self.sendRequest("POST", "/containers/{id}/{action}".format(id=quote(containerId, safe=''), action=action), query, timeout=actionTimeout)
+    return not status == 304 # Not modified
+
+  def stopContainers(self, containerIds, timeout=None):
+    # Stops the containers at the same time, like 'docker container stop a b c', each on its
+    # own connection. Yields (containerId, stopped, error) as each one finishes. stopped is
+    # False if it was already stopped, error is None unless it couldn't be stopped.
+    def stopOne(containerId):
+      containerApi = DockerApi(self.socketPath, self.timeout)
+      try:
+        return (containerId, containerApi.stopContainer(containerId, timeout), None)
+      except (OSError, DockerApiError) as err:
+        return (containerId, False, err)
+      finally:
+        containerApi.close()
+
+    if len(containerIds) == 0:
+      return
+    with ThreadPoolExecutor(max_workers=min(len(containerIds), maxParallelRequests)) as executor:
+      stopFutures = [executor.submit(stopOne, containerId) for containerId in containerIds]
+      for stopFuture in as_completed(stopFutures):
+        yield stopFuture.result()
+
+  def getStats(self, containerId):
+    # One sample of the container's CPU, memory, network and block IO usage
+    return self.request("GET", "/containers/{id}/stats".format(id=quote(containerId, safe='')), { "stream": "0", "one-shot": "1" })
+
+  def getEvents(self, since=None, until=None, filters=None):
+    # Yields each event as it happens. Without until, this waits for new events until the
+    # generator is closed. The stream has its own connection, so other requests can still be made.
+    query = {}
+    if not since == None:
+      query["since"] = str(since)
+    if not until == None:
+      query["until"] = str(until)
+    if filters:
+      query["filters"] = json.dumps(filters)
+    if self.socketPath == None:
+      raise FileNotFoundError("DOCKER_HOST is not a unix socket: {host}".format(host=os.environ.get("DOCKER_HOST")))
+
+    connection = UnixHTTPConnection(self.socketPath)
+    try:
+      connection.request("GET", "/events" + ("?" + urlencode(query) if query else ""))
+      response = connection.getresponse()
+      if response.status >= 400:
+        raise DockerApiError(response.status, getErrorMessage(response.read()))
+      while True:
+        line = response.readline()
+        if not line:
+          break
+        if not line.strip() == b'':
+          yield json.loads(line)
+    finally:
+      connection.close()
+
+dockerApi = None
+
+def getDockerApi():
+  global dockerApi
+  if dockerApi == None:
+    dockerApi = DockerApi()
+  return dockerApi
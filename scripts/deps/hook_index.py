@@ -0,0 +1,88 @@
+import os
+import re
+import ast
+import json
+from deps.consts import tempDirectory, hookIndexFile
+from deps.hook_loader import getFileSignature
+
+# Which hooks a template's build.py provides is found by scanning the script's source
+# for the hook function definitions, instead of executing it with each 'checkFor*Hook'.
+# The keys match the ones the 'checkFor*Hook' functions place into 'buildHooks'.
+# "needsTerminal" is set for scripts that call input() or run sudo, which may ask for a
+# password. Their hooks can't run in a hook worker, which has no terminal (see deps/hook_runner.py).
+hookFunctionNames = {
+  "options": "runOptionsMenu",
+  "preBuildHook": "preBuild",
+  "postBuildHook": "postBuild",
+  "runChecksHook": "runChecks"
+}
+
+scanVersion = 2 # Entries scanned by an older version are scanned again
+sudoPattern = re.compile(r'(^|[\s;&|(`])sudo(\s|$)')
+
+hookIndex = None
+hookIndexChanged = False
+
+def loadHookIndex():
+  global hookIndex
+  if hookIndex == None:
+    hookIndex = {}
+    try:
+      with open(hookIndexFile) as objHookIndexFile:
+        hookIndex = json.load(objHookIndexFile)
+    except (OSError, ValueError):
+      pass
+  return hookIndex
+
+def saveHookIndex():
+  global hookIndexChanged
+  if not hookIndexChanged:
+    return False
+  tempPath = "{path}.{pid}.tmp".format(path=hookIndexFile, pid=os.getpid())
+  try:
+    os.makedirs(tempDirectory, exist_ok=True)
+    with open(tempPath, 'w') as objHookIndexFile:
+      json.dump(hookIndex, objHookIndexFile, indent=2, sort_keys=True)
+    os.replace(tempPath, hookIndexFile)
+    hookIndexChanged = False
+    return True
+  except OSError:
+    return False
+
+def scanBuildScript(scriptPath):
+  with open(scriptPath, "rb") as buildScriptFile:
+    scriptTree = ast.parse(buildScriptFile.read(), scriptPath)
+
+  definedFunctions = set()
+  needsTerminal = False
+  for node in ast.walk(scriptTree):
+    if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+      definedFunctions.add(node.name)
+    elif isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "input":
+      needsTerminal = True
+    elif isinstance(node, ast.Constant) and isinstance(node.value, str) and sudoPattern.search(node.value):
+      needsTerminal = True # ['sudo', 'cp', ...] and "sudo cp ..." alike
+
+  capabilities = {}
+  for (hookName, functionName) in hookFunctionNames.items():
+    capabilities[hookName] = functionName in definedFunctions
+  capabilities["needsTerminal"] = needsTerminal
+  return capabilities
+
+def getHookCapabilities(scriptPath):
+  global hookIndexChanged
+  index = loadHookIndex()
+  signature = list(getFileSignature(scriptPath))
+  indexKey = os.path.normpath(scriptPath)
+
+  if indexKey in index and index[indexKey]["signature"] == signature and index[indexKey].get("scanVersion") == scanVersion:
+    return index[indexKey]["hooks"]
+
+  capabilities = scanBuildScript(scriptPath)
+  index[indexKey] = {
+    "scanVersion": scanVersion,
+    "signature": signature,
+    "hooks": capabilities
+  }
+  hookIndexChanged = True
+  return capabilities
@@ -0,0 +1,65 @@
+import os
+import sys
+import struct
+import marshal
+import importlib.util
+from deps.consts import hookCacheDirectory
+
+# Compiled build scripts are cached in memory and on disk so that each template's
+# build.py is only parsed once, rather than on every hook call from the menu.
+# Both caches are keyed by the script path, and invalidated by its mtime and size.
+
+cacheHeader = struct.Struct('<4sqq') # Magic number, mtime (ns), size
+compiledHooks = {}
+
+def getFileSignature(scriptPath):
+  fileStat = os.stat(scriptPath)
+  return (fileStat.st_mtime_ns, fileStat.st_size)
+
+def getDiskCachePath(scriptPath):
+  cacheName = os.path.normpath(scriptPath).lstrip('./').replace(os.sep, '__')
+  return "{cacheDir}{name}.{tag}.bin".format(cacheDir=hookCacheDirectory, name=cacheName, tag=sys.implementation.cache_tag)
+
+def readDiskCache(scriptPath, signature):
+  try:
+    with open(getDiskCachePath(scriptPath), 'rb') as cacheFile:
+      data = cacheFile.read()
+    magic, mtime, size = cacheHeader.unpack_from(data)
+    if magic == importlib.util.MAGIC_NUMBER and (mtime, size) == signature:
+      return marshal.loads(data[cacheHeader.size:])
+  except (OSError, ValueError, EOFError, TypeError, struct.error):
+    pass
+  return None
+
+def writeDiskCache(scriptPath, signature, code):
+  cachePath = getDiskCachePath(scriptPath)
+  tempPath = "{path}.{pid}.tmp".format(path=cachePath, pid=os.getpid())
+  try:
+    os.makedirs(hookCacheDirectory, exist_ok=True)
+    with open(tempPath, 'wb') as cacheFile:
+      cacheFile.write(cacheHeader.pack(importlib.util.MAGIC_NUMBER, signature[0], signature[1]))
+      cacheFile.write(marshal.dumps(code))
+    os.replace(tempPath, cachePath)
+  except OSError: # Cache is optional, a read only filesystem shouldn't stop the build
+    try:
+      os.remove(tempPath)
+    except OSError:
+      pass
+
+def loadHookCode(scriptPath):
+  signature = getFileSignature(scriptPath)
+
+  if scriptPath in compiledHooks and compiledHooks[scriptPath][0] == signature:
+    return compiledHooks[scriptPath][1]
+
+  code = readDiskCache(scriptPath, signature)
+  if code == None:
+    with open(scriptPath, "rb") as pythonDynamicImportFile:
+      code = compile(pythonDynamicImportFile.read(), scriptPath, "exec")
+    writeDiskCache(scriptPath, signature, code)
+
+  compiledHooks[scriptPath] = (signature, code)
+  return code
+
+def clearHookCache():
+  compiledHooks.clear()
@@ -0,0 +1,201 @@
+import os
+import sys
+import json
+import time
+import pickle
+import queue
+import signal
+import threading
+import subprocess
+from deps.consts import tempDirectory
+from deps.profiler import timeSpan
+
+# Runs template build hooks in worker processes (deps/hook_worker.py) instead of exec()ing
+# them in the menu's process, so a slow or hung hook can be timed out or cancelled without
+# freezing the menu. Each hook gets:
+#  * A time limit. When it runs out, the worker and anything it started (sudo cp, chmod -R
+#    etc) are killed and the hook is reported as failed.
+#  * Its output streamed back line by line as it runs, prefixed with the service name.
+#  * Its changes to dockerComposeServicesYaml returned as a patch through a result file.
+# The services and results are pickled, which keeps ruamel.yaml's comments and formatting
+# and is much faster than writing them as YAML. The files only live for one build.
+# Starting Python and loading the services for every hook is slow, so a HookWorkerPool keeps
+# its workers running between hooks. The services the hooks see are written once per wave
+# with writeServicesSnapshot(). A worker is only replaced when it had to be killed.
+
+defaultHookTimeout = 600 # Seconds, per hook
+hookJobsDirectory = tempDirectory + 'hook_jobs/'
+workerScript = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'hook_worker.py')
+jobDoneMarker = "\x1eIOTSTACK_HOOK_DONE"
+killGraceTime = 3
+pollInterval = 0.1
+
+def getJobPath(name):
+  return "{jobsDir}{name}.{pid}.pickle".format(jobsDir=hookJobsDirectory, name=name, pid=os.getpid())
+
+def writeServicesSnapshot(dockerComposeServicesYaml, snapshotName="services"):
+  # Returns the path of the snapshot, pass it to HookWorkerPool.runHook()
+  os.makedirs(hookJobsDirectory, exist_ok=True)
+  snapshotPath = getJobPath(snapshotName)
+  with open(snapshotPath, 'wb') as objSnapshotFile:
+    pickle.dump(dict(dockerComposeServicesYaml), objSnapshotFile, protocol=pickle.HIGHEST_PROTOCOL)
+  return snapshotPath
+
+def removeJobFile(jobPath):
+  try:
+    os.remove(jobPath)
+  except OSError:
+    pass
+
+class HookWorker:
+  def __init__(self):
+    self.process = subprocess.Popen(
+      [sys.executable, '-u', workerScript],
+      stdin=subprocess.PIPE,
+      stdout=subprocess.PIPE,
+      stderr=subprocess.STDOUT,
+      universal_newlines=True,
+      start_new_session=True # So a timed out hook's own commands are killed with it
+    )
+    self.serviceName = None
+    self.outputStream = sys.stdout
+    self.outputLock = threading.Lock()
+    self.capturedLines = []
+    self.jobsDone = queue.Queue()
+    self.outputThread = threading.Thread(target=self.readOutput, daemon=True)
+    self.outputThread.start()
+
+  def isAlive(self):
+    return self.process.poll() == None
+
+  def writeLine(self, line):
+    self.capturedLines.append(line)
+    with self.outputLock:
+      self.outputStream.write("[{service}] {line}".format(service=self.serviceName, line=line))
+      self.outputStream.flush()
+
+  def readOutput(self):
+    for line in iter(self.process.stdout.readline, ''):
+      if line.rstrip('\n').endswith(jobDoneMarker):
+        hookOutput = line.rstrip('\n')[:-len(jobDoneMarker)]
+        if hookOutput: # Output that didn't end with a new line
+          self.writeLine(hookOutput + '\n')
+        self.jobsDone.put(True)
+      elif line.endswith('\n'):
+        self.writeLine(line)
+      else: # The worker was stopped part way through a line
+        self.writeLine(line + '\n')
+    self.process.stdout.close()
+    self.jobsDone.put(False)
+
+  def stop(self):
+    # Every process the worker started is in its session, and is stopped with it
+    for stopSignal in [signal.SIGTERM, signal.SIGKILL]:
+      try:
+        os.killpg(self.process.pid, stopSignal)
+      except OSError:
+        return
+      try:
+        self.process.wait(timeout=killGraceTime)
+        self.outputThread.join(killGraceTime) # Print what the hook wrote before it was stopped
+        return
+      except subprocess.TimeoutExpired:
+        pass
+
+  def close(self):
+    try:
+      self.process.stdin.close() # The worker exits when there are no more jobs
+      self.process.wait(timeout=killGraceTime)
+    except (OSError, subprocess.TimeoutExpired):
+      self.stop()
+
+  def runHook(self, job, timeout, cancelEvent, outputStream, outputLock):
+    # Returns None once the worker has written the job's result, or the reason it didn't
+    self.serviceName = job["serviceName"]
+    self.outputStream = outputStream
+    self.outputLock = outputLock
+    self.capturedLines = []
+    try:
+      self.process.stdin.write(json.dumps(job) + '\n')
+      self.process.stdin.flush()
+    except OSError as err:
+      return "Hook worker stopped: {err}".format(err=err)
+
+    deadline = None
+    if timeout:
+      deadline = time.monotonic() + timeout
+    while True:
+      try:
+        if self.jobsDone.get(timeout=pollInterval):
+          return None
+        return "Hook worker exited with code {code}".format(code=self.process.wait())
+      except queue.Empty:
+        pass
+      if cancelEvent and cancelEvent.is_set():
+        self.stop()
+        return "Cancelled"
+      if deadline and time.monotonic() > deadline:
+        self.stop()
+        return "Timed out after {timeout} seconds".format(timeout=timeout)
+
+class HookWorkerPool:
+  # Hands each hook to an idle worker, starting a new one when none are idle
+  def __init__(self):
+    self.idleWorkers = []
+    self.allWorkers = []
+    self.lock = threading.Lock()
+
+  def getWorker(self):
+    with self.lock:
+      while len(self.idleWorkers) > 0:
+        hookWorker = self.idleWorkers.pop()
+        if hookWorker.isAlive():
+          return hookWorker
+      hookWorker = HookWorker()
+      self.allWorkers.append(hookWorker)
+      return hookWorker
+
+  def runHook(self, buildScriptPath, serviceName, toRun, snapshotPath, timeout=defaultHookTimeout, cancelEvent=None, outputStream=None, outputLock=None):
+    # Returns {"serviceName", "error", "output", "patch"} like runIsolatedHook() in deps/hook_scheduler.py,
+    # runChecks hooks also return "issues". The output has already been printed to outputStream, it's returned for logging.
+    hookResult = {
+      "serviceName": serviceName,
+      "error": None,
+      "output": "",
+      "patch": { "set": {}, "delete": [] }
+    }
+    resultPath = getJobPath("{service}.{toRun}.result".format(service=serviceName, toRun=toRun))
+    removeJobFile(resultPath)
+    job = {
+      "buildScriptPath": buildScriptPath,
+      "serviceName": serviceName,
+      "toRun": toRun,
+      "snapshotPath": snapshotPath,
+      "resultPath": resultPath
+    }
+
+    hookWorker = self.getWorker()
+    with timeSpan(toRun, "hook", serviceName):
+      hookResult["error"] = hookWorker.runHook(job, timeout, cancelEvent, outputStream or sys.stdout, outputLock or threading.Lock())
+    hookResult["output"] = "".join(hookWorker.capturedLines)
+    if hookWorker.isAlive():
+      with self.lock:
+        self.idleWorkers.append(hookWorker)
+
+    if hookResult["error"] == None:
+      try:
+        with open(resultPath, 'rb') as objResultFile:
+          workerResult = pickle.load(objResultFile)
+        hookResult["patch"] = { "set": workerResult["set"] or {}, "delete": list(workerResult["delete"] or []) }
+        hookResult["error"] = workerResult["error"]
+        if "issues" in workerResult:
+          hookResult["issues"] = workerResult["issues"]
+      except Exception as err:
+        hookResult["error"] = "Unable to read the hook's result: {err}".format(err=err)
+    removeJobFile(resultPath)
+    return hookResult
+
+  def close(self):
+    for hookWorker in self.allWorkers:
+      if hookWorker.isAlive():
+        hookWorker.close()
@@ -0,0 +1,196 @@
+import io
+import sys
+import copy
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor, wait
+from deps.hook_loader import loadHookCode
+from deps.dependency_graph import getStartWaves, getComposeDependsOn
+from deps.profiler import timeSpan
+from deps.hook_runner import HookWorkerPool, writeServicesSnapshot, removeJobFile
+
+# Runs a build hook (preBuild, postBuild) for many services at once in a bounded pool of
+# worker threads. Services are run in waves so that a service's hook only starts once the
+# hooks of the services it depends_on have finished.
+#
+# Each hook runs against its own copy of dockerComposeServicesYaml, where its own service is
+# a deep copy and the other services are shared (hooks may replace or remove other services,
+# but shouldn't edit them in place). When a wave finishes, the services each hook added,
+# changed or removed are applied to the real object in the order the services were given,
+# so the result doesn't depend on which hook finished first.
+# Anything a hook prints is captured and printed in the same order.
+#
+# With a hookTimeout, each hook runs in a worker process instead (see deps/hook_runner.py).
+# Its output is then printed as it runs, and it's stopped if it runs for too long or when
+# shouldCancel() returns True. shouldCancel is only called from the calling thread.
+#
+# Hooks of the services in terminalServices (scripts that run sudo or call input(), see
+# deps/hook_index.py) need the terminal, so sudo can ask for a password. They run in the
+# calling thread one at a time, once the rest of their wave has finished, with their output
+# and input going straight to the terminal. They have no time limit and can't be cancelled.
+
+defaultHookWorkers = 4
+consoleLock = threading.Lock()
+
+class ThreadOutputRouter:
+  # Stands in for sys.stdout/sys.stderr. Threads that are capturing write to their own
+  # buffer, every other thread writes to the original stream.
+  def __init__(self, stream, buffers):
+    self.stream = stream
+    self.buffers = buffers
+
+  def write(self, text):
+    buffer = self.buffers.get(threading.get_ident())
+    if buffer == None:
+      return self.stream.write(text)
+    return buffer.write(text)
+
+  def flush(self):
+    if not threading.get_ident() in self.buffers:
+      self.stream.flush()
+
+  def __getattr__(self, name):
+    return getattr(self.stream, name)
+
+def getServicesPatch(originalServicesYaml, hookServicesYaml, copiedServiceName):
+  servicesPatch = { "set": {}, "delete": [] }
+  for (serviceName, serviceYaml) in hookServicesYaml.items():
+    if not serviceName in originalServicesYaml:
+      servicesPatch["set"][serviceName] = serviceYaml
+    elif serviceName == copiedServiceName:
+      if not originalServicesYaml[serviceName] == serviceYaml:
+        servicesPatch["set"][serviceName] = serviceYaml
+    elif not originalServicesYaml[serviceName] is serviceYaml: # Shared services only change if replaced
+      servicesPatch["set"][serviceName] = serviceYaml
+  for serviceName in originalServicesYaml:
+    if not serviceName in hookServicesYaml:
+      servicesPatch["delete"].append(serviceName)
+  return servicesPatch
+
+def applyServicesPatch(dockerComposeServicesYaml, servicesPatch):
+  for (serviceName, serviceYaml) in servicesPatch["set"].items():
+    dockerComposeServicesYaml[serviceName] = serviceYaml
+  for serviceName in servicesPatch["delete"]:
+    if serviceName in dockerComposeServicesYaml:
+      del dockerComposeServicesYaml[serviceName]
+
+def getHookInput(outputBuffers, consoleStream):
+  # A hook that asks for input (usually "Press Enter to continue..." after an error) shows
+  # what it has printed so far, then waits for the user, one hook at a time.
+  def hookInput(prompt=""):
+    with consoleLock:
+      outputBuffer = outputBuffers[threading.get_ident()]
+      consoleStream.write(outputBuffer.getvalue() + str(prompt))
+      consoleStream.flush()
+      outputBuffer.seek(0)
+      outputBuffer.truncate()
+      return sys.stdin.readline().rstrip('\n')
+  return hookInput
+
+def runIsolatedHook(buildScriptPath, serviceName, toRun, servicesSnapshot, outputBuffers, consoleStream, captureOutput=True):
+  hookResult = {
+    "serviceName": serviceName,
+    "error": None,
+    "output": "",
+    "patch": { "set": {}, "delete": [] }
+  }
+  # Deep copying every service for every hook is O(n^2), only the hook's own service is copied
+  hookServicesYaml = dict(servicesSnapshot)
+  if serviceName in hookServicesYaml:
+    hookServicesYaml[serviceName] = copy.deepcopy(servicesSnapshot[serviceName])
+  if captureOutput:
+    outputBuffers[threading.get_ident()] = io.StringIO()
+  try:
+    execGlobals = {
+      "dockerComposeServicesYaml": hookServicesYaml,
+      "toRun": toRun,
+      "currentServiceName": serviceName
+    }
+    if captureOutput:
+      execGlobals["input"] = getHookInput(outputBuffers, consoleStream)
+    with timeSpan(toRun, "hook", serviceName):
+      exec(loadHookCode(buildScriptPath), execGlobals, {})
+    hookResult["patch"] = getServicesPatch(servicesSnapshot, execGlobals["dockerComposeServicesYaml"], serviceName)
+  except Exception as err:
+    traceback.print_exc()
+    hookResult["error"] = err
+  finally:
+    if captureOutput:
+      hookResult["output"] = outputBuffers.pop(threading.get_ident()).getvalue()
+  return hookResult
+
+def getCancelledResult(serviceName):
+  return {
+    "serviceName": serviceName,
+    "error": "Cancelled",
+    "output": "",
+    "patch": { "set": {}, "delete": [] }
+  }
+
+def waitForHooks(hookFutures, cancelEvent, shouldCancel):
+  while not all(hookFuture.done() for hookFuture in hookFutures):
+    if shouldCancel and not cancelEvent.is_set() and shouldCancel():
+      cancelEvent.set()
+    wait(hookFutures, timeout=0.1)
+
+def runHooks(hookTargets, toRun, dockerComposeServicesYaml, maxWorkers=defaultHookWorkers, hookTimeout=None, shouldCancel=None, terminalServices=()):
+  # hookTargets: [(serviceName, buildScriptPath), ...]
+  # Returns the results of each hook in the order given, see runIsolatedHook()
+  buildScriptPaths = dict(hookTargets)
+  serviceNames = [serviceName for (serviceName, buildScriptPath) in hookTargets]
+  hookResults = {}
+  cancelEvent = threading.Event()
+  workerPool = None
+  if hookTimeout:
+    workerPool = HookWorkerPool()
+
+  outputBuffers = {}
+  originalStdout = sys.stdout
+  originalStderr = sys.stderr
+  sys.stdout = ThreadOutputRouter(originalStdout, outputBuffers)
+  sys.stderr = ThreadOutputRouter(originalStderr, outputBuffers)
+  try:
+    with ThreadPoolExecutor(max_workers=max(1, maxWorkers)) as executor:
+      for (waveIndex, wave) in enumerate(getStartWaves(serviceNames, getComposeDependsOn(dockerComposeServicesYaml))):
+        if cancelEvent.is_set():
+          for serviceName in wave:
+            hookResults[serviceName] = getCancelledResult(serviceName)
+          continue
+
+        servicesSnapshot = dict(dockerComposeServicesYaml)
+        snapshotPath = None
+        hookFutures = []
+        backgroundServices = [serviceName for serviceName in wave if not serviceName in terminalServices]
+        if workerPool and len(backgroundServices) > 0:
+          snapshotPath = writeServicesSnapshot(servicesSnapshot, "services.{wave}".format(wave=waveIndex))
+        for serviceName in backgroundServices:
+          if snapshotPath:
+            hookFutures.append(executor.submit(workerPool.runHook, buildScriptPaths[serviceName], serviceName, toRun, snapshotPath, hookTimeout, cancelEvent, originalStdout, consoleLock))
+          else:
+            hookFutures.append(executor.submit(runIsolatedHook, buildScriptPaths[serviceName], serviceName, toRun, servicesSnapshot, outputBuffers, originalStdout))
+        waitForHooks(hookFutures, cancelEvent, shouldCancel)
+        if snapshotPath:
+          removeJobFile(snapshotPath)
+
+        waveResults = {}
+        for hookFuture in hookFutures: # Same order as submitted, not as completed
+          hookResult = hookFuture.result()
+          waveResults[hookResult["serviceName"]] = hookResult
+          if hookResult["output"] and not snapshotPath: # Worker output was already streamed
+            originalStdout.write(hookResult["output"])
+            originalStdout.flush()
+        for serviceName in wave:
+          if serviceName in terminalServices:
+            if cancelEvent.is_set():
+              waveResults[serviceName] = getCancelledResult(serviceName)
+            else:
+              waveResults[serviceName] = runIsolatedHook(buildScriptPaths[serviceName], serviceName, toRun, servicesSnapshot, outputBuffers, originalStdout, captureOutput=False)
+          hookResults[serviceName] = waveResults[serviceName]
+          applyServicesPatch(dockerComposeServicesYaml, waveResults[serviceName]["patch"])
+  finally:
+    sys.stdout = originalStdout
+    sys.stderr = originalStderr
+    if workerPool:
+      workerPool.close()
+
+  return [hookResults[serviceName] for serviceName in serviceNames]
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Runs template build hooks in a process of their own, started by deps/hook_runner.py.
+# Jobs are read from stdin, one JSON object per line:
+#  {"buildScriptPath", "serviceName", "toRun", "snapshotPath", "resultPath"}
+# The snapshot file holds dockerComposeServicesYaml (pickled) before the hook ran. The services the
+# hook added, changed or removed are written to the result file as a patch (see
+# getServicesPatch() in deps/hook_scheduler.py), with the error if the hook raised one. runChecks
+# hooks only read the services, their result has the issues they returned instead of a patch.
+# jobDoneMarker (deps/hook_runner.py) is printed once the result file has been written.
+import os
+import sys
+import copy
+import json
+import pickle
+import traceback
+
+def hookInput(prompt=""):
+  # Hooks can't read from the terminal, the menu owns it. Their prompts are printed and
+  # answered with an empty line (the build pauses once hooks fail instead).
+  print(prompt)
+  return ""
+
+def main():
+  sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # ./scripts, like the menu
+  from deps.hook_loader import loadHookCode, getFileSignature
+  from deps.hook_scheduler import getServicesPatch
+  from deps.hook_runner import jobDoneMarker
+  from deps.port_registry import sharedPortRegistry
+
+  # Commands started by hooks get /dev/null as stdin, so they can't read the jobs
+  jobStream = os.fdopen(os.dup(0))
+  devNull = os.open(os.devnull, os.O_RDONLY)
+  os.dup2(devNull, 0)
+  os.close(devNull)
+
+  loadedSnapshots = {} # snapshotPath: (signature, services), each wave's snapshot is loaded once
+  for jobLine in jobStream:
+    job = json.loads(jobLine)
+    hookResult = { "set": {}, "delete": [], "error": None }
+    try:
+      snapshotSignature = getFileSignature(job["snapshotPath"])
+      if not job["snapshotPath"] in loadedSnapshots or not loadedSnapshots[job["snapshotPath"]][0] == snapshotSignature:
+        loadedSnapshots.clear()
+        with open(job["snapshotPath"], 'rb') as objSnapshotFile:
+          loadedSnapshots[job["snapshotPath"]] = (snapshotSignature, pickle.load(objSnapshotFile))
+      servicesSnapshot = loadedSnapshots[job["snapshotPath"]][1]
+
+      serviceName = job["serviceName"]
+      if job["toRun"] == "runChecks":
+        hookServicesYaml = servicesSnapshot
+      else:
+        hookServicesYaml = dict(servicesSnapshot)
+        if serviceName in hookServicesYaml:
+          hookServicesYaml[serviceName] = copy.deepcopy(servicesSnapshot[serviceName])
+      execGlobals = {
+        "dockerComposeServicesYaml": hookServicesYaml,
+        "toRun": job["toRun"],
+        "currentServiceName": serviceName,
+        "input": hookInput
+      }
+      if job["toRun"] == "runChecks":
+        with sharedPortRegistry(servicesSnapshot):
+          exec(loadHookCode(job["buildScriptPath"]), execGlobals, {})
+        hookResult["issues"] = execGlobals.get("issues", [])
+      else:
+        exec(loadHookCode(job["buildScriptPath"]), execGlobals, {})
+        servicesPatch = getServicesPatch(servicesSnapshot, execGlobals["dockerComposeServicesYaml"], serviceName)
+        hookResult["set"] = servicesPatch["set"]
+        hookResult["delete"] = servicesPatch["delete"]
+    except Exception as err:
+      traceback.print_exc()
+      hookResult["error"] = "{errorType}: {err}".format(errorType=type(err).__name__, err=err)
+
+    try:
+      with open(job["resultPath"], 'wb') as objResultFile:
+        pickle.dump(hookResult, objResultFile, protocol=pickle.HIGHEST_PROTOCOL)
+    except Exception:
+      traceback.print_exc()
+    sys.stderr.flush()
+    sys.stdout.write(jobDoneMarker + "\n")
+    sys.stdout.flush()
+  return 0
+
+if __name__ == '__main__':
+  sys.exit(main())
@@ -0,0 +1,97 @@
+import os
+import json
+import hashlib
+from deps.consts import tempDirectory, issuesCacheFile
+from deps.template_catalog import getTemplateEntry
+from deps.build_manifest import getSettingsHash, hasExternalSideEffects
+from deps.dependency_graph import getDependsOn
+from deps.port_registry import getPortConflicts
+
+# Saves the issues each service's runChecks hook returned to ./.tmp/issues_cache.json, so
+# they can be reused instead of running the hook again. A service's stored issues are only
+# reused while its key is the same. The key is a hash of everything the checks look at:
+#  * The template's service.yml and build.py signatures (from the template catalog)
+#  * The service's settings files in ./services (build_settings.yml etc)
+#  * The service's own docker-compose config
+#  * Its port conflicts, so a peer publishing an overlapping port invalidates it
+#  * Which of the services it depends on are selected
+# Hooks flagged "needsTerminal" aren't stored. Their checks also restore files outside ./services
+# (esphome's ./.env and udev rule), so they must run every time, see deps/build_manifest.py
+
+cacheVersion = 1
+
+issuesCache = None
+issuesCacheChanged = False
+
+def loadIssuesCache():
+  global issuesCache
+  if issuesCache == None:
+    issuesCache = { "version": cacheVersion, "services": {} }
+    try:
+      with open(issuesCacheFile) as objIssuesCacheFile:
+        savedCache = json.load(objIssuesCacheFile)
+      if savedCache.get("version") == cacheVersion and isinstance(savedCache.get("services"), dict):
+        issuesCache = savedCache
+    except (OSError, ValueError):
+      pass
+  return issuesCache
+
+def saveIssuesCache():
+  global issuesCacheChanged
+  if not issuesCacheChanged:
+    return False
+  tempPath = "{path}.{pid}.tmp".format(path=issuesCacheFile, pid=os.getpid())
+  try:
+    os.makedirs(tempDirectory, exist_ok=True)
+    with open(tempPath, 'w') as objIssuesCacheFile:
+      json.dump(issuesCache, objIssuesCacheFile, sort_keys=True)
+    os.replace(tempPath, issuesCacheFile)
+    issuesCacheChanged = False
+    return True
+  except OSError:
+    return False
+
+def getIssuesKey(serviceName, dockerComposeServicesYaml):
+  # Returns None for services without a template or with side effects, their issues aren't stored
+  try:
+    templateEntry = getTemplateEntry(serviceName)
+  except KeyError:
+    return None
+  if hasExternalSideEffects(serviceName):
+    return None
+  serviceYaml = dockerComposeServicesYaml.get(serviceName)
+  keyData = {
+    "template": [templateEntry["serviceSignature"], templateEntry["buildSignature"]],
+    "settings": getSettingsHash(serviceName),
+    "service": serviceYaml,
+    "portConflicts": getPortConflicts(serviceName, dockerComposeServicesYaml),
+    "dependsOn": [[dependencyName, dependencyName in dockerComposeServicesYaml] for dependencyName in getDependsOn(serviceYaml)]
+  }
+  serialised = json.dumps(keyData, sort_keys=True, default=str)
+  return hashlib.sha256(serialised.encode('utf-8')).hexdigest()
+
+def getCachedIssues(serviceName, issuesKey):
+  # Returns the stored issues, or None if there are none for this key
+  cachedEntry = loadIssuesCache()["services"].get(serviceName)
+  if cachedEntry and cachedEntry.get("key") == issuesKey:
+    return cachedEntry["issues"]
+  return None
+
+def storeIssues(serviceName, issuesKey, issues):
+  global issuesCacheChanged
+  try:
+    storedIssues = json.loads(json.dumps(issues))
+  except (TypeError, ValueError): # Not saveable, the checks run again next time
+    return False
+  loadIssuesCache()["services"][serviceName] = {
+    "key": issuesKey,
+    "issues": storedIssues
+  }
+  issuesCacheChanged = True
+  return True
+
+def clearIssuesCache():
+  global issuesCache
+  global issuesCacheChanged
+  issuesCache = { "version": cacheVersion, "services": {} }
+  issuesCacheChanged = True
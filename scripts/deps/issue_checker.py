@@ -0,0 +1,183 @@
+import io
+import sys
+import queue
+import threading
+from deps import buildstack
+from deps.hook_scheduler import ThreadOutputRouter
+from deps.issue_cache import getIssuesKey, saveIssuesCache
+from deps.port_registry import sharedPortRegistry
+from deps.hook_runner import HookWorkerPool, writeServicesSnapshot, removeJobFile
+
+# Runs the build menu's issue checks in a background thread, so that selecting a service
+# doesn't wait for every selected service's runChecks hook.
+#
+# requestCheck() is called with the selected services after every change. The thread works out
+# which services' results are out of date: those whose issues key (see deps/issue_cache.py) or
+# dependency issues changed since their results were last sent. It sends ("checking", [names])
+# for them, then ("issues", name, issues) as each one is checked. Services that didn't change
+# keep their results and aren't checked again. If another request comes in part way through,
+# the rest of the old one is dropped, and its unchecked services are checked with the new one.
+# getUpdates() returns what was sent since the last call, in order, so the newest result for a
+# service is always applied last.
+#
+# The runChecks hooks run in a hook worker process (see deps/hook_runner.py) rather than this
+# thread. The worker has no terminal, so hooks that create a blessed Terminal() can't read the
+# keys pressed in the menu while it queries the terminal. Anything the hooks print while being
+# checked in the background is discarded, it would be drawn over the menu.
+#
+# Hooks that need the terminal (they run sudo or call input(), see deps/hook_index.py) aren't
+# run in the background, sudo couldn't ask for a password. Unless their issues are cached, these
+# services are sent with None as their issues, and are checked in the menu's process when the
+# build starts.
+
+checkTimeout = 60 # Seconds, per service
+
+class BackgroundIssueChecker:
+  def __init__(self):
+    self.requests = queue.Queue()
+    self.updates = queue.Queue()
+    self.idle = threading.Event()
+    self.idle.set()
+    self.idleLock = threading.Lock()
+    self.cancelled = threading.Event() # Set by stop(cancel=True), ends the hook being run
+    self.sentKeys = {} # serviceName: key of the results last sent
+    self.forgottenServices = set()
+    self.outputBuffers = {}
+    self.workerPool = HookWorkerPool()
+    self.snapshotCount = 0
+    self.snapshotPath = None
+    self.servicesYaml = None
+    self.originalStdout = sys.stdout
+    self.originalStderr = sys.stderr
+    sys.stdout = ThreadOutputRouter(self.originalStdout, self.outputBuffers)
+    sys.stderr = ThreadOutputRouter(self.originalStderr, self.outputBuffers)
+    self.thread = threading.Thread(target=self.run, daemon=True)
+    self.thread.start()
+
+  def requestCheck(self, serviceNames, dockerComposeServicesYaml):
+    with self.idleLock:
+      self.idle.clear()
+      self.requests.put((list(serviceNames), dict(dockerComposeServicesYaml)))
+
+  def forgetService(self, serviceName):
+    # For deselected services, so they are checked again when selected again
+    with self.idleLock:
+      self.forgottenServices.add(serviceName)
+
+  def getUpdates(self):
+    pendingUpdates = []
+    while True:
+      try:
+        pendingUpdates.append(self.updates.get_nowait())
+      except queue.Empty:
+        return pendingUpdates
+
+  def waitUntilIdle(self, timeout=None):
+    # Returns False if the checks are still running after the timeout
+    return self.idle.wait(timeout)
+
+  def stop(self, cancel=False):
+    # Waits for the service being checked, the rest are dropped. With cancel, its hook is stopped
+    # rather than waited for. Can be called more than once.
+    if not self.thread.is_alive():
+      return
+    if cancel:
+      self.cancelled.set()
+    self.requests.put(None)
+    self.thread.join()
+    self.workerPool.close()
+    sys.stdout = self.originalStdout
+    sys.stderr = self.originalStderr
+
+  def getLatestRequest(self, block=True):
+    # Returns the newest check request, dropping any older ones. None once stopped.
+    latestRequest = False
+    while True:
+      try:
+        checkRequest = self.requests.get(block=block and latestRequest == False)
+      except queue.Empty:
+        return latestRequest
+      if checkRequest == None:
+        return None
+      latestRequest = checkRequest
+
+  def run(self):
+    self.outputBuffers[threading.get_ident()] = io.StringIO()
+    checkRequest = self.getLatestRequest()
+    while not checkRequest == None:
+      newerRequest = self.checkServices(*checkRequest)
+      if newerRequest == False:
+        with self.idleLock:
+          if self.requests.empty():
+            self.idle.set()
+        checkRequest = self.getLatestRequest()
+      else:
+        checkRequest = newerRequest
+      self.outputBuffers[threading.get_ident()] = io.StringIO()
+
+  def runWorkerHook(self, serviceName, toRun):
+    # hookRunner for buildstack.getServiceIssues(). The services are only written for the worker
+    # once a request has a hook to run, most are answered from the issues cache.
+    if self.snapshotPath == None:
+      self.snapshotCount += 1
+      self.snapshotPath = writeServicesSnapshot(self.servicesYaml, "checks.{count}".format(count=self.snapshotCount))
+    hookResult = self.workerPool.runHook(
+      buildstack.getBuildScriptPath(serviceName),
+      serviceName,
+      toRun,
+      self.snapshotPath,
+      timeout=checkTimeout,
+      cancelEvent=self.cancelled,
+      outputStream=io.StringIO()
+    )
+    if not hookResult["error"] == None:
+      raise RuntimeError(hookResult["error"])
+    return { "issues": hookResult.get("issues") or [] }
+
+  def checkServices(self, serviceNames, dockerComposeServicesYaml):
+    # Returns False when done, or the newer request that interrupted it (None if stopped)
+    self.servicesYaml = dockerComposeServicesYaml
+    try:
+      return self.checkRequestedServices(serviceNames, dockerComposeServicesYaml)
+    finally:
+      if not self.snapshotPath == None:
+        removeJobFile(self.snapshotPath)
+        self.snapshotPath = None
+
+  def checkRequestedServices(self, serviceNames, dockerComposeServicesYaml):
+    with self.idleLock:
+      for serviceName in self.forgottenServices:
+        self.sentKeys.pop(serviceName, None)
+      self.forgottenServices.clear()
+    dependencyIssues = buildstack.addDependencyIssues(serviceNames, {})
+    with sharedPortRegistry(dockerComposeServicesYaml):
+      serviceKeys = {}
+      for serviceName in serviceNames:
+        issuesKey = None
+        if buildstack.hasRunChecksHook(serviceName):
+          issuesKey = getIssuesKey(serviceName, dockerComposeServicesYaml)
+        serviceKeys[serviceName] = (issuesKey, repr(dependencyIssues.get(serviceName)))
+
+      outdatedServices = [serviceName for serviceName in serviceNames if not self.sentKeys.get(serviceName) == serviceKeys[serviceName]]
+      if len(outdatedServices) > 0:
+        self.updates.put(("checking", outdatedServices))
+
+      for (index, serviceName) in enumerate(outdatedServices):
+        if not self.requests.empty():
+          newerRequest = self.getLatestRequest(block=False)
+          if newerRequest == None or not newerRequest == False:
+            for uncheckedName in outdatedServices[index:]:
+              self.sentKeys.pop(uncheckedName, None)
+            saveIssuesCache()
+            return newerRequest
+        issuesKey = serviceKeys[serviceName][0]
+        if buildstack.hookNeedsTerminal(serviceName):
+          issues = None # Checked when the build starts, their issues are never stored
+        else:
+          issues = buildstack.getServiceIssues(serviceName, dockerComposeServicesYaml, issuesKey, interactive=False, hookRunner=self.runWorkerHook)
+        if serviceName in dependencyIssues:
+          issues = dict(issues or {}, **dependencyIssues[serviceName])
+        self.sentKeys[serviceName] = serviceKeys[serviceName]
+        self.updates.put(("issues", serviceName, issues))
+    saveIssuesCache()
+    return False
@@ -0,0 +1,463 @@
+import signal
+from functools import lru_cache
+from deps.chars import specialChars, commonTopBorder, commonBottomBorder, commonEmptyLine, commonScrollLine, padText
+from deps.render import getTerminal, renderFrame
+
+# One menu loop for the menus that are a list of commands or options to run. Before this, each
+# submenu and template options menu had its own copy of renderHotZone(), mainRender(),
+# runSelection(), isMenuItemSelectable() and the inkey() loop.
+#
+# Menu items are the same lists the menus used before:
+#   ["Title", functionToRun]
+#   ["Title", functionToRun, { "skip": True }] # Shown, but can't be selected
+#
+# To use it:
+#   commandsMenu = Menu('IOTstack Miscellaneous Commands', mainMenuList, renderMode)
+#   commandsMenu.run()
+# Pass a function that returns the items instead if they are rebuilt while the menu is open, as
+# the services' options menus do. An item's function can call commandsMenu.close() to go back.
+#
+# Menus that show more than a title per row pass hooks:
+#   formatRow(menuItem, isSelected)  Returns the row's line, for checkboxes, statuses etc
+#   statusLines()                    Returns the lines shown below the items, None is an empty line
+#   onKey(key)                       Runs before the default keys, returns True if it used the key
+#   onPoll()                         Runs about every pollInterval seconds while no key is pressed
+# and call refreshRows() when a row's state changes, so only that row is drawn again.
+# ChecklistMenu below is a Menu of [title, { "checked": True }] items, toggled with [Space].
+#
+# Rendering:
+#  * Rows are formatted by formatMenuRow(), which is memoised. Moving the cursor only formats
+#    and draws the rows that were and are now selected, the rest of the frame is left alone.
+#    MenuRows keeps the rows as they were drawn, the build stack menu uses it for its rows too.
+#  * Only the rows that fit on the screen are formatted. Longer lists are paginated, with
+#    arrows showing there are more items above or below.
+#  * Every render is one frame, see deps/render.py
+
+lineLengthAtTextStart = 71
+boxTextLength = 74 # commonEmptyLine() without the border and indent
+
+defaultControls = [
+  "[Up] and [Down] to move selection cursor",
+  "[H] Show/hide this text",
+  "[Enter] to run command",
+  "[Escape] to go back to main menu"
+]
+
+optionsMenuControls = [ # For services' options menus, opened from the build stack menu
+  "[Up] and [Down] to move selection cursor",
+  "[H] Show/hide this text",
+  "[Enter] to run command or save input",
+  "[Escape] to go back to build stack menu"
+]
+
+checklistPageSizes = [10, None] # ChecklistMenu's rows shown at once, toggled with [Tab]. None fits as many as there's room for
+
+# Render types, like the menus' needsRender
+noRender = 0
+fullRender = 1
+selectionRender = 2
+
+@lru_cache(maxsize=1024)
+def formatMenuRow(title, isSelected, renderMode, terminalWidth):
+  # terminalWidth is part of the key since term.center() pads to the terminal's width
+  term = getTerminal()
+  if isSelected:
+    toPrint = '{bv} -> {t.blue_on_green} {title} {t.normal} <-'.format(t=term, title=title, bv=specialChars[renderMode]["borderVertical"])
+  else:
+    toPrint = '{bv}    {t.normal} {title}    '.format(t=term, title=title, bv=specialChars[renderMode]["borderVertical"])
+  toPrint += " " * (lineLengthAtTextStart - len(title))
+  toPrint += specialChars[renderMode]["borderVertical"]
+  return term.center(toPrint)
+
+@lru_cache(maxsize=1024)
+def formatCheckboxRow(title, isChecked, isSelected, renderMode, terminalWidth):
+  term = getTerminal()
+  if isSelected:
+    toPrint = ' -> {t.blue_on_green}{title}{t.normal} <-'.format(t=term, title=title) + " " * (61 - len(title))
+  else:
+    toPrint = '    {title}{t.normal}'.format(t=term, title=title) + " " * (64 - len(title))
+  toPrint = "{bv}      ({check}) {toPrint}  {bv}".format(bv=specialChars[renderMode]["borderVertical"], check="X" if isChecked else " ", toPrint=toPrint)
+  return term.center(toPrint)
+
+@lru_cache(maxsize=1024)
+def formatPlainRow(title, isSelected, terminalWidth):
+  # The main menu's rows, without the box
+  term = getTerminal()
+  if isSelected:
+    return term.center('-> {t.blue_on_green}{title}{t.normal} <-'.format(t=term, title=title))
+  return term.center(title)
+
+@lru_cache(maxsize=256)
+def formatBoxLine(text, renderMode, terminalWidth):
+  term = getTerminal()
+  return term.center("{bv}      {text}{bv}".format(bv=specialChars[renderMode]["borderVertical"], text=padText(text, boxTextLength)))
+
+@lru_cache(maxsize=64)
+def formatNoticeLine(text, renderMode, terminalWidth):
+  # A highlighted line in the box, such as "Using existing addons_list.yml"
+  term = getTerminal()
+  return term.center("{bv}      {t.grey_on_blue4} {text} {t.normal}{padding}{bv}".format(t=term, text=text, padding=" " * (boxTextLength - 2 - len(text)), bv=specialChars[renderMode]["borderVertical"]))
+
+@lru_cache(maxsize=64)
+def formatScrollLine(renderMode, terminalWidth, direction):
+  term = getTerminal()
+  if direction == 0:
+    return term.center(commonEmptyLine(renderMode))
+  return term.center(commonScrollLine(renderMode, direction))
+
+def isMenuItemSelectable(menu, index):
+  if len(menu) > index:
+    if len(menu[index]) > 2:
+      if menu[index][2].get("skip") == True:
+        return False
+  return True
+
+class MenuRows:
+  # The rows of a menu as they were last drawn, so a change to a few rows only draws those rows
+  # again, in place. formatRow(index, isSelected) returns the row's line for the item at index.
+  def __init__(self, formatRow):
+    self.formatRow = formatRow
+    self.frame = [] # Lines as they were drawn
+    self.frameKey = None # The pagination and terminal size the lines were drawn with
+    self.startIndex = 0 # Item index of the first row
+    self.screenRow = 0 # Screen row of the first row
+
+  def draw(self, screenRow, startIndex, endIndex, selection, frameKey):
+    # Prints the rows of the items from startIndex to endIndex, as part of a full render
+    self.frame = []
+    self.startIndex = startIndex
+    self.screenRow = screenRow
+    for index in range(startIndex, endIndex):
+      toPrint = self.formatRow(index, index == selection)
+      self.frame.append(toPrint)
+      print(toPrint)
+    self.frameKey = frameKey
+
+  def invalidate(self):
+    # Call when the rows aren't where they were drawn, such as after the screen scrolled
+    self.frameKey = None
+
+  def canRedraw(self, frameKey):
+    return not self.frameKey == None and self.frameKey == frameKey
+
+  def redraw(self, indexes, selection):
+    # Formats the rows of the items in indexes that are on screen, and only prints those that changed
+    for index in sorted(set(indexes)):
+      frameIndex = index - self.startIndex
+      if frameIndex >= 0 and frameIndex < len(self.frame):
+        toPrint = self.formatRow(index, index == selection)
+        if not toPrint == self.frame[frameIndex]:
+          print(getTerminal().move_yx(self.screenRow + frameIndex, 0) + toPrint, end='')
+          self.frame[frameIndex] = toPrint
+    print(getTerminal().move_yx(self.screenRow + len(self.frame), 0), end='')
+
+  def getVisibleIndexes(self):
+    return range(self.startIndex, self.startIndex + len(self.frame))
+
+class Menu:
+  def __init__(self, title, items, renderMode, subtitle="Select Option to configure", controls=None, documentationHint="", hideHelpText=False, headerRow=None, headerPadding=0, leftGoesBack=False, formatRow=None, statusLines=None, onKey=None, onPoll=None, pollInterval=None, helpNotes=None, boxed=True):
+    self.title = title
+    self.items = items
+    self.renderMode = renderMode
+    self.subtitle = subtitle
+    self.controls = controls or defaultControls
+    self.documentationHint = documentationHint or ""
+    self.hideHelpText = hideHelpText
+    self.headerRow = headerRow # Defaults to a 16th of the way down the screen
+    self.headerPadding = headerPadding # Empty lines between the subtitle and the items
+    self.leftGoesBack = leftGoesBack
+    self.formatRowHook = formatRow
+    self.statusLines = statusLines
+    self.onKey = onKey
+    self.onPoll = onPoll
+    self.pollInterval = pollInterval # Seconds, only used with onPoll
+    self.helpNotes = helpNotes or [] # Lines shown above the controls
+    self.boxed = boxed # Without the box, subtitle and help text, like the main menu
+    self.maxPageSize = None # Rows shown at most, the rest are paginated
+    self.keepScrollLines = False # Leave the scroll arrows' lines empty when the items fit, instead of leaving them out
+    self.selection = 0
+    self.running = False
+    self.needsRender = fullRender
+    self.paginationStartIndex = 0
+    self.lastSelection = 0
+    self.changedRows = set() # Item indexes to draw again on the next render, see refreshRows()
+    self.rows = MenuRows(self.formatRow)
+    self.itemCount = 0
+
+  def getItems(self):
+    if callable(self.items):
+      return self.items()
+    return self.items
+
+  def formatRow(self, index, isSelected):
+    term = getTerminal()
+    menuItem = self.getItems()[index]
+    if not self.formatRowHook == None:
+      return self.formatRowHook(menuItem, isSelected)
+    if not self.boxed:
+      return formatPlainRow(menuItem[0], isSelected, term.width)
+    return formatMenuRow(menuItem[0], isSelected, self.renderMode, term.width)
+
+  def close(self):
+    self.running = False
+
+  def refreshRows(self, indexes=None):
+    # Draws the rows of these items again if they changed, or all the rows on screen without indexes
+    if indexes == None:
+      indexes = self.rows.getVisibleIndexes()
+    self.changedRows.update(indexes)
+    self.needsRender = max(self.needsRender, selectionRender)
+
+  def moveSelection(self, direction):
+    menu = self.getItems()
+    for attempt in range(len(menu)):
+      self.selection = (self.selection + direction) % len(menu)
+      if isMenuItemSelectable(menu, self.selection):
+        break
+    self.needsRender = max(self.needsRender, selectionRender)
+
+  def checkSelection(self):
+    # The items can change while the menu is open, such as the main menu's update notices
+    menu = self.getItems()
+    if len(menu) > 0 and (self.selection >= len(menu) or not isMenuItemSelectable(menu, self.selection)):
+      self.selection = 0
+      if not isMenuItemSelectable(menu, self.selection):
+        self.moveSelection(1)
+      self.needsRender = fullRender
+
+  def runSelection(self):
+    menu = self.getItems()
+    menuItem = menu[self.selection]
+    if len(menuItem) > 1 and callable(menuItem[1]):
+      menuItem[1]()
+      if self.selection >= len(self.getItems()): # The items were rebuilt with fewer
+        self.selection = 0
+      self.needsRender = fullRender
+    else:
+      print(getTerminal().green_reverse('IOTstack Error: No function assigned to menu item: "{}"'.format(menuItem[0])))
+
+  def getHelpLines(self):
+    if not self.boxed:
+      return []
+    helpLines = [None]
+    if len(self.helpNotes) > 0:
+      helpLines += self.helpNotes + [None]
+    helpLines += ["Controls:"] + self.controls + [None] # None is an empty line
+    if len(self.documentationHint) > 1:
+      if len(self.documentationHint) > 56:
+        helpLines += ["Documentation:", "  " + self.documentationHint]
+      else:
+        helpLines += ["  Documentation: " + self.documentationHint]
+      helpLines.append(None)
+    return helpLines
+
+  def getStatusLines(self):
+    if self.statusLines == None:
+      return []
+    return self.statusLines()
+
+  def getLayout(self, term, itemCount, statusLineCount):
+    # Returns (headerRow, helpLines, pageSize), fitting as many items on the screen as there's room for
+    headerRow = self.headerRow
+    if headerRow == None:
+      headerRow = term.height // 16
+    if self.boxed:
+      headerHeight = 7 + self.headerPadding # Title, gap, border, empty, subtitle, empty and padding
+      footerHeight = 4 + statusLineCount # Empty lines, border and the cursor's line
+    else:
+      headerHeight = 3 + self.headerPadding # Title, gap and padding
+      footerHeight = 1 + statusLineCount
+    helpLines = []
+    if not self.hideHelpText:
+      helpLines = self.getHelpLines()
+    room = term.height - (headerRow + headerHeight + footerHeight + len(helpLines))
+    if len(helpLines) > 0 and room < min(itemCount, 3):
+      helpLines = [None, "Not enough vertical room to render controls help text", None]
+      room = term.height - (headerRow + headerHeight + footerHeight + len(helpLines))
+    pageSize = itemCount
+    if not self.maxPageSize == None:
+      pageSize = min(pageSize, self.maxPageSize)
+    if pageSize > room or pageSize < itemCount or self.keepScrollLines: # Paginated, leave room for the scroll arrows
+      pageSize = min(pageSize, room - 2)
+    return (headerRow, helpLines, max(1, pageSize))
+
+  def updatePagination(self, pageSize):
+    # Returns True if the page moved
+    lastStartIndex = self.paginationStartIndex
+    if self.selection >= self.paginationStartIndex + pageSize:
+      self.paginationStartIndex = self.selection - pageSize + 1
+    if self.selection < self.paginationStartIndex:
+      self.paginationStartIndex = self.selection
+    if self.paginationStartIndex + pageSize > self.itemCount: # The items were rebuilt with fewer
+      self.paginationStartIndex = max(0, self.itemCount - pageSize)
+    return not lastStartIndex == self.paginationStartIndex
+
+  @renderFrame()
+  def render(self, renderType=fullRender):
+    term = getTerminal()
+    menu = self.getItems()
+    statusLines = self.getStatusLines()
+    (headerRow, helpLines, pageSize) = self.getLayout(term, len(menu), len(statusLines))
+    self.itemCount = len(menu)
+    if self.updatePagination(pageSize):
+      renderType = fullRender
+    frameKey = (self.paginationStartIndex, pageSize, term.width, term.height, self.renderMode, self.hideHelpText, len(menu), len(statusLines))
+
+    changedRows = self.changedRows
+    self.changedRows = set()
+    if renderType == selectionRender and self.rows.canRedraw(frameKey):
+      self.rows.redraw(changedRows | set([self.lastSelection, self.selection]), self.selection)
+      self.lastSelection = self.selection
+      return
+
+    print(term.clear())
+    print(term.move_y(headerRow))
+    print(term.black_on_cornsilk4(term.center(self.title)))
+    print("")
+    if self.boxed:
+      print(term.center(commonTopBorder(self.renderMode)))
+      print(term.center(commonEmptyLine(self.renderMode)))
+      print(formatBoxLine(self.subtitle, self.renderMode, term.width))
+      print(term.center(commonEmptyLine(self.renderMode)))
+    for i in range(self.headerPadding):
+      print(term.center(commonEmptyLine(self.renderMode)) if self.boxed else "")
+
+    isPaginated = pageSize < len(menu)
+    hasScrollLines = isPaginated or self.keepScrollLines
+    if hasScrollLines:
+      print(formatScrollLine(self.renderMode, term.width, -1 if self.paginationStartIndex > 0 else 0))
+    itemsRow = headerRow + (7 if self.boxed else 3) + self.headerPadding + (1 if hasScrollLines else 0)
+    self.rows.draw(itemsRow, self.paginationStartIndex, min(self.paginationStartIndex + pageSize, len(menu)), self.selection, frameKey)
+    if hasScrollLines:
+      print(formatScrollLine(self.renderMode, term.width, 1 if self.paginationStartIndex + pageSize < len(menu) else 0))
+
+    if self.boxed:
+      print(term.center(commonEmptyLine(self.renderMode)))
+    for statusLine in statusLines:
+      if statusLine == None:
+        print(term.center(commonEmptyLine(self.renderMode)) if self.boxed else "")
+      else:
+        print(statusLine)
+    for helpLine in helpLines:
+      if helpLine == None:
+        print(term.center(commonEmptyLine(self.renderMode)))
+      else:
+        print(formatBoxLine(helpLine, self.renderMode, term.width))
+    if self.boxed:
+      print(term.center(commonEmptyLine(self.renderMode)))
+      print(term.center(commonBottomBorder(self.renderMode)))
+
+    footerHeight = len(statusLines) + len(helpLines) + (4 if self.boxed else 1) + (1 if hasScrollLines else 0)
+    if itemsRow + len(self.rows.frame) + footerHeight > term.height:
+      self.rows.invalidate() # The screen scrolled, the rows aren't where they were drawn
+    self.lastSelection = self.selection
+
+  def onResize(self, sig, action):
+    self.rows.invalidate()
+    self.render(fullRender)
+
+  def handleKey(self, key):
+    # The default keys, returns True if the key was used
+    if key.is_sequence:
+      if key.name == 'KEY_TAB' or key.name == 'KEY_DOWN':
+        self.moveSelection(1)
+      elif key.name == 'KEY_UP':
+        self.moveSelection(-1)
+      elif key.name == 'KEY_ENTER':
+        self.runSelection()
+      elif key.name == 'KEY_ESCAPE' or (key.name == 'KEY_LEFT' and self.leftGoesBack):
+        self.close()
+      else:
+        return False
+      return True
+    if key == 'h': # H pressed
+      self.hideHelpText = not self.hideHelpText
+      self.needsRender = fullRender
+      return True
+    return False
+
+  def run(self):
+    # Returns once the menu is closed with [Escape], or by an item calling close()
+    term = getTerminal()
+    previousResizeHandler = signal.getsignal(signal.SIGWINCH)
+    signal.signal(signal.SIGWINCH, self.onResize)
+    self.running = True
+    self.needsRender = fullRender
+    if not isMenuItemSelectable(self.getItems(), self.selection):
+      self.moveSelection(1)
+    keyTimeout = None
+    if not self.onPoll == None:
+      keyTimeout = self.pollInterval
+    try:
+      with term.fullscreen():
+        with term.cbreak():
+          while self.running:
+            if not self.onPoll == None:
+              self.onPoll()
+              self.checkSelection()
+
+            if not self.needsRender == noRender: # Only rerender when changed to prevent flickering
+              renderType = self.needsRender
+              self.needsRender = noRender
+              self.render(renderType)
+
+            key = term.inkey(timeout=keyTimeout, esc_delay=0.05)
+            if not key: # Timed out, poll again
+              continue
+            if not self.onKey == None and self.onKey(key):
+              continue
+            self.handleKey(key)
+    finally:
+      signal.signal(signal.SIGWINCH, previousResizeHandler)
+    return True
+
+class ChecklistMenu(Menu):
+  # A menu of [title, { "checked": True }] items, such as the Node-RED addons or deconz hardware.
+  # [Space] checks or unchecks the selected item. With singleChoice, checking an item unchecks
+  # the others, and without allowNone the checked item can't be unchecked (a password option).
+  # [Enter] runs onSave(), which returns True if it saved, and closes the menu. [Escape] closes
+  # it without saving. [Tab] shows more or fewer rows at once.
+  def __init__(self, title, items, renderMode, onSave, singleChoice=False, allowNone=True, **menuOptions):
+    super().__init__(title, items, renderMode, formatRow=self.formatCheckboxRow, **menuOptions)
+    self.onSave = onSave
+    self.singleChoice = singleChoice
+    self.allowNone = allowNone
+    self.saved = False
+    self.maxPageSize = checklistPageSizes[0]
+    self.keepScrollLines = True
+
+  def formatCheckboxRow(self, menuItem, isSelected):
+    return formatCheckboxRow(menuItem[0], menuItem[1]["checked"], isSelected, self.renderMode, getTerminal().width)
+
+  def checkItem(self, index):
+    menu = self.getItems()
+    if self.singleChoice:
+      isChecked = menu[index][1]["checked"] and self.allowNone
+      for menuItem in menu:
+        menuItem[1]["checked"] = False
+      menu[index][1]["checked"] = not isChecked
+      self.refreshRows() # The previously checked item may be on another row
+    else:
+      menu[index][1]["checked"] = not menu[index][1]["checked"]
+      self.refreshRows([index])
+
+  def handleKey(self, key):
+    if key.is_sequence:
+      if key.name == 'KEY_TAB':
+        if self.maxPageSize == checklistPageSizes[0]:
+          self.maxPageSize = checklistPageSizes[1]
+        else:
+          self.maxPageSize = checklistPageSizes[0]
+        self.needsRender = fullRender
+        return True
+      if key.name == 'KEY_ENTER':
+        if self.onSave():
+          self.saved = True
+          self.close()
+        else:
+          print("Something went wrong. Try saving the list again.")
+        return True
+    elif key == ' ' and len(self.getItems()) > 0: # Space pressed
+      self.checkItem(self.selection)
+      return True
+    return super().handleKey(key)
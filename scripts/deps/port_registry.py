@@ -0,0 +1,155 @@
+import re
+from contextlib import contextmanager
+
+# A registry of every host port published by the selected services, so that port
+# conflicts for the whole stack are found in a single pass. It is rebuilt only when
+# the selected services or their ports change, and every template queries the same
+# registry from its checkForIssues() instead of comparing itself to each service.
+
+wildcardAddresses = ['', '0.0.0.0', '::']
+envVariablePattern = re.compile(r'\$\{[A-Za-z_][A-Za-z0-9_]*(?::?-([^}]*))?\}')
+
+lastFingerprint = None
+lastRegistry = None
+sharedServicesYaml = None
+
+def resolveEnvDefaults(portText):
+  # "${PORT:-8080}:80" resolves to "8080:80". Variables without defaults are left as is.
+  def replaceVariable(match):
+    if match.group(1) == None:
+      return match.group(0)
+    return match.group(1)
+  return envVariablePattern.sub(replaceVariable, portText)
+
+def parsePortRange(portText):
+  portText = portText.strip()
+  if portText == '':
+    return []
+  if '-' in portText:
+    rangeStart, rangeEnd = portText.split('-', 1)
+    return list(range(int(rangeStart), int(rangeEnd) + 1))
+  return [int(portText)]
+
+def splitHostIp(portText):
+  # IPv6 addresses must be in brackets: "[::1]:8080:80"
+  if portText.startswith('['):
+    closingBracket = portText.index(']')
+    return portText[1:closingBracket], portText[closingBracket + 2:]
+  parts = portText.split(':')
+  if len(parts) == 3:
+    return parts[0], parts[1] + ':' + parts[2]
+  return '', portText
+
+def parsePortMapping(portEntry):
+  # Returns a list of (hostIp, hostPort, protocol) for each published host port.
+  # Container only ports ("80") and ephemeral host ports ("127.0.0.1::80") publish nothing fixed.
+  if isinstance(portEntry, dict): # Long syntax
+    if not "published" in portEntry or portEntry["published"] in [None, '']:
+      return []
+    protocol = str(portEntry.get("protocol", "tcp")).lower()
+    hostIp = str(portEntry.get("host_ip", ""))
+    return [(hostIp, hostPort, protocol) for hostPort in parsePortRange(resolveEnvDefaults(str(portEntry["published"])))]
+
+  portText = resolveEnvDefaults(str(portEntry).strip())
+  protocol = "tcp"
+  if '/' in portText:
+    portText, protocol = portText.rsplit('/', 1)
+    protocol = protocol.lower()
+
+  hostIp, portText = splitHostIp(portText)
+  if not ':' in portText:
+    return []
+  hostPorts = parsePortRange(portText.rsplit(':', 1)[0])
+  return [(hostIp, hostPort, protocol) for hostPort in hostPorts]
+
+def formatPort(hostIp, hostPort, protocol):
+  portText = str(hostPort)
+  if not hostIp in wildcardAddresses:
+    portText = hostIp + ':' + portText
+  if not protocol == "tcp":
+    portText += '/' + protocol
+  return portText
+
+def addressesOverlap(firstIp, secondIp):
+  return firstIp in wildcardAddresses or secondIp in wildcardAddresses or firstIp == secondIp
+
+def getServicePorts(serviceName, dockerComposeServicesYaml):
+  try:
+    yamlService = dockerComposeServicesYaml[serviceName]
+    if yamlService and "ports" in yamlService and yamlService["ports"]:
+      return yamlService["ports"]
+  except (KeyError, TypeError):
+    pass
+  return []
+
+def getPortsFingerprint(dockerComposeServicesYaml):
+  fingerprint = []
+  for serviceName in dockerComposeServicesYaml:
+    fingerprint.append((serviceName, tuple(str(port) for port in getServicePorts(serviceName, dockerComposeServicesYaml))))
+  return tuple(fingerprint)
+
+def buildPortRegistry(dockerComposeServicesYaml):
+  # bindings: (hostPort, protocol) -> [(hostIp, serviceName), ...]
+  bindings = {}
+  unparsed = {}
+  for serviceName in dockerComposeServicesYaml:
+    for portEntry in getServicePorts(serviceName, dockerComposeServicesYaml):
+      try:
+        mappings = parsePortMapping(portEntry)
+      except (ValueError, IndexError):
+        unparsed.setdefault(serviceName, []).append(str(portEntry))
+        continue
+      for (hostIp, hostPort, protocol) in mappings:
+        bindings.setdefault((hostPort, protocol), []).append((hostIp, serviceName))
+
+  conflicts = {}
+  for ((hostPort, protocol), bound) in bindings.items():
+    if len(bound) < 2:
+      continue
+    for (index, (hostIp, serviceName)) in enumerate(bound):
+      for (otherIp, otherServiceName) in bound[index + 1:]:
+        if otherServiceName == serviceName or not addressesOverlap(hostIp, otherIp):
+          continue
+        conflicts.setdefault(serviceName, []).append([formatPort(hostIp, hostPort, protocol), otherServiceName])
+        conflicts.setdefault(otherServiceName, []).append([formatPort(otherIp, hostPort, protocol), serviceName])
+
+  return {
+    "bindings": bindings,
+    "conflicts": conflicts,
+    "unparsed": unparsed
+  }
+
+@contextmanager
+def sharedPortRegistry(dockerComposeServicesYaml):
+  # For a batch of checks that don't change any ports. Every lookup for this services dict
+  # reuses one registry, instead of fingerprinting every service's ports on each lookup.
+  global sharedServicesYaml
+  getPortRegistry(dockerComposeServicesYaml)
+  sharedServicesYaml = dockerComposeServicesYaml
+  try:
+    yield
+  finally:
+    sharedServicesYaml = None
+
+def getPortRegistry(dockerComposeServicesYaml):
+  global lastFingerprint
+  global lastRegistry
+  if dockerComposeServicesYaml is sharedServicesYaml and not lastRegistry == None:
+    return lastRegistry
+  fingerprint = getPortsFingerprint(dockerComposeServicesYaml)
+  if lastRegistry == None or not fingerprint == lastFingerprint:
+    lastRegistry = buildPortRegistry(dockerComposeServicesYaml)
+    lastFingerprint = fingerprint
+  return lastRegistry
+
+def getPortConflicts(serviceName, dockerComposeServicesYaml):
+  # Returns [[port, conflictingServiceName], ...] for the given service. Ports that couldn't be
+  # parsed, so can't be checked for conflicts, are returned as [portEntry, "portParse"]
+  registry = getPortRegistry(dockerComposeServicesYaml)
+  portConflicts = list(registry["conflicts"].get(serviceName, []))
+  for portEntry in registry["unparsed"].get(serviceName, []):
+    portConflicts.append([portEntry, "portParse"])
+  return portConflicts
+
+def getAllPortConflicts(dockerComposeServicesYaml):
+  return getPortRegistry(dockerComposeServicesYaml)["conflicts"]
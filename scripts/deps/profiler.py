@@ -0,0 +1,111 @@
+import os
+import sys
+import json
+import time
+import threading
+from contextlib import contextmanager
+from deps.consts import tempDirectory
+
+# Timing spans for the build pipeline. Wrap a step in 'with timeSpan(...)' and, when
+# profiling is turned on, its duration is recorded. Profiling is off by default and then
+# costs almost nothing. Turn it on with 'scripts/build.py --profile', or set IOTSTACK_PROFILE=1
+# to profile builds from the menu.
+#
+# printProfileReport() prints the time spent in each step, slowest first.
+# writeProfileTrace() saves the spans as a Chrome trace (open in chrome://tracing or
+# https://ui.perfetto.dev), which shows hooks that ran in parallel side by side.
+
+profilingEnabled = os.environ.get("IOTSTACK_PROFILE", "") == "1"
+profileStartTime = time.perf_counter()
+recordedSpans = []
+spansLock = threading.Lock()
+
+def enableProfiling(enabled=True):
+  global profilingEnabled
+  profilingEnabled = enabled
+  resetProfile()
+
+def isProfiling():
+  return profilingEnabled
+
+def resetProfile():
+  global profileStartTime
+  with spansLock:
+    recordedSpans.clear()
+  profileStartTime = time.perf_counter()
+
+@contextmanager
+def timeSpan(name, category, serviceName=None):
+  # category groups spans in the report: "catalog", "load", "checks", "hook", "merge", "write", "postbuild"
+  if not profilingEnabled:
+    yield
+    return
+  startTime = time.perf_counter()
+  try:
+    yield
+  finally:
+    duration = time.perf_counter() - startTime
+    with spansLock:
+      recordedSpans.append({
+        "name": name,
+        "category": category,
+        "service": serviceName,
+        "start": startTime - profileStartTime,
+        "duration": duration,
+        "thread": threading.get_ident()
+      })
+
+def getProfileSummary():
+  # Returns [{"name", "category", "service", "count", "total"}, ...] slowest first
+  summary = {}
+  with spansLock:
+    spans = list(recordedSpans)
+  for span in spans:
+    summaryKey = (span["category"], span["name"], span["service"])
+    if not summaryKey in summary:
+      summary[summaryKey] = { "name": span["name"], "category": span["category"], "service": span["service"], "count": 0, "total": 0.0 }
+    summary[summaryKey]["count"] += 1
+    summary[summaryKey]["total"] += span["duration"]
+  return sorted(summary.values(), key=lambda entry: entry["total"], reverse=True)
+
+def printProfileReport(stream=None, limit=None):
+  stream = stream or sys.stdout
+  profileSummary = getProfileSummary()
+  wallTime = time.perf_counter() - profileStartTime
+  print("", file=stream)
+  print("Build profile ({count} spans, {wall:.1f} ms since start):".format(count=sum(entry["count"] for entry in profileSummary), wall=wallTime * 1000), file=stream)
+  print("  {total:>10}  {count:>5}  {category:<10} {name}".format(total="ms", count="calls", category="step", name="name"), file=stream)
+  for entry in profileSummary[:limit]:
+    name = entry["name"]
+    if entry["service"]:
+      name = "{name} ({service})".format(name=name, service=entry["service"])
+    print("  {total:>10.1f}  {count:>5}  {category:<10} {name}".format(total=entry["total"] * 1000, count=entry["count"], category=entry["category"], name=name), file=stream)
+
+def writeProfileTrace(tracePath=None):
+  # Returns the path written to, or None if it couldn't be written
+  if not tracePath:
+    tracePath = tempDirectory + "build_profile_{time}.json".format(time=time.strftime("%Y%m%d-%H%M%S"))
+  traceEvents = []
+  with spansLock:
+    spans = list(recordedSpans)
+  for span in spans:
+    traceEvent = {
+      "name": span["name"],
+      "cat": span["category"],
+      "ph": "X",
+      "ts": round(span["start"] * 1000000),
+      "dur": round(span["duration"] * 1000000),
+      "pid": os.getpid(),
+      "tid": span["thread"]
+    }
+    if span["service"]:
+      traceEvent["args"] = { "service": span["service"] }
+    traceEvents.append(traceEvent)
+  try:
+    os.makedirs(os.path.dirname(tracePath) or '.', exist_ok=True)
+    with open(tracePath, 'w') as objTraceFile:
+      json.dump({ "traceEvents": traceEvents, "displayTimeUnit": "ms" }, objTraceFile)
+    return tracePath
+  except OSError as err:
+    print("Unable to write profile trace to '{path}': {err}".format(path=tracePath, err=err), file=sys.stderr)
+    return None
@@ -0,0 +1,72 @@
+import sys
+import threading
+from contextlib import contextmanager
+
+# Shared terminal and frame rendering for the menus.
+#
+# Creating a blessed Terminal() isn't free (it loads terminal capabilities, and may query the
+# terminal), and every menu, options menu and build.py used to create several, some of them on
+# every render. getTerminal() creates one the first time it's called and returns it from then on.
+#
+# A menu's mainRender() prints a frame line by line, dozens of writes that flicker and are slow
+# over SSH. Rendering inside renderFrame() collects everything the rendering thread prints and
+# writes it to the terminal in one go when the frame is done. Other threads' output isn't
+# collected. A frame rendered inside another (a submenu rendering while its parent's frame is
+# open) is written with the outer one. It can be used as a decorator:
+#
+#   @renderFrame()
+#   def mainRender(needsRender, menu, selection):
+#     term = getTerminal()
+#     print(term.clear())
+#     ...
+
+terminal = None
+frameBuffer = None
+
+def getTerminal():
+  global terminal
+  if terminal == None:
+    from blessed import Terminal
+    terminal = Terminal()
+  return terminal
+
+class FrameBuffer:
+  def __init__(self, stream):
+    self.stream = stream
+    self.threadId = threading.get_ident()
+    self.parts = []
+
+  def write(self, text):
+    if threading.get_ident() == self.threadId:
+      self.parts.append(text)
+    else:
+      self.stream.write(text)
+    return len(text)
+
+  def flush(self): # Frames are only flushed once they're done
+    if not threading.get_ident() == self.threadId:
+      self.stream.flush()
+
+  def getFrame(self):
+    return "".join(self.parts)
+
+  def __getattr__(self, name): # isatty(), encoding etc come from the terminal's stream
+    return getattr(self.stream, name)
+
+@contextmanager
+def renderFrame():
+  global frameBuffer
+  if not frameBuffer == None and frameBuffer.threadId == threading.get_ident():
+    yield frameBuffer # Written by the outer frame
+    return
+
+  frameBuffer = FrameBuffer(sys.stdout)
+  sys.stdout = frameBuffer
+  try:
+    yield frameBuffer
+  finally:
+    sys.stdout = frameBuffer.stream
+    frame = frameBuffer.getFrame()
+    frameBuffer = None
+    sys.stdout.write(frame) # Also written when rendering failed, so the error can be seen
+    sys.stdout.flush()
@@ -0,0 +1,186 @@
+import os
+import json
+import time
+import shutil
+import threading
+import subprocess
+from deps.consts import tempDirectory, startupProbesFile
+
+# Checks the main menu makes when it starts, run in background threads so the menu is drawn
+# straight away:
+#  * dockerVersion: The Docker daemon's version, from the Engine API (see deps/docker_api.py), or
+#    'docker version' when the daemon isn't on the local unix socket
+#  * projectUpdate: If there are new commits on this branch of IOTstack, from 'git fetch'
+# Each probe runs with a timeout. Successful results are saved to ./.tmp/startup_probes.json,
+# and reused until they are older than the probe's TTL, so opening the menu again doesn't wait
+# on the network or the Docker daemon. getResults() returns the results of the probes that
+# have finished, the main menu polls it from doPotentialMenuCheck().
+#
+# A result is also saved with a key of the state it was probed from (probeStateKeys), and isn't
+# reused once that changes, whatever its age:
+#  * projectUpdate: The branch and commit of HEAD, read from ./.git without running git, so a
+#    'git pull' (such as update_project in menu.sh) isn't followed by "Update IOTstack"
+#  * dockerVersion: When the docker and dockerd binaries were last changed, so upgrading or
+#    installing Docker outside of the menu is seen straight away
+
+cacheVersion = 2
+probeTimeout = 15 # Seconds, per command
+
+probeTtls = { # Seconds
+  "dockerVersion": 6 * 60 * 60,
+  "projectUpdate": 60 * 60
+}
+
+def runCommand(command):
+  # Returns the command's output, raises an error if it fails or times out. Nothing is read
+  # from or printed to the terminal, since the menu is drawn while probes run.
+  completedProcess = subprocess.run(
+    command,
+    stdin=subprocess.DEVNULL,
+    stdout=subprocess.PIPE,
+    stderr=subprocess.PIPE,
+    timeout=probeTimeout,
+    env=dict(os.environ, GIT_TERMINAL_PROMPT="0")
+  )
+  if not completedProcess.returncode == 0:
+    raise RuntimeError(completedProcess.stderr.decode("utf-8", "replace").strip())
+  return completedProcess.stdout.decode("utf-8").strip()
+
+def probeDockerVersion():
+  from deps.docker_api import DockerApi # Imported here, http.client is slow to import and only needed in this thread
+  dockerApi = DockerApi(timeout=probeTimeout) # Its own connection, since probes run in background threads
+  if dockerApi.isAvailable():
+    try:
+      return { "version": str(dockerApi.getVersion()["Version"]) }
+    except KeyError:
+      raise ValueError("No version in the Docker daemon's response")
+    finally:
+      dockerApi.close()
+  return { "version": runCommand(['docker', 'version', '-f', '{{.Server.Version}}']).replace('"', '') }
+
+def probeProjectUpdate():
+  currentBranch = runCommand(["git", "name-rev", "--name-only", "HEAD"])
+  runCommand(["git", "fetch", "origin", currentBranch])
+  behindCount = int(runCommand(["git", "rev-list", "--count", "HEAD..FETCH_HEAD"]))
+  return { "branch": currentBranch, "updateAvailable": behindCount > 0, "behind": behindCount }
+
+probes = {
+  "dockerVersion": probeDockerVersion,
+  "projectUpdate": probeProjectUpdate
+}
+
+def readGitFile(gitDirectory, fileName):
+  with open(os.path.join(gitDirectory, fileName)) as objGitFile:
+    return objGitFile.read().strip()
+
+def getGitHeadKey():
+  # Returns [ref, sha] of HEAD, or None if it can't be read
+  try:
+    gitDirectory = '.git'
+    if os.path.isfile(gitDirectory): # A worktree or submodule, .git says where the repository is
+      gitDirectory = readGitFile('.', '.git')[len('gitdir:'):].strip()
+    head = readGitFile(gitDirectory, 'HEAD')
+    if not head.startswith('ref:'):
+      return [None, head] # Detached
+    headRef = head[len('ref:'):].strip()
+    try:
+      return [headRef, readGitFile(gitDirectory, headRef)]
+    except OSError: # Packed, such as after 'git gc'
+      for line in readGitFile(gitDirectory, 'packed-refs').splitlines():
+        if line.endswith(' ' + headRef):
+          return [headRef, line.split(' ')[0]]
+      return [headRef, None]
+  except OSError:
+    return None
+
+def getDockerBinaryKey():
+  # Returns [[path, modified time], ...] of the docker binaries that are installed
+  dockerBinaries = []
+  for binaryName in ['docker', 'dockerd']:
+    binaryPath = shutil.which(binaryName)
+    if not binaryPath == None:
+      try:
+        dockerBinaries.append([binaryPath, os.stat(binaryPath).st_mtime_ns])
+      except OSError:
+        pass
+  return dockerBinaries
+
+probeStateKeys = {
+  "dockerVersion": getDockerBinaryKey,
+  "projectUpdate": getGitHeadKey
+}
+
+def loadProbeCache():
+  try:
+    with open(startupProbesFile) as objProbesFile:
+      probeCache = json.load(objProbesFile)
+    if probeCache.get("version") == cacheVersion and isinstance(probeCache.get("probes"), dict):
+      return probeCache
+  except (OSError, ValueError):
+    pass
+  return { "version": cacheVersion, "probes": {} }
+
+def saveProbeCache(probeCache):
+  tempPath = "{path}.{pid}.tmp".format(path=startupProbesFile, pid=os.getpid())
+  try:
+    os.makedirs(tempDirectory, exist_ok=True)
+    with open(tempPath, 'w') as objProbesFile:
+      json.dump(probeCache, objProbesFile, sort_keys=True)
+    os.replace(tempPath, startupProbesFile)
+    return True
+  except OSError:
+    return False
+
+def clearProbeCache(probeName):
+  probeCache = loadProbeCache()
+  if probeName in probeCache["probes"]:
+    del probeCache["probes"][probeName]
+    saveProbeCache(probeCache)
+
+class StartupProbes:
+  def __init__(self, probeNames=None):
+    self.probeNames = probeNames or list(probes)
+    self.results = {} # probeName: { "result": ..., "error": ... }
+    self.resultsLock = threading.Lock()
+    self.cacheLock = threading.Lock()
+
+  def start(self):
+    # Cached results are available straight away, the other probes are started together
+    probeCache = loadProbeCache()
+    for probeName in self.probeNames:
+      cachedProbe = probeCache["probes"].get(probeName)
+      if not cachedProbe == None and 0 <= time.time() - cachedProbe["time"] < probeTtls[probeName] and cachedProbe.get("stateKey") == probeStateKeys[probeName]():
+        self.results[probeName] = { "result": cachedProbe["result"], "error": None, "cached": True }
+      else:
+        probeThread = threading.Thread(target=self.runProbe, args=(probeName,), daemon=True)
+        probeThread.start()
+    return self
+
+  def runProbe(self, probeName):
+    stateKey = probeStateKeys[probeName]() # Before probing, a change while it runs is a change after it
+    try:
+      probeResult = { "result": probes[probeName](), "error": None, "cached": False }
+    except (OSError, ValueError, RuntimeError, subprocess.TimeoutExpired) as err:
+      probeResult = { "result": None, "error": str(err) or type(err).__name__, "cached": False }
+
+    if probeResult["error"] == None: # Errors, like the Docker daemon not running yet, are probed again next time
+      with self.cacheLock:
+        probeCache = loadProbeCache()
+        probeCache["probes"][probeName] = { "time": time.time(), "stateKey": stateKey, "result": probeResult["result"] }
+        saveProbeCache(probeCache)
+    with self.resultsLock:
+      self.results[probeName] = probeResult
+
+  def rerun(self, probeName):
+    # Probes again without the cached result, for when it's known to be out of date
+    with self.cacheLock:
+      clearProbeCache(probeName)
+    with self.resultsLock:
+      self.results.pop(probeName, None)
+    probeThread = threading.Thread(target=self.runProbe, args=(probeName,), daemon=True)
+    probeThread.start()
+
+  def getResults(self):
+    # Returns { probeName: { "result": ..., "error": ... } } for the probes that have finished
+    with self.resultsLock:
+      return dict(self.results)
@@ -0,0 +1,147 @@
+import os
+import json
+from deps.consts import tempDirectory, templatesDirectory, servicesFileName, templateCatalogFile
+from deps.hook_loader import getFileSignature
+from deps.hook_index import getHookCapabilities, saveHookIndex
+from deps.dependency_graph import getDependsOn
+from deps.yaml_io import readYaml
+from deps.profiler import timeSpan
+
+# A catalog of every template in ./.templates, saved to ./.tmp/templates_catalog.json.
+# For each template it keeps the service.yml text, the parsed services, a summary of the
+# main service (image, ports, volumes, devices, depends_on), and which build hooks its
+# build.py defines. The menus and scripts/build.py read this once at startup instead of
+# walking ./.templates and parsing every service.yml. A template's entry is only rebuilt
+# when its service.yml or build.py changes.
+
+catalogVersion = 2
+buildScriptFile = 'build.py'
+
+templateCatalog = None
+
+def loadCatalogFile():
+  try:
+    with open(templateCatalogFile) as objCatalogFile:
+      catalog = json.load(objCatalogFile)
+    if catalog.get("version") == catalogVersion and isinstance(catalog.get("templates"), dict):
+      return catalog
+  except (OSError, ValueError):
+    pass
+  return { "version": catalogVersion, "templates": {} }
+
+def saveCatalogFile(catalog):
+  tempPath = "{path}.{pid}.tmp".format(path=templateCatalogFile, pid=os.getpid())
+  try:
+    os.makedirs(tempDirectory, exist_ok=True)
+    with open(tempPath, 'w') as objCatalogFile:
+      json.dump(catalog, objCatalogFile, sort_keys=True)
+    os.replace(tempPath, templateCatalogFile)
+    return True
+  except OSError:
+    return False
+
+def getListValue(serviceYaml, key):
+  if isinstance(serviceYaml, dict) and isinstance(serviceYaml.get(key), list):
+    return [str(value) if not isinstance(value, dict) else value for value in serviceYaml[key]]
+  return []
+
+def getTemplateSummary(templateName, servicesYaml):
+  serviceYaml = servicesYaml.get(templateName)
+  providedServices = [serviceName for serviceName in servicesYaml if not serviceName == templateName]
+  dependsOn = []
+  for otherServiceYaml in servicesYaml.values():
+    for dependencyName in getDependsOn(otherServiceYaml):
+      if not dependencyName == templateName and not dependencyName in providedServices and not dependencyName in dependsOn:
+        dependsOn.append(dependencyName)
+
+  image = None
+  if isinstance(serviceYaml, dict):
+    image = serviceYaml.get("image")
+  return {
+    "image": image,
+    "ports": getListValue(serviceYaml, "ports"),
+    "volumes": getListValue(serviceYaml, "volumes"),
+    "devices": getListValue(serviceYaml, "devices"),
+    "dependsOn": dependsOn,
+    "provided": providedServices
+  }
+
+def buildCatalogEntry(templateName, serviceSignature, buildSignature):
+  serviceFilePath = templatesDirectory + templateName + '/' + servicesFileName
+  buildScriptPath = templatesDirectory + templateName + '/' + buildScriptFile
+  with open(serviceFilePath) as objServiceFile:
+    serviceText = objServiceFile.read()
+
+  catalogEntry = {
+    "serviceSignature": serviceSignature,
+    "buildSignature": buildSignature,
+    "serviceText": serviceText,
+    "services": {},
+    "summary": getTemplateSummary(templateName, {}),
+    "hooks": None,
+    "error": None
+  }
+  try:
+    servicesYaml = readYaml(serviceText) or {}
+    # Round trip through json so the entry only holds what the catalog file can store
+    catalogEntry["services"] = json.loads(json.dumps(servicesYaml, default=str))
+    catalogEntry["summary"] = getTemplateSummary(templateName, catalogEntry["services"])
+  except Exception as err:
+    catalogEntry["error"] = str(err)
+  if not buildSignature == None:
+    try:
+      catalogEntry["hooks"] = getHookCapabilities(buildScriptPath)
+    except Exception as err:
+      catalogEntry["error"] = str(err)
+  return catalogEntry
+
+def getBuildSignature(templateName):
+  try:
+    return list(getFileSignature(templatesDirectory + templateName + '/' + buildScriptFile))
+  except OSError:
+    return None
+
+def refreshTemplateCatalog():
+  # Checks every template against the catalog file, and rebuilds only the entries that changed
+  global templateCatalog
+  catalog = loadCatalogFile()
+  catalogChanged = False
+  templates = {}
+  templateNames = sorted(entry.name for entry in os.scandir(templatesDirectory) if entry.is_dir())
+  for templateName in templateNames:
+    try:
+      serviceSignature = list(getFileSignature(templatesDirectory + templateName + '/' + servicesFileName))
+    except OSError:
+      continue # Not a template
+    buildSignature = getBuildSignature(templateName)
+    catalogEntry = catalog["templates"].get(templateName)
+    if catalogEntry == None or not catalogEntry["serviceSignature"] == serviceSignature or not catalogEntry["buildSignature"] == buildSignature:
+      catalogEntry = buildCatalogEntry(templateName, serviceSignature, buildSignature)
+      catalogChanged = True
+    templates[templateName] = catalogEntry
+
+  if catalogChanged or not list(templates) == sorted(catalog["templates"]):
+    catalog["templates"] = templates
+    saveCatalogFile(catalog)
+    saveHookIndex()
+  templateCatalog = catalog
+  return templateCatalog
+
+def getTemplateCatalog():
+  if templateCatalog == None:
+    with timeSpan("Load template catalog", "catalog"):
+      return refreshTemplateCatalog()
+  return templateCatalog
+
+def getTemplateNames():
+  return list(getTemplateCatalog()["templates"])
+
+def getTemplateEntry(templateName):
+  return getTemplateCatalog()["templates"][templateName]
+
+def getTemplateDependencies():
+  # {templateName: [depends_on, ...]} for deps/dependency_graph.py
+  templateDependencies = {}
+  for (templateName, catalogEntry) in getTemplateCatalog()["templates"].items():
+    templateDependencies[templateName] = catalogEntry["summary"]["dependsOn"]
+  return templateDependencies
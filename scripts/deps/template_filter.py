@@ -0,0 +1,97 @@
+import re
+from deps.template_catalog import getTemplateCatalog
+
+# Type to filter for the build stack menu. Each template is indexed once, by its name, image,
+# container names and the services it provides (from the template catalog, see
+# deps/template_catalog.py), into:
+#  * a prefix index, every prefix of every word ("home_assistant" has "h", "ho", ... "assistant")
+#  * an n-gram index, every 1, 2 and 3 character run of each indexed text
+#
+# Every word typed must be found in the template's text, in any order: words up to 3 characters
+# are looked up directly in the n-gram index, longer ones must have all of their trigrams there.
+# Typing more only ever narrows the results, so each keystroke filters the previous keystroke's
+# results rather than every template. Templates where the words start a word (a prefix index hit)
+# are listed first.
+
+wordSplitPattern = re.compile(r'[^a-z0-9]+')
+maxNgramLength = 3
+
+def normaliseText(text):
+  return str(text).lower().strip()
+
+def getWords(text):
+  return [word for word in wordSplitPattern.split(normaliseText(text)) if not word == '']
+
+def getNgrams(text, ngramLength):
+  return set(text[index:index + ngramLength] for index in range(len(text) - ngramLength + 1))
+
+def getSearchTexts(templateName, catalogEntry):
+  searchTexts = [templateName]
+  summary = catalogEntry.get("summary") or {}
+  if summary.get("image"):
+    searchTexts.append(summary["image"])
+  searchTexts += summary.get("provided") or []
+  for serviceYaml in (catalogEntry.get("services") or {}).values():
+    if isinstance(serviceYaml, dict) and serviceYaml.get("container_name"):
+      searchTexts.append(serviceYaml["container_name"])
+  return [normaliseText(searchText) for searchText in searchTexts]
+
+class TemplateFilter:
+  def __init__(self, templates):
+    # templates: {templateName: [searchText, ...]}, in the order results are listed
+    self.templateNames = list(templates)
+    self.templateOrder = { templateName: index for (index, templateName) in enumerate(self.templateNames) }
+    self.prefixIndex = {}
+    self.ngramIndex = {}
+    self.lastQuery = None
+    self.lastResults = self.templateNames
+    for (templateName, searchTexts) in templates.items():
+      for searchText in searchTexts:
+        for word in getWords(searchText):
+          for prefixLength in range(1, len(word) + 1):
+            self.prefixIndex.setdefault(word[:prefixLength], set()).add(templateName)
+        for ngramLength in range(1, maxNgramLength + 1):
+          for ngram in getNgrams(searchText, ngramLength):
+            self.ngramIndex.setdefault(ngram, set()).add(templateName)
+
+  def getWordMatches(self, word):
+    if len(word) <= maxNgramLength:
+      return self.ngramIndex.get(word, set())
+    wordMatches = None
+    for ngram in getNgrams(word, maxNgramLength):
+      ngramMatches = self.ngramIndex.get(ngram, set())
+      wordMatches = ngramMatches if wordMatches == None else wordMatches & ngramMatches
+      if len(wordMatches) == 0:
+        break
+    return wordMatches
+
+  def search(self, query):
+    # Returns the matching template names, best matches first
+    query = normaliseText(query)
+    queryWords = [word for word in query.split(' ') if not word == '']
+    if len(queryWords) == 0:
+      self.lastQuery = query
+      self.lastResults = self.templateNames
+      return self.lastResults
+
+    candidates = self.templateNames
+    if not self.lastQuery == None and query.startswith(self.lastQuery):
+      candidates = self.lastResults # Narrowing, only the last results can still match
+
+    matches = set(candidates)
+    for word in queryWords:
+      matches &= self.getWordMatches(word)
+
+    def getRank(templateName):
+      prefixHits = sum([1 for word in queryWords if templateName in self.prefixIndex.get(word, ())])
+      return (not templateName.startswith(queryWords[0]), -prefixHits, self.templateOrder[templateName])
+
+    self.lastQuery = query
+    self.lastResults = sorted(matches, key=getRank)
+    return self.lastResults
+
+def buildTemplateFilter(templateNames=None):
+  catalogTemplates = getTemplateCatalog()["templates"]
+  if templateNames == None:
+    templateNames = list(catalogTemplates)
+  return TemplateFilter({ templateName: getSearchTexts(templateName, catalogTemplates[templateName]) for templateName in templateNames })
@@ -0,0 +1,57 @@
+import threading
+from io import StringIO
+
+# One place to load and save YAML, with two modes:
+#  readYaml():      For files that are only read (template lists, build settings during checks,
+#                   the template catalog). Uses the safe loader, which is C accelerated when
+#                   ruamel.yaml's C extension is installed, and returns plain dicts and lists.
+#  loadRoundTrip(): For anything that ends up in docker-compose.yml or is saved back to disk.
+#                   Keeps comments, key order and quoting, but is much slower.
+# Both take an open file or a string. ruamel.yaml's YAML objects can't be shared between
+# threads, and build hooks run in parallel, so each thread gets its own.
+# ruamel.yaml is slow to import on a Pi, so it's only imported the first time YAML is loaded
+# or saved, not when the menus start. See scripts/development/check_import_time.py
+
+threadYaml = threading.local()
+
+def getSafeYaml():
+  if not hasattr(threadYaml, "safe"):
+    import ruamel.yaml
+    threadYaml.safe = ruamel.yaml.YAML(typ='safe')
+  return threadYaml.safe
+
+def getRoundTripYaml():
+  if not hasattr(threadYaml, "roundTrip"):
+    import ruamel.yaml
+    threadYaml.roundTrip = ruamel.yaml.YAML()
+    threadYaml.roundTrip.preserve_quotes = True
+  return threadYaml.roundTrip
+
+def hasCLoader():
+  try:
+    import _ruamel_yaml
+    return True
+  except ImportError:
+    return False
+
+def readYaml(streamOrText):
+  return getSafeYaml().load(streamOrText)
+
+def readYamlFile(filePath):
+  with open(r'%s' % filePath) as objYamlFile:
+    return readYaml(objYamlFile)
+
+def loadRoundTrip(streamOrText):
+  return getRoundTripYaml().load(streamOrText)
+
+def loadRoundTripFile(filePath):
+  with open(r'%s' % filePath) as objYamlFile:
+    return loadRoundTrip(objYamlFile)
+
+def dumpRoundTrip(yamlData, stream):
+  getRoundTripYaml().dump(yamlData, stream)
+
+def dumpRoundTripText(yamlData):
+  outputStream = StringIO()
+  dumpRoundTrip(yamlData, outputStream)
+  return outputStream.getvalue()
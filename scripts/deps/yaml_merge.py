@@ -1,19 +1,152 @@
+from ruamel.yaml.comments import CommentedBase, CommentedMap, CommentedSeq
 
-def mergeYaml(priorityYaml, defaultYaml):
+# Merges compose-override.yml (priorityYaml) into the generated docker-compose (defaultYaml).
+#  * Mappings are merged key by key, keys from defaultYaml keep their order and new keys from
+#    priorityYaml are added after them.
+#  * Any other value in priorityYaml replaces the one in defaultYaml. How lists are merged can
+#    be changed per path, see mergeStrategies below.
+# Each node is visited once, without recursion. The inputs aren't changed: merged mappings and
+# lists are new objects, everything else is shared with the inputs. Comments and formatting
+# on ruamel.yaml's CommentedMap/CommentedSeq are copied to the merged objects.
+#
+# List merge strategies:
+#  replace:    The list from priorityYaml replaces the default list (default).
+#  append:     Entries from priorityYaml not already in the default list are added to the end.
+#  mergeByKey: Entries with the same key replace the default entry in place, others are added
+#              to the end. The key of an environment entry is the variable name ("TZ=..."), of a
+#              port the container port and protocol ("1880/tcp") and of a volume the container
+#              path. For other lists the entry itself is the key.
+#
+# Strategies are set per path, where '*' matches any key. compose-override.yml can set them with
+# a top level 'x-iotstack-merge' key, which is removed from the output:
+#
+# x-iotstack-merge:
+#   services.*.environment: mergeByKey
+#   services.nodered.volumes: append
+
+mergeStrategiesKey = 'x-iotstack-merge'
+mergeStrategyNames = {
+  "replace": "replace",
+  "append": "append",
+  "mergeByKey": "mergeByKey",
+  "merge-by-key": "mergeByKey"
+}
+
+def splitMergeStrategies(overrideYaml):
+  # Returns (overrideYaml without 'x-iotstack-merge', strategies)
+  if not isinstance(overrideYaml, dict) or not mergeStrategiesKey in overrideYaml:
+    return overrideYaml, {}
+  strategies = overrideYaml[mergeStrategiesKey] or {}
+  del overrideYaml[mergeStrategiesKey]
+  return overrideYaml, dict(strategies)
+
+def compileStrategies(strategies):
+  compiledStrategies = []
+  for (pathPattern, strategyName) in (strategies or {}).items():
+    if not strategyName in mergeStrategyNames:
+      raise ValueError("Unknown merge strategy '{strategy}' for '{path}'. Use one of: replace, append, mergeByKey".format(strategy=strategyName, path=pathPattern))
+    compiledStrategies.append((tuple(str(pathPattern).split('.')), mergeStrategyNames[strategyName]))
+  return compiledStrategies
+
+def getStrategy(compiledStrategies, path):
+  # The last matching pattern wins, so specific paths can be listed after wildcards
+  strategy = "replace"
+  for (pattern, strategyName) in compiledStrategies:
+    if len(pattern) == len(path) and all(part == '*' or part == str(key) for (part, key) in zip(pattern, path)):
+      strategy = strategyName
+  return strategy
+
+def getEnvironmentKey(entry):
+  return str(entry).split('=', 1)[0].strip()
+
+def getPortKey(entry):
+  if isinstance(entry, dict):
+    return "{target}/{protocol}".format(target=entry.get("target"), protocol=entry.get("protocol", "tcp"))
+  portText = str(entry).strip()
+  protocol = "tcp"
+  if '/' in portText:
+    portText, protocol = portText.rsplit('/', 1)
+  return "{target}/{protocol}".format(target=portText.rsplit(':', 1)[-1], protocol=protocol)
+
+def getVolumeKey(entry):
+  if isinstance(entry, dict):
+    return str(entry.get("target"))
+  volumeParts = str(entry).split(':')
+  if len(volumeParts) == 1:
+    return volumeParts[0]
+  return volumeParts[1]
+
+def getEntryKey(path, entry):
+  listName = str(path[-1]) if len(path) > 0 else ''
+  if listName == "environment":
+    return getEnvironmentKey(entry)
+  if listName == "ports":
+    return getPortKey(entry)
+  if listName == "volumes":
+    return getVolumeKey(entry)
+  return repr(entry)
+
+def newMappingLike(sourceMapping):
+  if isinstance(sourceMapping, CommentedBase):
+    mergedMapping = CommentedMap()
+    sourceMapping.copy_attributes(mergedMapping)
+    return mergedMapping
+  return {}
+
+def newListLike(sourceList):
+  if isinstance(sourceList, CommentedBase):
+    mergedList = CommentedSeq()
+    sourceList.copy_attributes(mergedList)
+    return mergedList
+  return []
+
+def mergeLists(priorityList, defaultList, strategy, path):
+  if strategy == "replace":
+    return priorityList
+  mergedList = newListLike(defaultList)
+  mergedList.extend(defaultList)
+  if strategy == "append":
+    for entry in priorityList:
+      if not entry in mergedList:
+        mergedList.append(entry)
+    return mergedList
+
+  entryIndexes = {}
+  for (index, entry) in enumerate(mergedList):
+    entryIndexes[getEntryKey(path, entry)] = index
+  for entry in priorityList:
+    entryKey = getEntryKey(path, entry)
+    if entryKey in entryIndexes:
+      mergedList[entryIndexes[entryKey]] = entry
+    else:
+      entryIndexes[entryKey] = len(mergedList)
+      mergedList.append(entry)
+  return mergedList
+
+def mergeYaml(priorityYaml, defaultYaml, strategies=None):
   if not priorityYaml:
-      return defaultYaml
-  finalYaml = {}
-  if isinstance(defaultYaml, dict):
-    for dk, dv in defaultYaml.items():
-      if dk in priorityYaml:
-        finalYaml[dk] = mergeYaml(priorityYaml[dk], dv)
-      else:
-        finalYaml[dk] = dv
-    for pk, pv in priorityYaml.items():
-      if pk in finalYaml:
-        finalYaml[pk] = mergeYaml(finalYaml[pk], pv)
-      else:
-        finalYaml[pk] = pv
-  else:
-    finalYaml = defaultYaml
-  return finalYaml
+    return defaultYaml
+  compiledStrategies = compileStrategies(strategies)
+
+  mergedRoot = [None]
+  # Each entry: (priority value, default value, container to write into, key in container, path)
+  toMerge = [(priorityYaml, defaultYaml, mergedRoot, 0, ())]
+  while len(toMerge) > 0:
+    priorityValue, defaultValue, container, key, path = toMerge.pop()
+    if isinstance(priorityValue, dict) and isinstance(defaultValue, dict):
+      mergedMapping = newMappingLike(defaultValue)
+      container[key] = mergedMapping
+      for (defaultKey, defaultChild) in defaultValue.items():
+        if defaultKey in priorityValue:
+          mergedMapping[defaultKey] = None # Keeps the key's position until it's merged
+          toMerge.append((priorityValue[defaultKey], defaultChild, mergedMapping, defaultKey, path + (defaultKey,)))
+        else:
+          mergedMapping[defaultKey] = defaultChild
+      for (priorityKey, priorityChild) in priorityValue.items():
+        if not priorityKey in defaultValue:
+          mergedMapping[priorityKey] = priorityChild
+    elif isinstance(priorityValue, list) and isinstance(defaultValue, list) and len(compiledStrategies) > 0:
+      container[key] = mergeLists(priorityValue, defaultValue, getStrategy(compiledStrategies, path), path)
+    else:
+      container[key] = priorityValue
+  return mergedRoot[0]
@@ -0,0 +1,311 @@
+#!/usr/bin/env python3
+# Checks the Docker Engine API client (deps/docker_api.py) against a fake Docker daemon, an HTTP
+# server on a unix socket in a temp directory. No Docker install is needed, so it can be run on
+# any machine after changing the client or the menu commands that use it.
+#
+# It checks that requests share one kept alive connection, that a connection closed by the
+# daemon is opened again, how errors and "not modified" answers are returned, the streamed
+# events, that stopContainers() stops containers at the same time, and that a stop isn't cut
+# short by the client's timeout. With --menu it also runs the Docker Commands menu in a pty
+# and selects "Stop ALL running docker containers".
+#
+# Usage:
+#  python3 ./scripts/development/check_docker_api.py
+#  python3 ./scripts/development/check_docker_api.py --menu
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import threading
+import socketserver
+import http.server
+
+class FakeDockerDaemon(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  daemon_threads = True
+
+  def __init__(self, socketPath):
+    self.containers = {
+      "a1b2c3d4e5f6a7b8": { "Names": ["/nodered"], "running": True },
+      "b1b2c3d4e5f6a7b8": { "Names": ["/grafana"], "running": True },
+      "c1b2c3d4e5f6a7b8": { "Names": ["/influxdb"], "running": False }
+    }
+    self.stopDelay = 0 # Seconds each stop takes
+    self.closeAfterResponse = False # Close kept alive connections without saying so, like an idle timeout
+    self.connectionCount = 0
+    self.requests = []
+    self.lock = threading.Lock()
+    super().__init__(socketPath, FakeDockerHandler)
+
+  def start(self):
+    threading.Thread(target=self.serve_forever, daemon=True).start()
+    return self
+
+  def stop(self):
+    self.shutdown()
+    self.server_close()
+
+class FakeDockerHandler(http.server.BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def setup(self):
+    super().setup()
+    with self.server.lock:
+      self.server.connectionCount += 1
+
+  def address_string(self):
+    return "unix"
+
+  def log_message(self, *args):
+    pass
+
+  def sendJson(self, status, responseData=None):
+    responseBody = b''
+    if not responseData == None:
+      responseBody = json.dumps(responseData).encode("utf-8")
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(responseBody)))
+    self.end_headers()
+    if len(responseBody) > 0: # The client may have closed the connection once it had the headers
+      self.wfile.write(responseBody)
+    if self.server.closeAfterResponse:
+      self.close_connection = True
+
+  def do_GET(self):
+    with self.server.lock:
+      self.server.requests.append(("GET", self.path))
+    (path, separator, query) = self.path.partition("?")
+    if path == "/version":
+      self.sendJson(200, { "Version": "24.0.7", "ApiVersion": "1.43" })
+    elif path == "/containers/json":
+      showAll = "all=1" in query
+      self.sendJson(200, [
+        { "Id": containerId, "Names": container["Names"], "State": "running" if container["running"] else "exited" }
+        for (containerId, container) in self.server.containers.items() if showAll or container["running"]
+      ])
+    elif path.startswith("/containers/") and path.endswith("/stats"):
+      self.sendJson(200, { "read": "2024-01-01T00:00:00Z", "query": query })
+    elif path == "/events":
+      self.send_response(200)
+      self.send_header("Content-Type", "application/json")
+      self.send_header("Transfer-Encoding", "chunked")
+      self.end_headers()
+      for index in range(3):
+        eventLine = (json.dumps({ "Type": "container", "Action": "start", "index": index }) + "\n").encode("utf-8")
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(eventLine), eventLine))
+        self.wfile.flush()
+      self.wfile.write(b"0\r\n\r\n")
+      self.close_connection = True
+    else:
+      self.sendJson(404, { "message": "page not found" })
+
+  def do_POST(self):
+    with self.server.lock:
+      self.server.requests.append(("POST", self.path))
+    (path, separator, query) = self.path.partition("?")
+    pathParts = path.split("/") # ["", "containers", id, action]
+    if not len(pathParts) == 4 or not pathParts[1] == "containers":
+      self.sendJson(404, { "message": "page not found" })
+      return
+    container = self.server.containers.get(pathParts[2])
+    if container == None:
+      self.sendJson(404, { "message": "No such container: {id}".format(id=pathParts[2]) })
+    elif pathParts[3] == "stop":
+      if not container["running"]:
+        self.sendJson(304)
+        return
+      time.sleep(self.server.stopDelay)
+      container["running"] = False
+      self.sendJson(204)
+    elif pathParts[3] == "start":
+      if container["running"]:
+        self.sendJson(304)
+        return
+      container["running"] = True
+      self.sendJson(204)
+    elif pathParts[3] == "restart":
+      time.sleep(self.server.stopDelay)
+      container["running"] = True
+      self.sendJson(204)
+    else:
+      self.sendJson(404, { "message": "page not found" })
+
+def parseArguments():
+  parser = argparse.ArgumentParser(description="Check the Docker Engine API client against a fake Docker daemon.")
+  parser.add_argument("--menu", action="store_true", help="Also run the Docker Commands menu in a pty and stop all containers from it.")
+  return parser.parse_args()
+
+def checkRequests(socketPath):
+  # Returns a list of problems found
+  from deps.docker_api import DockerApi, DockerApiError
+  problems = []
+  fakeDaemon = FakeDockerDaemon(socketPath).start()
+  dockerApi = DockerApi(socketPath)
+  try:
+    if not dockerApi.isAvailable():
+      problems.append("isAvailable() is False with the socket there")
+    if not dockerApi.getVersion().get("Version") == "24.0.7":
+      problems.append("getVersion() didn't return the daemon's version")
+    if not len(dockerApi.listContainers()) == 2 or not len(dockerApi.listContainers(all=True)) == 3:
+      problems.append("listContainers() didn't return the running, or all, containers")
+    if not dockerApi.startContainer("c1b2c3d4e5f6a7b8") == True or not dockerApi.startContainer("c1b2c3d4e5f6a7b8") == False:
+      problems.append("startContainer() should return True, then False once it was already started")
+    if not dockerApi.restartContainer("a1b2c3d4e5f6a7b8", timeout=5) == True:
+      problems.append("restartContainer() should return True")
+    try:
+      dockerApi.stopContainer("missing")
+      problems.append("stopContainer() of a missing container didn't raise DockerApiError")
+    except DockerApiError as err:
+      if not err.status == 404 or not err.message == "No such container: missing":
+        problems.append("DockerApiError has the wrong status or message: {err}".format(err=err))
+    if not "one-shot=1" in dockerApi.getStats("a1b2c3d4e5f6a7b8").get("query", ""):
+      problems.append("getStats() didn't ask for one sample")
+    if not fakeDaemon.connectionCount == 1:
+      problems.append("Requests used {count} connections, expected them to share 1".format(count=fakeDaemon.connectionCount))
+
+    events = list(dockerApi.getEvents(since=1, until=2, filters={ "type": ["container"] }))
+    if not [event.get("index") for event in events] == [0, 1, 2]:
+      problems.append("getEvents() returned {events}".format(events=events))
+    if not dockerApi.getVersion().get("Version") == "24.0.7" or not fakeDaemon.connectionCount == 2:
+      problems.append("The events stream should have its own connection, and not close the shared one")
+
+    fakeDaemon.closeAfterResponse = True
+    try:
+      for attempt in range(3):
+        dockerApi.getVersion()
+    except OSError as err:
+      problems.append("A connection closed by the daemon wasn't opened again: {err}".format(err=repr(err)))
+    fakeDaemon.closeAfterResponse = False
+  finally:
+    dockerApi.close()
+    fakeDaemon.stop()
+    os.remove(socketPath)
+
+  try:
+    dockerApi.getVersion()
+    problems.append("A request with no daemon didn't raise OSError")
+  except OSError:
+    pass
+  if DockerApi(socketPath).isAvailable():
+    problems.append("isAvailable() is True with no socket")
+  return problems
+
+def checkStopContainers(socketPath):
+  from deps.docker_api import DockerApi
+  problems = []
+  fakeDaemon = FakeDockerDaemon(socketPath)
+  for index in range(6):
+    fakeDaemon.containers["d{index}".format(index=index)] = { "Names": ["/service{index}".format(index=index)], "running": True }
+  fakeDaemon.containers["missing"] = { "Names": ["/missing"], "running": True }
+  fakeDaemon.stopDelay = 1
+  fakeDaemon.start()
+  dockerApi = DockerApi(socketPath, timeout=0.5) # Shorter than a stop, which must still finish
+  try:
+    containerIds = [container["Id"] for container in dockerApi.listContainers()]
+    del fakeDaemon.containers["missing"] # Removed after being listed
+    startTime = time.monotonic()
+    stopResults = list(dockerApi.stopContainers(containerIds + ["c1b2c3d4e5f6a7b8"]))
+    stopTime = time.monotonic() - startTime
+    print("Stopped {count} containers taking {delay}s each in {time:.1f}s".format(count=len(containerIds), delay=fakeDaemon.stopDelay, time=stopTime))
+
+    stopErrors = { containerId: err for (containerId, stopped, err) in stopResults if not err == None }
+    if stopTime > fakeDaemon.stopDelay * 3:
+      problems.append("stopContainers() took {time:.1f}s, the containers weren't stopped at the same time".format(time=stopTime))
+    if not list(stopErrors) == ["missing"]:
+      problems.append("stopContainers() errors: {errors}, expected only 'missing' to fail".format(errors=stopErrors))
+    if not [stopped for (containerId, stopped, err) in stopResults if containerId == "c1b2c3d4e5f6a7b8"] == [False]:
+      problems.append("stopContainers() should return False for a container that was already stopped")
+    if any(container["running"] for container in fakeDaemon.containers.values()):
+      problems.append("Containers were left running: {containers}".format(containers=fakeDaemon.containers))
+  finally:
+    dockerApi.close()
+    fakeDaemon.stop()
+    os.remove(socketPath)
+  return problems
+
+def checkMenu(socketPath):
+  # Runs the Docker Commands menu in a pty, and selects "Stop ALL running docker containers"
+  import pty
+  import select
+  problems = []
+  fakeDaemon = FakeDockerDaemon(socketPath).start()
+  menuCode = "import sys; sys.path.insert(0, './scripts'); import docker_commands; docker_commands.main('latin')"
+  processId, terminalFd = pty.fork()
+  if processId == 0:
+    os.environ["DOCKER_HOST"] = "unix://" + socketPath
+    os.environ["TERM"] = "xterm-256color"
+    os.execvp(sys.executable, [sys.executable, "-c", menuCode])
+
+  menuOutput = b''
+  def readOutput(seconds):
+    nonlocal menuOutput
+    endTime = time.monotonic() + seconds
+    while time.monotonic() < endTime:
+      (readable, writable, errored) = select.select([terminalFd], [], [], 0.05)
+      if readable:
+        try:
+          outputData = os.read(terminalFd, 65536)
+        except OSError:
+          return
+        menuOutput += outputData
+        for query in range(outputData.count(b'\x1b[6n')): # blessed asks where the cursor is
+          os.write(terminalFd, b'\x1b[1;1R')
+
+  try:
+    readOutput(2)
+    for key in ['\x1b[B'] * 4 + ['\r']: # Down to "Stop ALL running docker containers"
+      os.write(terminalFd, key.encode("utf-8"))
+      readOutput(0.3)
+    readOutput(2)
+    os.write(terminalFd, b'\r') # "Press [Enter] to show menu and continue."
+    readOutput(0.5)
+    os.write(terminalFd, b'\x1b')
+    readOutput(0.5)
+  finally:
+    try:
+      os.kill(processId, 9)
+      os.waitpid(processId, 0)
+    except OSError:
+      pass
+    fakeDaemon.stop()
+    os.remove(socketPath)
+
+  menuText = menuOutput.decode("utf-8", "replace")
+  for containerName in ["nodered", "grafana"]:
+    if not "Stopped {name}".format(name=containerName) in menuText:
+      problems.append("The menu didn't print 'Stopped {name}'".format(name=containerName))
+  if any(container["running"] for container in fakeDaemon.containers.values()):
+    problems.append("The menu left containers running")
+  return problems
+
+def main():
+  os.chdir(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+  sys.path.insert(0, './scripts')
+  args = parseArguments()
+  tempDirectory = tempfile.mkdtemp(prefix="iotstack_docker_api_")
+  socketPath = os.path.join(tempDirectory, "docker.sock")
+  checks = [("Requests", checkRequests), ("Stop containers", checkStopContainers)]
+  if args.menu:
+    checks.append(("Docker Commands menu", checkMenu))
+
+  problems = []
+  try:
+    for (checkName, checkFunction) in checks:
+      checkProblems = checkFunction(socketPath)
+      print("{name}: {result}".format(name=checkName, result="FAIL" if len(checkProblems) > 0 else "OK"))
+      problems += ["{name}: {problem}".format(name=checkName, problem=problem) for problem in checkProblems]
+  finally:
+    shutil.rmtree(tempDirectory, ignore_errors=True)
+
+  if len(problems) > 0:
+    print("")
+    for problem in problems:
+      print("FAIL", problem)
+    sys.exit(1)
+  print("OK, the client works against the fake Docker daemon")
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# Checks how long the menus take to start. Fails if:
+#  * a module that should only be imported later (such as ruamel.yaml, see deps/yaml_io.py) is
+#    imported at startup, found with python's -X importtime
+#  * the startup imports take longer than the import budget
+#  * the menu takes longer than the frame budget to draw its first frame. The menu is run in a
+#    pseudo terminal, and timed from starting python until its title is written, which happens
+#    when the first frame is flushed (see deps/render.py). This includes loading the templates.
+#
+# Each startup is run in a new python process, a few times, and the fastest run is used so
+# that the first run compiling ./scripts/__pycache__ doesn't count.
+#
+# Run it from a checkout on the machine the menu runs on, such as a Raspberry Pi, after adding
+# an import to a menu or to a module in ./scripts/deps. It isn't run by CI, the times depend on
+# the machine. It needs a pseudo terminal for the first frame, so Linux or macOS.
+#
+# Usage:
+#  python3 ./scripts/development/check_import_time.py
+#  python3 ./scripts/development/check_import_time.py --budget-ms 1500 --frame-budget-ms 3000 --show 20
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+# What each menu imports before its first frame. The main menu also creates the terminal.
+startupImports = {
+  "Main menu": "import menu_main",
+  "Build stack menu": "import buildstack_menu, deps.buildstack, deps.issue_checker, deps.template_filter, deps.render",
+  "Command menus": "import docker_commands, misc_commands, backup_restore, native_installs, deps.menu_engine"
+}
+
+# Imported the first time they're used, never at startup
+lazyModules = ["ruamel", "ruamel.yaml", "deps.yaml_merge", "deps.hook_worker", "multiprocessing", "deps.docker_api", "http.client"]
+
+# How each menu is started to time its first frame, and text that's only drawn once it is
+firstFrameStartups = {
+  "Main menu": ("import runpy; runpy.run_path('./scripts/menu_main.py', run_name='__main__')", "IOTstack Main Menu"),
+  "Build stack menu": ("import buildstack_menu; buildstack_menu.main('latin')", "IOTstack Build Menu"),
+  "Command menus": ("import misc_commands; misc_commands.main('latin')", "IOTstack Miscellaneous Commands")
+}
+firstFrameTimeout = 30 # Seconds
+terminalSize = (50, 160) # Rows and columns of the pseudo terminal
+
+def parseArguments():
+  parser = argparse.ArgumentParser(description="Check the menus' startup imports against a time budget.")
+  parser.add_argument("--budget-ms", type=float, default=500, help="Most time the imports of each startup may take, in milliseconds.")
+  parser.add_argument("--frame-budget-ms", type=float, default=2000, help="Most time each menu may take to draw its first frame, in milliseconds.")
+  parser.add_argument("--no-frame", action="store_true", help="Only check the imports, without running the menus.")
+  parser.add_argument("--repeat", type=int, default=3, help="Number of times to run each startup. The fastest is used.")
+  parser.add_argument("--show", type=int, default=10, help="Number of slowest imports to list for each startup.")
+  return parser.parse_args()
+
+def parseImportTimes(importTimeOutput):
+  # Returns [(moduleName, selfUs, cumulativeUs, depth)] from -X importtime's output
+  importTimes = []
+  for line in importTimeOutput.splitlines():
+    if not line.startswith("import time:") or "self [us]" in line:
+      continue
+    selfUs, cumulativeUs, moduleName = line[len("import time:"):].split("|")
+    depth = (len(moduleName) - len(moduleName.lstrip(" ")) - 1) // 2
+    importTimes.append((moduleName.strip(), int(selfUs), int(cumulativeUs), depth))
+  return importTimes
+
+def runStartup(importCode):
+  code = "import sys; sys.path.insert(0, './scripts'); " + importCode
+  environment = dict(os.environ, TERM=os.environ.get("TERM", "xterm-256color"))
+  startupProcess = subprocess.run([sys.executable, "-X", "importtime", "-c", code], stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, env=environment)
+  importTimeOutput = startupProcess.stderr.decode("utf-8", "replace")
+  if not startupProcess.returncode == 0:
+    raise RuntimeError(importTimeOutput.strip().splitlines()[-1])
+  return parseImportTimes(importTimeOutput)
+
+def timeFirstFrame(runCode, firstFrameText):
+  # Returns the milliseconds from starting python until firstFrameText was written to the terminal
+  import pty
+  import fcntl
+  import struct
+  import select
+  import signal
+  import termios
+  code = "import sys; sys.path.insert(0, './scripts'); " + runCode
+  startTime = time.perf_counter()
+  (pid, terminalFd) = pty.fork()
+  if pid == 0: # The menu, in the pseudo terminal
+    os.environ["TERM"] = os.environ.get("TERM", "xterm-256color")
+    os.environ["LINES"] = str(terminalSize[0])
+    os.environ["COLUMNS"] = str(terminalSize[1])
+    os.execv(sys.executable, [sys.executable, "-c", code])
+  fcntl.ioctl(terminalFd, termios.TIOCSWINSZ, struct.pack("HHHH", terminalSize[0], terminalSize[1], 0, 0))
+  output = b""
+  try:
+    while time.perf_counter() - startTime < firstFrameTimeout:
+      if len(select.select([terminalFd], [], [], 0.05)[0]) == 0:
+        continue
+      try:
+        data = os.read(terminalFd, 65536)
+      except OSError: # The menu exited
+        data = b""
+      if len(data) == 0:
+        break
+      output += data
+      for i in range(data.count(b"\x1b[6n")): # Answer the terminal's cursor position queries
+        os.write(terminalFd, b"\x1b[1;1R")
+      if firstFrameText.encode("utf-8") in output:
+        return (time.perf_counter() - startTime) * 1000
+  finally:
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+    os.close(terminalFd)
+  lastLines = output.decode("utf-8", "replace").strip().splitlines()
+  raise RuntimeError(lastLines[-1] if len(lastLines) > 0 else "No first frame after {timeout} seconds".format(timeout=firstFrameTimeout))
+
+def checkFirstFrame(startupName, args):
+  # Returns a list of problems found
+  (runCode, firstFrameText) = firstFrameStartups[startupName]
+  fastestMs = min(timeFirstFrame(runCode, firstFrameText) for i in range(args.repeat))
+  print("  First frame: {ms:.1f} ms".format(ms=fastestMs))
+  if fastestMs > args.frame_budget_ms:
+    return ["{name}: the first frame took {ms:.1f} ms, the budget is {budget:.0f} ms".format(name=startupName, ms=fastestMs, budget=args.frame_budget_ms)]
+  return []
+
+def checkStartup(startupName, importCode, args):
+  # Returns a list of problems found
+  fastestTimes = None
+  fastestTotal = None
+  for i in range(args.repeat):
+    importTimes = runStartup(importCode)
+    totalUs = sum(cumulativeUs for (moduleName, selfUs, cumulativeUs, depth) in importTimes if depth == 0)
+    if fastestTotal == None or totalUs < fastestTotal:
+      fastestTimes = importTimes
+      fastestTotal = totalUs
+
+  print("{name}: {ms:.1f} ms ({count} modules)".format(name=startupName, ms=fastestTotal / 1000, count=len(fastestTimes)))
+  for (moduleName, selfUs, cumulativeUs, depth) in sorted(fastestTimes, key=lambda importTime: -importTime[1])[:args.show]:
+    print("  {ms:8.1f} ms  {name}".format(ms=selfUs / 1000, name=moduleName))
+
+  problems = []
+  importedModules = set(moduleName for (moduleName, selfUs, cumulativeUs, depth) in fastestTimes)
+  for lazyModule in lazyModules:
+    if lazyModule in importedModules:
+      problems.append("{name}: '{module}' is imported at startup".format(name=startupName, module=lazyModule))
+  if fastestTotal / 1000 > args.budget_ms:
+    problems.append("{name}: imports took {ms:.1f} ms, the budget is {budget:.0f} ms".format(name=startupName, ms=fastestTotal / 1000, budget=args.budget_ms))
+  return problems
+
+def main():
+  os.chdir(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+  args = parseArguments()
+  problems = []
+  for (startupName, importCode) in startupImports.items():
+    try:
+      problems += checkStartup(startupName, importCode, args)
+    except RuntimeError as err:
+      problems.append("{name}: failed to import: {err}".format(name=startupName, err=err))
+    if not args.no_frame and startupName in firstFrameStartups:
+      try:
+        problems += checkFirstFrame(startupName, args)
+      except RuntimeError as err:
+        problems.append("{name}: failed to draw its first frame: {err}".format(name=startupName, err=err))
+    print("")
+
+  if len(problems) > 0:
+    for problem in problems:
+      print("FAIL", problem)
+    sys.exit(1)
+  print("OK, all startups within {budget:.0f} ms".format(budget=args.budget_ms))
+  if not args.no_frame:
+    print("OK, all first frames within {budget:.0f} ms".format(budget=args.frame_budget_ms))
+
+if __name__ == '__main__':
+  main()
@@ -1,34 +1,32 @@
 #!/usr/bin/python3
-from blessed import Terminal
+from deps.render import getTerminal
 import sys
 import subprocess
 import os
 import time
-import types
 import signal
+import importlib
 from deps.chars import specialChars
+from deps.menu_engine import Menu, fullRender
 from deps.version_check import checkVersion
+from deps.startup_probes import StartupProbes
 
-term = Terminal()
+term = getTerminal()
 
 # Settings/Consts
 requiredDockerVersion = "18.2.0"
 
 # Vars
-selectionInProgress = True
-currentMenuItemIndex = 0
-menuNavigateDirection = 0
 projectStatusPollRateRefresh = 1
 promptFiles = False
 buildComplete = None
-hotzoneLocation = [((term.height // 16) + 6), 0]
-screenActive = True
+mainMenu = None # The Menu, see deps/menu_engine.py
 
   # Render Modes:
   #  0 = No render needed
   #  1 = Full render
   #  2 = Hotzone only
-needsRender = 1
+needsRender = 0
 
 def checkRenderOptions():
   global term
@@ -78,126 +76,48 @@ def checkRenderOptions():
         return "ascii"
 
 
-def onResize(sig, action):
-  global needsRender
-  global mainMenuList
-  global currentMenuItemIndex
-  global screenActive
-  if screenActive:
-    mainRender(1, mainMenuList, currentMenuItemIndex)
-
 # Menu Functions
 def exitMenu():
   print("Exiting IOTstack menu.")
   print(term.clear())
   sys.exit(0)
 
+def runSubmenu(moduleName):
+  # Submenus are imported the first time they're opened, and stay loaded in sys.modules.
+  # Python keeps their compiled code in ./scripts/__pycache__ between runs.
+  submenu = importlib.import_module(moduleName)
+  result = submenu.main(renderMode)
+  signal.signal(signal.SIGWINCH, mainMenu.onResize) # Not every submenu puts back the handler it replaced
+  return result
+
 def buildStack():
   global buildComplete
-  global needsRender
-  global screenActive
-  
   buildComplete = None
-  buildstackFilePath = "./scripts/buildstack_menu.py"
-  with open(buildstackFilePath, "rb") as pythonDynamicImportFile:
-    code = compile(pythonDynamicImportFile.read(), buildstackFilePath, "exec")
-  execGlobals = {
-    "renderMode": renderMode
-  }
-  execLocals = {}
-  screenActive = False
   print(term.clear())
-  exec(code, execGlobals, execLocals)
-  buildComplete = execGlobals["results"]["buildState"]
-  signal.signal(signal.SIGWINCH, onResize)
-  screenActive = True
-  needsRender = 1
+  buildComplete = runSubmenu("buildstack_menu")
 
 def runExampleMenu():
+  from deps.hook_loader import loadHookCode
   exampleMenuFilePath = "./.templates/example_template/example_build.py"
-  with open(exampleMenuFilePath, "rb") as pythonDynamicImportFile:
-    code = compile(pythonDynamicImportFile.read(), exampleMenuFilePath, "exec")
-  # execGlobals = globals()
+  # Templates are run as scripts with their globals set, the same as from the build stack menu
   execGlobals = {
-    "renderMode": renderMode
+    "renderMode": renderMode,
+    "currentServiceName": 'SERVICENAME',
+    "toRun": 'runOptionsMenu'
   }
-  execLocals = locals()
-  execGlobals["currentServiceName"] = 'SERVICENAME'
-  execGlobals["toRun"] = 'runOptionsMenu'
-  screenActive = False
-  exec(code, execGlobals, execLocals)
-  signal.signal(signal.SIGWINCH, onResize)
-  screenActive = True
+  exec(loadHookCode(exampleMenuFilePath), execGlobals, {})
 
 def dockerCommands():
-  global needsRender
-  dockerCommandsFilePath = "./scripts/docker_commands.py"
-  with open(dockerCommandsFilePath, "rb") as pythonDynamicImportFile:
-    code = compile(pythonDynamicImportFile.read(), dockerCommandsFilePath, "exec")
-  # execGlobals = globals()
-  # execLocals = locals()
-  execGlobals = {
-    "renderMode": renderMode
-  }
-  execLocals = {}
-  screenActive = False
-  exec(code, execGlobals, execLocals)
-  signal.signal(signal.SIGWINCH, onResize)
-  screenActive = True
-  needsRender = 1
+  runSubmenu("docker_commands")
 
 def miscCommands():
-  global needsRender
-  dockerCommandsFilePath = "./scripts/misc_commands.py"
-  with open(dockerCommandsFilePath, "rb") as pythonDynamicImportFile:
-    code = compile(pythonDynamicImportFile.read(), dockerCommandsFilePath, "exec")
-  # execGlobals = globals()
-  # execLocals = locals()
-  execGlobals = {
-    "renderMode": renderMode
-  }
-  execLocals = {}
-  screenActive = False
-  exec(code, execGlobals, execLocals)
-  signal.signal(signal.SIGWINCH, onResize)
-  screenActive = True
-  needsRender = 1
+  runSubmenu("misc_commands")
 
 def nativeInstalls():
-  global needsRender
-  global screenActive
-  dockerCommandsFilePath = "./scripts/native_installs.py"
-  with open(dockerCommandsFilePath, "rb") as pythonDynamicImportFile:
-    code = compile(pythonDynamicImportFile.read(), dockerCommandsFilePath, "exec")
-  # currGlobals = globals()
-  # currLocals = locals()
-  execGlobals = {
-    "renderMode": renderMode
-  }
-  execLocals = {}
-  screenActive = False
-  exec(code, execGlobals, execLocals)
-  signal.signal(signal.SIGWINCH, onResize)
-  screenActive = True
-  needsRender = 1
+  runSubmenu("native_installs")
 
 def backupAndRestore():
-  global needsRender
-  global screenActive
-  dockerCommandsFilePath = "./scripts/backup_restore.py"
-  with open(dockerCommandsFilePath, "rb") as pythonDynamicImportFile:
-    code = compile(pythonDynamicImportFile.read(), dockerCommandsFilePath, "exec")
-  # currGlobals = globals()
-  # currLocals = locals()
-  execGlobals = {
-    "renderMode": renderMode
-  }
-  execLocals = {}
-  screenActive = False
-  exec(code, execGlobals, execLocals)
-  signal.signal(signal.SIGWINCH, onResize)
-  screenActive = True
-  needsRender = 1
+  runSubmenu("backup_restore")
 
 def doNothing():
   selectionInProgress = True
@@ -226,15 +146,29 @@ def installDocker():
   installDockerProcess.wait()
   installDockerResult, stdError = installDockerProcess.communicate()
   installDockerResult = installDockerResult.decode("utf-8").rstrip()
+  startupProbes.rerun("dockerVersion")
 
   return installDockerResult
 
+def updateProject():
+  # The same as update_project in menu.sh
+  print(term.clear())
+  currentBranch = startupProbes.getResults()["projectUpdate"]["result"]["branch"]
+  print("Update IOTstack: git pull origin {branch}".format(branch=currentBranch))
+  subprocess.call(["git", "pull", "origin", currentBranch])
+  subprocess.call(["git", "status"])
+  print("")
+  print("Restart the menu to use the updated version.")
+  input("Process terminated. Press [Enter] to show menu and continue.")
+  startupProbes.rerun("projectUpdate")
+
 def upgradeDocker():
   print("Upgrade Docker: sudo apt upgrade docker docker-compose")
   upgradeDockerProcess = subprocess.Popen(['sudo', 'bash', './install_docker.sh', 'upgrade'], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
   upgradeDockerProcess.wait()
   upgradeDockerResult, stdError = upgradeDockerProcess.communicate()
   upgradeDockerResult = upgradeDockerResult.decode("utf-8").rstrip()
+  startupProbes.rerun("dockerVersion")
 
   return upgradeDockerResult
 
@@ -253,7 +187,7 @@ mainMenuList = baseMenu
 
 potentialMenu = {
   "projectUpdate": {
-    "menuItem": ["Update IOTstack", installDocker],
+    "menuItem": ["Update IOTstack", updateProject],
     "added": False
   },
   "dockerUpdate": { # TODO: Do note use, fix shell issues first
@@ -290,27 +224,6 @@ potentialMenu = {
   }
 }
 
-def checkDockerVersion():
-  try:
-    getDockerVersion = subprocess.Popen(['docker', 'version', '-f', '"{{.Server.Version}}"'], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-    getDockerVersion.wait()
-    currentDockerVersion, stdError = getDockerVersion.communicate()
-    currentDockerVersion = currentDockerVersion.decode("utf-8").rstrip().replace('"', '')
-  except Exception as err:
-    print("Error attempting to run docker command:", err)
-    currentDockerVersion = ""
-
-  return checkVersion(requiredDockerVersion, currentDockerVersion)
-
-def checkProjectUpdates():
-  getCurrentBranch = subprocess.Popen(["git", "name-rev", "--name-only", "HEAD"], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-  getCurrentBranch.wait()
-  currentBranch, stdError = getCurrentBranch.communicate()
-  currentBranch = currentBranch.decode("utf-8").rstrip()
-  projectStatus = subprocess.Popen(["git", "fetch", "origin", currentBranch], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-
-  return projectStatus
-
 def addPotentialMenuItem(menuItemName, hasSpacer=True):
   if (potentialMenu["newLine"]["added"] == False):
     potentialMenu["newLine"]["added"] = True
@@ -333,8 +246,11 @@ def removeMenuItemByLabel(potentialItemKey):
     if menuItem[0] == potentialMenu[potentialItemKey]["menuItem"][0]:
       potentialMenu[potentialItemKey]["added"] = False
       mainMenuList.pop(i)
+      return True
+  return False
 
-def doPotentialMenuCheck(projectStatus, dockerVersion=True, promptFiles=False):
+def doPotentialMenuCheck(probeResults, promptFiles=False):
+  # probeResults are the startup probes that have finished so far, see deps/startup_probes.py
   global needsRender
 
   if (promptFiles == True):
@@ -343,27 +259,33 @@ def doPotentialMenuCheck(projectStatus, dockerVersion=True, promptFiles=False):
   else:
     removeMenuItemByLabel("deletePromptFiles")
 
-  # if (projectStatus.poll() == None):
-  #   addPotentialMenuItem("updatesCheck", False)
-  #   needsRender = 2
-  # else:
-  #   removeMenuItemByLabel("updatesCheck")
-
-  # if (projectStatus.poll() == 1):
-  #   added = addPotentialMenuItem("projectUpdate")
-  #   projectStatusPollRateRefresh = None
-  #   if (added):
-  #     needsRender = 1
-
-  # if (projectStatus.poll() == 0):
-  #   added = addPotentialMenuItem("noProjectUpdate")
-  #   projectStatusPollRateRefresh = None
-  #   if (added):
-  #     needsRender = 1
-
-  if (dockerVersion == False):
-    added = addPotentialMenuItem("dockerNotUpdated")
-    if (added):
+  if not "projectUpdate" in probeResults:
+    if addPotentialMenuItem("updatesCheck", False):
+      needsRender = 1
+  else:
+    if removeMenuItemByLabel("updatesCheck"):
+      needsRender = 1
+    projectUpdate = probeResults["projectUpdate"]["result"]
+    if not projectUpdate == None: # Not shown if git fetch failed, such as when offline
+      if projectUpdate["updateAvailable"]:
+        removeMenuItemByLabel("noProjectUpdate")
+        if addPotentialMenuItem("projectUpdate"):
+          needsRender = 1
+      else:
+        removeMenuItemByLabel("projectUpdate")
+        if addPotentialMenuItem("noProjectUpdate"):
+          needsRender = 1
+
+  if "dockerVersion" in probeResults:
+    currentDockerVersion = ""
+    if not probeResults["dockerVersion"]["result"] == None:
+      currentDockerVersion = probeResults["dockerVersion"]["result"]["version"]
+    dockerVersionGood, reason, data = checkVersion(requiredDockerVersion, currentDockerVersion)
+    if (dockerVersionGood == False):
+      added = addPotentialMenuItem("dockerNotUpdated")
+      if (added):
+        needsRender = 1
+    elif removeMenuItemByLabel("dockerNotUpdated"): # Upgraded since it was shown
       needsRender = 1
 
 def checkIfPromptFilesExist():
@@ -375,93 +297,49 @@ def checkIfPromptFilesExist():
     return True
   return False
 
-def renderHotZone(term, menu, selection):
-  print(term.move(hotzoneLocation[0], hotzoneLocation[1]))
-  for (index, menuItem) in enumerate(menu):
-    if index == selection:
-      print(term.center('-> {t.blue_on_green}{title}{t.normal} <-'.format(t=term, title=menuItem[0])))
-    else:
-      print(term.center('{title}'.format(t=term, title=menuItem[0])))
-
-def mainRender(needsRender, menu, selection):
-  term = Terminal()
-  if needsRender == 1:
-    print(term.clear())
-    print(term.move_y(term.height // 16))
-    print(term.black_on_cornsilk4(term.center('IOTstack Main Menu')))
-    print("")
-
-  if needsRender >= 1:
-    renderHotZone(term, menu, selection)
-
-  if (buildComplete and needsRender == 1):
-    print("")
-    print("")
-    print("")
-    print(term.center('{t.blue_on_green} {text} {t.normal}{t.white_on_black}{cPath} {t.normal}'.format(t=term, text="Build completed:", cPath=" ./docker-compose.yml")))
-    print(term.center('{t.white_on_black}{text}{t.blue_on_green2} {commandString} {t.normal}'.format(t=term, text="You can start the stack from the Docker Commands menu, or from the CLI with: ", commandString="docker-compose up -d")))
-    if os.path.exists('./compose-override.yml'):
-      print("")
-      print(term.center('{t.grey_on_blue4} {text} {t.normal}{t.white_on_black}{t.normal}'.format(t=term, text="'compose-override.yml' was merged into 'docker-compose.yml'")))
-    print("")
-
-def runSelection(selection):
+def getBuildCompleteLines():
+  # Shown below the main menu's items after a build
+  if not buildComplete:
+    return []
+  statusLines = [None, None, None]
+  statusLines.append(term.center('{t.blue_on_green} {text} {t.normal}{t.white_on_black}{cPath} {t.normal}'.format(t=term, text="Build completed:", cPath=" ./docker-compose.yml")))
+  statusLines.append(term.center('{t.white_on_black}{text}{t.blue_on_green2} {commandString} {t.normal}'.format(t=term, text="You can start the stack from the Docker Commands menu, or from the CLI with: ", commandString="docker-compose up -d")))
+  if os.path.exists('./compose-override.yml'):
+    statusLines.append(None)
+    statusLines.append(term.center('{t.grey_on_blue4} {text} {t.normal}{t.white_on_black}{t.normal}'.format(t=term, text="'compose-override.yml' was merged into 'docker-compose.yml'")))
+  statusLines.append(None)
+  return statusLines
+
+def pollMainMenu():
+  # Adds and removes the update notices as the startup probes finish
+  global promptFiles
   global needsRender
-  if len(mainMenuList[selection]) > 1 and isinstance(mainMenuList[selection][1], types.FunctionType):
-    mainMenuList[selection][1]()
-    needsRender = 1
-  else:
-    print(term.green_reverse('IOTstack Error: No function assigned to menu item: "{}"'.format(mainMenuList[selection][0])))
-
-def isMenuItemSelectable(menu, index):
-  if len(menu) > index:
-    if len(menu[index]) > 2:
-      if menu[index][2]["skip"] == True:
-        return False
-  return True
+  if (promptFiles):
+    promptFiles = checkIfPromptFilesExist()
+  doPotentialMenuCheck(probeResults=startupProbes.getResults(), promptFiles=promptFiles)
+  if needsRender == 1:
+    mainMenu.needsRender = fullRender
+  elif needsRender == 2:
+    mainMenu.refreshRows()
+  needsRender = 0
 
 # Entrypoint
 if __name__ == '__main__':
-  projectStatus = checkProjectUpdates() # Async
-  dockerVersion, reason, data = checkDockerVersion()
+  startupProbes = StartupProbes().start() # Docker version and IOTstack update checks, run in the background
   promptFiles = checkIfPromptFilesExist()
-  term = Terminal()
+  term = getTerminal()
   
-  signal.signal(signal.SIGWINCH, onResize)
-
   with term.fullscreen():
     checkRenderOptions()
-    mainRender(needsRender, mainMenuList, currentMenuItemIndex) # Initial Draw
-    with term.cbreak():
-      while selectionInProgress:
-        menuNavigateDirection = 0
-        if (promptFiles):
-          promptFiles = checkIfPromptFilesExist()
-
-        if needsRender > 0: # Only rerender when changed to prevent flickering
-          mainRender(needsRender, mainMenuList, currentMenuItemIndex)
-          needsRender = 0
-
-        doPotentialMenuCheck(projectStatus=projectStatus, dockerVersion=dockerVersion, promptFiles=promptFiles)
-        
-        key = term.inkey(timeout=projectStatusPollRateRefresh)
-        if key.is_sequence:
-          if key.name == 'KEY_TAB':
-            menuNavigateDirection = 1
-          if key.name == 'KEY_DOWN':
-            menuNavigateDirection = 1
-          if key.name == 'KEY_UP':
-            menuNavigateDirection = -1
-          if key.name == 'KEY_ENTER':
-            runSelection(currentMenuItemIndex)
-          if key.name == 'KEY_ESCAPE':
-            exitMenu()
-        
-        if not menuNavigateDirection == 0: # If a direction was pressed, find next selectable item
-          currentMenuItemIndex += menuNavigateDirection
-          currentMenuItemIndex = currentMenuItemIndex % len(mainMenuList)
-          needsRender = 2
-
-          while not isMenuItemSelectable(mainMenuList, currentMenuItemIndex):
-            currentMenuItemIndex += menuNavigateDirection
-            currentMenuItemIndex = currentMenuItemIndex % len(mainMenuList)
+    mainMenu = Menu(
+      'IOTstack Main Menu',
+      mainMenuList,
+      renderMode,
+      boxed=False,
+      headerPadding=4,
+      statusLines=getBuildCompleteLines,
+      onPoll=pollMainMenu,
+      pollInterval=projectStatusPollRateRefresh
+    )
+    mainMenu.run()
+  exitMenu() # [Escape] closes the main menu
@@ -1,6 +1,7 @@
 import sys
 import traceback
 import ruamel.yaml
+from deps.yaml_merge import mergeYaml, splitMergeStrategies
 
 yaml = ruamel.yaml.YAML()
 yaml.preserve_quotes = True
@@ -29,30 +30,14 @@ try:
   pathOverride = sys.argv[2]
   pathOutput = sys.argv[3]
 
-  def mergeYaml(priorityYaml, defaultYaml):
-    finalYaml = {}
-    if isinstance(defaultYaml, dict):
-      for dk, dv in defaultYaml.items():
-        if dk in priorityYaml:
-          finalYaml[dk] = mergeYaml(priorityYaml[dk], dv)
-        else:
-          finalYaml[dk] = dv
-      for pk, pv in priorityYaml.items():
-        if pk in finalYaml:
-          finalYaml[pk] = mergeYaml(finalYaml[pk], pv)
-        else:
-          finalYaml[pk] = pv
-    else:
-      finalYaml = defaultYaml
-    return finalYaml
-
   with open(r'%s' % pathTempDockerCompose) as fileTempDockerCompose:
     yamlTempDockerCompose = yaml.load(fileTempDockerCompose)
 
   with open(r'%s' % pathOverride) as fileOverride:
     yamlOverride = yaml.load(fileOverride)
 
-  mergedYaml = mergeYaml(yamlOverride, yamlTempDockerCompose)
+  yamlOverride, mergeStrategies = splitMergeStrategies(yamlOverride)
+  mergedYaml = mergeYaml(yamlOverride, yamlTempDockerCompose, mergeStrategies)
 
   with open(r'%s' % pathOutput, 'w') as outputFile:
     yaml.dump(mergedYaml, outputFile, explicit_start=True, default_style='"')